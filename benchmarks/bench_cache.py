@@ -0,0 +1,114 @@
+"""
+Benchmark the overhead record() adds to each cache operation, for direct
+calls and for calls like get_or_set() that call other cache methods
+internally, and the check for such internal calls on its own, against the
+stack inspection previously used.
+
+Run with:
+
+    python benchmarks/bench_cache.py [--number N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import inspect
+import timeit
+from collections.abc import Callable
+from contextvars import ContextVar
+from functools import partial
+from typing import Any
+
+import django
+from django.conf import settings
+
+from django_perf_rec.cache import AllCacheRecorder
+
+
+def configure() -> None:
+    settings.configure(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    django.setup()
+
+
+def time_per_op(func: Callable[[], object], number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def is_internal_call_inspect(cache: Any) -> bool:
+    frame = inspect.currentframe()
+    assert frame is not None
+    try:
+        frame = frame.f_back
+        return frame is not None and frame.f_locals.get("self", None) is cache
+    finally:
+        del frame
+
+
+calling: ContextVar[bool] = ContextVar("calling", default=False)
+
+
+def is_internal_call_contextvar(cache: Any) -> bool:
+    return calling.get()
+
+
+def call_check(self: Any, check: Callable[[Any], bool]) -> bool:
+    # Stands in for a cache method, with a few locals
+    key = "key"
+    version = None
+    return check(self) and key is not version
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    configure()
+    from django.core.cache import caches
+
+    # The instance, rather than the django.core.cache.cache proxy, whose
+    # lookups would swamp the overhead being measured
+    cache = caches["default"]
+    cache.set("key", "value")
+    many_keys = [f"user:{i}:profile" for i in range(500)]
+    # Each with the number of calls to time, fewer for slower operations
+    operations: dict[str, tuple[Callable[[], object], int]] = {
+        "get": (lambda: cache.get("key"), args.number),
+        "set": (lambda: cache.set("key", "value"), args.number),
+        "get_or_set": (lambda: cache.get_or_set("key", "value"), args.number),
+        "get_many of 500 keys": (
+            lambda: cache.get_many(many_keys),
+            max(args.number // 500, 1),
+        ),
+    }
+
+    for name, (func, number) in operations.items():
+        plain = time_per_op(func, number, args.repeat)
+        with AllCacheRecorder(lambda op: None):
+            recorded = time_per_op(func, number, args.repeat)
+        overhead = recorded - plain
+        print(
+            f"{name}: {plain * 1e6:.2f}us plain, {recorded * 1e6:.2f}us recorded, "
+            + f"{overhead * 1e6:.2f}us overhead per operation"
+        )
+
+    cache_self = object()
+    for name, check in (
+        ("stack inspection", is_internal_call_inspect),
+        ("context variable", is_internal_call_contextvar),
+    ):
+        per_check = time_per_op(
+            partial(call_check, cache_self, check), args.number, args.repeat
+        )
+        print(f"Internal call check by {name}: {per_check * 1e9:.0f}ns")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""
+Benchmark loading and saving a large performance file with the pure Python
+and libyaml YAML implementations.
+
+Run with:
+
+    python benchmarks/bench_yaml.py [--records N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+import yaml
+from django.conf import settings
+
+from django_perf_rec.storage import HAVE_LIBYAML, dump_yaml, load_yaml
+from django_perf_rec.yaml import KVFile
+
+
+def make_data(records: int) -> dict[str, list[dict[str, str]]]:
+    return {
+        f"AuthorTests.test_{i}": [
+            {"db": f'SELECT ... FROM "testapp_author" WHERE "id" = # LIMIT {i}'},
+            {"db|replica": 'SELECT ... FROM "testapp_book" WHERE "author_id" IN (...)'},
+            {"cache|get": f"author.{i}.#"},
+            {"cache|set": f"author.{i}.#"},
+        ]
+        for i in range(records)
+    }
+
+
+def dump_pure(data: object) -> str:
+    return yaml.dump(
+        data,
+        Dumper=yaml.SafeDumper,
+        default_flow_style=False,
+        allow_unicode=True,
+        width=10000,
+    )
+
+
+def dump_fast(data: object) -> str:
+    stream = io.StringIO()
+    dump_yaml(data, stream)
+    return stream.getvalue()
+
+
+def report(name: str, pure: float, fast: float) -> None:
+    print(f"{name}: pure Python {pure:.3f}s, django-perf-rec {fast:.3f}s", end="")
+    print(f" ({pure / fast:.1f}x)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    settings.configure()
+    print(f"libyaml available: {HAVE_LIBYAML}")
+    data = make_data(args.records)
+    content = dump_pure(data)
+    print(f"File size: {len(content.encode()) / 1_000_000:.1f}MB")
+
+    if dump_fast(data) != content:
+        print("Output differs from the pure Python dumper!", file=sys.stderr)
+        return 1
+
+    pure = min(
+        timeit.repeat(lambda: yaml.safe_load(content), number=1, repeat=args.repeat)
+    )
+    fast = min(timeit.repeat(lambda: load_yaml(content), number=1, repeat=args.repeat))
+    report("Load", pure, fast)
+
+    pure = min(timeit.repeat(lambda: dump_pure(data), number=1, repeat=args.repeat))
+    fast = min(timeit.repeat(lambda: dump_fast(data), number=1, repeat=args.repeat))
+    report("Dump", pure, fast)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_name = os.path.join(temp_dir, "bench.perf.yml")
+        with open(file_name, "w") as fp:
+            fp.write(content)
+
+        def kvfile_load() -> None:
+            KVFile._clear_load_cache()
+            KVFile(file_name)
+
+        fast = min(timeit.repeat(kvfile_load, number=1, repeat=args.repeat))
+        print(f"KVFile load: {fast:.3f}s")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -12,13 +12,26 @@ if _HAVE_PYTEST:
 
 from django_perf_rec.api import (
     TestCaseMixin,  # noqa: E402
+    flush,
     get_perf_path,
     get_record_name,
     record,
 )
+from django_perf_rec.budget import budget
+from django_perf_rec.nplusone import NPlusOneWarning, detect_n_plus_one
+from django_perf_rec.redundant_cache import (
+    RedundantCacheOpWarning,
+    detect_redundant_cache_ops,
+)
 
 __all__ = [
+    "NPlusOneWarning",
+    "RedundantCacheOpWarning",
     "TestCaseMixin",
+    "budget",
+    "detect_n_plus_one",
+    "detect_redundant_cache_ops",
+    "flush",
     "get_record_name",
     "get_perf_path",
     "record",
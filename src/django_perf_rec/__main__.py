@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from collections.abc import Iterator, Sequence
+
+from django_perf_rec.report import (
+    DirectorySource,
+    GitSource,
+    Report,
+    compare,
+    write_json,
+    write_text,
+)
+from django_perf_rec.storage import (
+    backends,
+    compressors,
+    convert,
+    detect_storage,
+    get_extension,
+    is_perf_file,
+)
+from django_perf_rec.yaml import KVFile, get_journal_path
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m django_perf_rec")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Convert performance files to another storage format.",
+    )
+    convert_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Performance files, or directories to search for them.",
+    )
+    convert_parser.add_argument(
+        "--to",
+        dest="storage",
+        choices=sorted(backends),
+        default="yaml",
+        help="The storage format to convert to.",
+    )
+    convert_parser.add_argument(
+        "--compression",
+        choices=sorted(compressors),
+        default=None,
+        help="Compress the converted files.",
+    )
+    convert_parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the original files, rather than deleting them.",
+    )
+
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Fold the journals of the 'journal' WRITE_MODE into their files.",
+    )
+    compact_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Performance files, or directories to search for them.",
+    )
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help=(
+            "Report the changes to records between two git revisions, or two "
+            + "directories of performance files."
+        ),
+    )
+    diff_parser.add_argument(
+        "old",
+        help="The git revision, or directory, to compare from.",
+    )
+    diff_parser.add_argument(
+        "new",
+        help="The git revision, or directory, to compare to.",
+    )
+    diff_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="With git revisions, only compare performance files within these paths.",
+    )
+    diff_parser.add_argument(
+        "--format",
+        choices=["json", "text"],
+        default="text",
+        help="The report format.",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        if args.storage == "sqlite" and args.compression is not None:
+            convert_parser.error("SQLite files can't be compressed.")
+        return convert_command(args.paths, args.storage, args.compression, args.keep)
+    elif args.command == "compact":
+        return compact_command(args.paths)
+    elif args.command == "diff":
+        if os.path.isdir(args.old) and os.path.isdir(args.new):
+            if args.paths:
+                diff_parser.error("Paths can only be given with git revisions.")
+            return diff_command(
+                DirectorySource(args.old), DirectorySource(args.new), args.format
+            )
+        return diff_command(
+            GitSource(args.old, args.paths),
+            GitSource(args.new, args.paths),
+            args.format,
+        )
+    raise AssertionError(f"Unhandled command {args.command}")  # pragma: no cover
+
+
+def find_perf_files(paths: Sequence[str]) -> Iterator[str]:
+    """
+    Yield the performance files within the given paths, in a stable order.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith(journal_suffix):
+                        file_name = file_name[: -len(journal_suffix)]
+                        if file_name in file_names:
+                            # Found alongside its performance file
+                            continue
+                    if is_perf_file(file_name):
+                        yield os.path.join(dir_path, file_name)
+        else:
+            yield path
+
+
+journal_suffix = get_journal_path("")
+
+
+def strip_perf_extension(file_name: str) -> str:
+    root, extension = os.path.splitext(file_name)
+    if extension in {c.extension for c in compressors.values()}:
+        root, extension = os.path.splitext(root)
+    return root
+
+
+def convert_command(
+    paths: Sequence[str],
+    storage: str,
+    compression: str | None,
+    keep: bool,
+) -> int:
+    extension = get_extension(storage, compression)
+    status = 0
+    for file_name in find_perf_files(paths):
+        if detect_storage(file_name) is None:
+            print(f"Skipping {file_name}: unrecognized extension", file=sys.stderr)
+            status = 1
+            continue
+        new_file_name = strip_perf_extension(file_name) + extension
+        if new_file_name == file_name:
+            continue
+        if os.path.exists(new_file_name):
+            print(f"Skipping {file_name}: {new_file_name} exists", file=sys.stderr)
+            status = 1
+            continue
+        KVFile.compact(file_name)
+        convert(file_name, new_file_name, storage, compression)
+        if not keep:
+            os.unlink(file_name)
+        print(f"Converted {file_name} to {new_file_name}")
+    return status
+
+
+def compact_command(paths: Sequence[str]) -> int:
+    status = 0
+    for file_name in find_perf_files(paths):
+        if detect_storage(file_name) is None:
+            print(f"Skipping {file_name}: unrecognized extension", file=sys.stderr)
+            status = 1
+            continue
+        if KVFile.compact(file_name):
+            print(f"Compacted {file_name}")
+    return status
+
+
+def diff_command(
+    old_source: DirectorySource | GitSource,
+    new_source: DirectorySource | GitSource,
+    format: str,
+) -> int:
+    report = Report()
+    write = write_json if format == "json" else write_text
+    try:
+        with old_source, new_source:
+            write(report, compare(report, old_source, new_source), sys.stdout)
+    except subprocess.CalledProcessError:
+        # git has explained why on stderr
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,31 +2,59 @@ from __future__ import annotations
 
 import os
 from collections.abc import Callable
+from contextvars import ContextVar
 from functools import cache
-from threading import local
 from types import TracebackType
 
-from django_perf_rec import pytest_plugin
-from django_perf_rec.cache import AllCacheRecorder
-from django_perf_rec.db import AllDBRecorder
+from asgiref.sync import sync_to_async
+
+from django_perf_rec import prune, state
+from django_perf_rec.cache import AllCacheRecorder, CacheOp
+from django_perf_rec.db import AllDBRecorder, DBOp, ThreadDBRecorder
+from django_perf_rec.nplusone import NPlusOneDetector
 from django_perf_rec.operation import Operation
+from django_perf_rec.redundant_cache import RedundantCacheOpDetector
 from django_perf_rec.settings import perf_rec_settings
+from django_perf_rec.storage import get_extension
+from django_perf_rec.timings import timings
 from django_perf_rec.types import PerformanceRecordItem
-from django_perf_rec.utils import TestDetails, current_test, record_diff
+from django_perf_rec.utils import (
+    RecordDigest,
+    TestDetails,
+    collapse_repeats,
+    current_test,
+    expand_repeats,
+    record_diff,
+)
 from django_perf_rec.yaml import KVFile
 
 
 def get_perf_path(file_path: str) -> str:
+    extension = get_extension(perf_rec_settings.STORAGE, perf_rec_settings.COMPRESSION)
     if file_path.endswith(".py"):
-        perf_path = file_path[: -len(".py")] + ".perf.yml"
+        perf_path = file_path[: -len(".py")] + ".perf" + extension
     elif file_path.endswith(".pyc"):
-        perf_path = file_path[: -len(".pyc")] + ".perf.yml"
+        perf_path = file_path[: -len(".pyc")] + ".perf" + extension
     else:
-        perf_path = file_path + ".perf.yml"
+        perf_path = file_path + ".perf" + extension
     return perf_path
 
 
-record_current = local()
+# The file and record name of the last record() in this thread or task, and
+# how many times it has been used in a row
+record_current: ContextVar[tuple[tuple[str, str], int] | None] = ContextVar(
+    "record_current", default=None
+)
+
+
+def get_base_record_name(test_name: str, class_name: str | None = None) -> str:
+    """
+    Return the name get_record_name() gives a test's first record, before
+    any .2, .3 etc. suffix for later ones.
+    """
+    if class_name:
+        return f"{class_name}.{test_name}"
+    return test_name
 
 
 def get_record_name(
@@ -34,19 +62,17 @@ def get_record_name(
     class_name: str | None = None,
     file_name: str = "",
 ) -> str:
-    if class_name:
-        record_name = f"{class_name}.{test_name}"
-    else:
-        record_name = test_name
+    record_name = get_base_record_name(test_name, class_name)
 
     # Multiple calls inside the same test should end up suffixing with .2, .3 etc.
     record_spec = (file_name, record_name)
-    if getattr(record_current, "record_spec", None) == record_spec:
-        record_current.counter += 1
-        record_name = record_name + f".{record_current.counter}"
+    current = record_current.get()
+    if current is not None and current[0] == record_spec:
+        counter = current[1] + 1
+        record_name = record_name + f".{counter}"
     else:
-        record_current.record_spec = record_spec
-        record_current.counter = 1
+        counter = 1
+    record_current.set((record_spec, counter))
 
     return record_name
 
@@ -63,15 +89,59 @@ class PerformanceRecorder:
         self.record_name = record_name
 
         self.record: list[PerformanceRecordItem] = []
+        # Digests items as they're completed, lagging one behind the record,
+        # since the last item's repeat count may still change
+        self.record_digest = RecordDigest()
+        self.collapse_repeats = perf_rec_settings.COLLAPSE_REPEATS
+        # The last item, without any repeat count, and how often it's repeated
+        self.run_item: PerformanceRecordItem | None = None
+        self.run_count = 0
         self.db_recorder = AllDBRecorder(self.on_op)
         self.cache_recorder = AllCacheRecorder(self.on_op)
+        self.thread_db_recorder: ThreadDBRecorder | None = None
+        if perf_rec_settings.CAPTURE_THREADS:
+            self.thread_db_recorder = ThreadDBRecorder(self.on_op)
         self.capture_operation = capture_operation
         self.capture_traceback = capture_traceback
 
+        self.timed_ops: list[Operation] | None = None
+        if perf_rec_settings.TIMINGS:
+            self.timed_ops = []
+
+        self.n_plus_one_detector: NPlusOneDetector | None = None
+        threshold = perf_rec_settings.N_PLUS_ONE_THRESHOLD
+        if threshold is not None:
+            self.n_plus_one_detector = NPlusOneDetector(
+                threshold, perf_rec_settings.N_PLUS_ONE_ACTION
+            )
+
+        self.redundant_cache_op_detector: RedundantCacheOpDetector | None = None
+        redundant_cache_ops = perf_rec_settings.REDUNDANT_CACHE_OPS
+        if redundant_cache_ops is not None:
+            self.redundant_cache_op_detector = RedundantCacheOpDetector(
+                redundant_cache_ops
+            )
+
     def __enter__(self) -> None:
         self.db_recorder.__enter__()
+        if self.thread_db_recorder is not None:
+            self.thread_db_recorder.__enter__()
         self.cache_recorder.__enter__()
         self.load_recordings()
+        prune.mark_used(self.file_name, self.record_name)
+
+    async def __aenter__(self) -> None:
+        # Run where the ORM runs sync code, so the recorders wrap the same
+        # database connections as async queries use
+        await sync_to_async(self.__enter__)()
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        await sync_to_async(self.__exit__)(exc_type, exc_value, exc_traceback)
 
     def __exit__(
         self,
@@ -80,13 +150,32 @@ class PerformanceRecorder:
         exc_traceback: TracebackType | None,
     ) -> None:
         self.cache_recorder.__exit__(exc_type, exc_value, exc_traceback)
+        if self.thread_db_recorder is not None:
+            # Adds the other threads' queries after this thread's
+            self.thread_db_recorder.__exit__(exc_type, exc_value, exc_traceback)
         self.db_recorder.__exit__(exc_type, exc_value, exc_traceback)
 
+        if self.timed_ops is not None:
+            timings.add(self.file_name, self.timed_ops)
+
         if exc_type is None:
             self.save_or_assert()
+            if self.n_plus_one_detector is not None:
+                self.n_plus_one_detector.check()
+            if self.redundant_cache_op_detector is not None:
+                self.redundant_cache_op_detector.check()
 
     def on_op(self, op: Operation) -> None:
-        record = {op.name: op.query}
+        if self.timed_ops is not None:
+            # Cache operations' durations are only set after this call
+            self.timed_ops.append(op)
+
+        if self.n_plus_one_detector is not None and isinstance(op, DBOp):
+            self.n_plus_one_detector.on_op(op)
+        if self.redundant_cache_op_detector is not None and isinstance(op, CacheOp):
+            self.redundant_cache_op_detector.on_op(op)
+
+        record: PerformanceRecordItem = {op.name: op.query}
 
         if self.capture_operation and not self.capture_operation(op):
             return
@@ -94,7 +183,16 @@ class PerformanceRecorder:
         if self.capture_traceback and self.capture_traceback(op):
             record["traceback"] = op.traceback.format()
 
+        if self.collapse_repeats and record == self.run_item:
+            self.run_count += 1
+            self.record[-1] = {**record, "repeat": self.run_count}
+            return
+
+        if self.record:
+            self.record_digest.update(self.record[-1])
         self.record.append(record)
+        self.run_item = record
+        self.run_count = 1
 
     def load_recordings(self) -> None:
         self.records_file = KVFile(self.file_name)
@@ -106,13 +204,34 @@ class PerformanceRecorder:
                 f"Original performance record does not exist for {self.record_name}"
             )
 
-        if orig_record is not None and perf_rec_settings.MODE != "overwrite":
+        # Only compare whole records, and build a diff, if the digests differ
+        if self.record:
+            self.record_digest.update(self.record[-1])
+        digest = self.record_digest.hexdigest()
+        if (
+            orig_record is not None
+            and perf_rec_settings.MODE != "overwrite"
+            and digest != self.records_file.get_digest(self.record_name)
+        ):
             msg = f"Performance record did not match for {self.record_name}"
-            if not pytest_plugin.in_pytest:
-                msg += f"\n{record_diff(orig_record, self.record)}"
-            assert self.record == orig_record, msg
-
-        self.records_file.set_and_save(self.record_name, self.record)
+            if not state.in_pytest:
+                # Diff in the same representation, in case COLLAPSE_REPEATS
+                # changed since the original was recorded
+                if self.collapse_repeats:
+                    orig_for_diff = collapse_repeats(orig_record)
+                else:
+                    orig_for_diff = expand_repeats(orig_record)
+                msg += f"\n{record_diff(orig_for_diff, self.record)}"
+            # Records match whether or not repeats are collapsed
+            assert collapse_repeats(self.record) == collapse_repeats(orig_record), msg
+
+        # pytest-xdist workers leave writing files to the controller
+        if state.xdist_worker or perf_rec_settings.WRITE_MODE == "deferred":
+            self.records_file.set_deferred(self.record_name, self.record, digest)
+        elif perf_rec_settings.WRITE_MODE == "journal":
+            self.records_file.set_journaled(self.record_name, self.record, digest)
+        else:
+            self.records_file.set_and_save(self.record_name, self.record, digest)
 
         if perf_rec_settings.MODE == "all":
             assert orig_record is not None, (
@@ -163,6 +282,16 @@ def record(
     )
 
 
+def flush() -> None:
+    """
+    Write any records deferred by the 'deferred' WRITE_MODE to their files,
+    compact journals written by the 'journal' WRITE_MODE, and write timings
+    collected with the TIMINGS setting.
+    """
+    KVFile.flush()
+    timings.flush()
+
+
 class TestCaseMixin:
     """
     Adds record_performance() method to TestCase class it's mixed into
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Sequence
+from types import TracebackType
+
+from django_perf_rec.cache import AllCacheRecorder, CacheOp
+from django_perf_rec.db import AllDBRecorder
+from django_perf_rec.operation import Operation
+from django_perf_rec.sql import sql_tables
+
+# How many of the most common operations to list for each exceeded limit
+summary_size = 5
+
+
+class BudgetRecorder:
+    """
+    Counts the queries and cache operations run inside it, and fails if any
+    exceed their limits. Unlike PerformanceRecorder, nothing is read from or
+    written to performance files.
+    """
+
+    def __init__(
+        self,
+        max_queries: int | None,
+        max_cache_ops: int | dict[str, int] | None,
+        max_per_table: dict[str, int] | None,
+    ) -> None:
+        self.max_queries = max_queries
+        self.max_cache_ops = max_cache_ops
+        self.max_per_table = max_per_table
+
+        self.queries: list[Operation] = []
+        self.cache_ops: list[CacheOp] = []
+        self.db_recorder = AllDBRecorder(self.on_op)
+        self.cache_recorder = AllCacheRecorder(self.on_op)
+
+    def __enter__(self) -> BudgetRecorder:
+        self.db_recorder.__enter__()
+        self.cache_recorder.__enter__()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        self.cache_recorder.__exit__(exc_type, exc_value, exc_traceback)
+        self.db_recorder.__exit__(exc_type, exc_value, exc_traceback)
+
+        if exc_type is None:
+            self.check()
+
+    def on_op(self, op: Operation) -> None:
+        if isinstance(op, CacheOp):
+            self.cache_ops.append(op)
+        else:
+            self.queries.append(op)
+
+    def check(self) -> None:
+        failures = []
+
+        if self.max_queries is not None:
+            failures.extend(
+                limit_failure("queries", self.max_queries, self.queries),
+            )
+
+        if isinstance(self.max_cache_ops, int):
+            failures.extend(
+                limit_failure("cache operations", self.max_cache_ops, self.cache_ops)
+            )
+        elif self.max_cache_ops is not None:
+            for operation, limit in sorted(self.max_cache_ops.items()):
+                ops = [op for op in self.cache_ops if op.operation == operation]
+                failures.extend(limit_failure(f"cache {operation}", limit, ops))
+
+        if self.max_per_table is not None:
+            queries_by_table: dict[str, list[Operation]] = {}
+            for op in self.queries:
+                assert isinstance(op.query, str)
+                for table in sql_tables(op.query):
+                    queries_by_table.setdefault(table, []).append(op)
+            for table, limit in sorted(self.max_per_table.items()):
+                failures.extend(
+                    limit_failure(
+                        f"queries on {table}", limit, queries_by_table.get(table, [])
+                    )
+                )
+
+        if failures:
+            raise AssertionError("Performance budget exceeded:\n" + "\n".join(failures))
+
+
+def limit_failure(description: str, limit: int, ops: Sequence[Operation]) -> list[str]:
+    """
+    Return lines summarizing ops if there are more than limit of them,
+    grouped by name and query, most common first.
+    """
+    if len(ops) <= limit:
+        return []
+    lines = [f"  {description}: {len(ops)} > {limit}"]
+    counts = Counter((op.name, str(op.query)) for op in ops)
+    for (name, query), count in counts.most_common(summary_size):
+        lines.append(f"    {count} x {name}: {query}")
+    if len(counts) > summary_size:
+        lines.append(f"    ... and {len(counts) - summary_size} more")
+    return lines
+
+
+def budget(
+    *,
+    max_queries: int | None = None,
+    max_cache_ops: int | dict[str, int] | None = None,
+    max_per_table: dict[str, int] | None = None,
+) -> BudgetRecorder:
+    """
+    Assert that the code inside doesn't exceed the given numbers of queries,
+    cache operations in total or per operation name, or queries per table.
+    """
+    return BudgetRecorder(max_queries, max_cache_ops, max_per_table)
@@ -1,18 +1,68 @@
 from __future__ import annotations
 
-import inspect
 import re
-import traceback
-from collections.abc import Callable, Collection
+from collections.abc import Callable, Collection, Sequence
 from collections.abc import Collection as TypingCollection
-from functools import wraps
+from contextvars import ContextVar
+from functools import cache, lru_cache, wraps
 from re import Pattern
+from threading import Lock
+from time import perf_counter
+from traceback import StackSummary
 from types import MethodType, TracebackType
 from typing import Any, TypeVar, cast
 
 from django.core.cache import DEFAULT_CACHE_ALIAS, caches
 
-from django_perf_rec.operation import AllSourceRecorder, BaseRecorder, Operation
+from django_perf_rec.operation import (
+    AllSourceRecorder,
+    BaseRecorder,
+    FrameSnapshot,
+    Operation,
+)
+from django_perf_rec.settings import perf_rec_settings
+
+# Stopping before a last group that starts a long random hash, which is
+# replaced first when the patterns are applied one by one
+_uuid_pattern = (
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-(?![0-9a-f]{32}\b)[0-9a-f]{12}"
+)
+
+# The patterns CacheOp.clean_key() replaces, unless changed with the
+# CACHE_KEY_PATTERNS setting
+default_key_patterns = (
+    # Django session keys for 'cache' backend
+    r"(?<=django\.contrib\.sessions\.cache)[0-9a-z]{32}\b",
+    # Django session keys for 'cached_db' backend
+    r"(?<=django\.contrib\.sessions\.cached_db)[0-9a-z]{32}\b",
+    # Long random hashes
+    r"\b[0-9a-f]{32}\b",
+    # UUIDs
+    _uuid_pattern,
+    # Integers, stopping before any UUID that starts with digits, as in one
+    # pass, digits before a UUID would otherwise be matched first
+    rf"\d(?:(?!{_uuid_pattern})\d)*",
+)
+
+
+@cache
+def get_variable_re(patterns: tuple[str, ...] | None) -> Pattern[str] | None:
+    """
+    Combine the patterns into a single alternation, so keys are cleaned in
+    one pass. Where several match at the same position, the first wins.
+    """
+    if patterns is None:
+        patterns = default_key_patterns
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+@lru_cache(maxsize=10_000)
+def clean_key(key: str, variable_re: Pattern[str] | None) -> str:
+    if variable_re is None:
+        return key
+    return variable_re.sub("#", key)
 
 
 class CacheOp(Operation):
@@ -21,42 +71,38 @@ class CacheOp(Operation):
         alias: str,
         operation: str,
         key_or_keys: str | TypingCollection[str],
-        traceback: traceback.StackSummary,
+        traceback: StackSummary | FrameSnapshot,
     ):
         self.alias = alias
         self.operation = operation
+        variable_re = get_variable_re(perf_rec_settings.CACHE_KEY_PATTERNS)
         cleaned_key_or_keys: str | TypingCollection[str]
         if isinstance(key_or_keys, str):
-            cleaned_key_or_keys = self.clean_key(key_or_keys)
+            self.raw_keys: tuple[str, ...] = (key_or_keys,)
+            cleaned_key_or_keys = clean_key(key_or_keys, variable_re)
         elif isinstance(key_or_keys, Collection):
-            cleaned_key_or_keys = sorted(self.clean_key(k) for k in key_or_keys)
+            self.raw_keys = tuple(key_or_keys)
+            cleaned_key_or_keys = sorted(
+                clean_key(k, variable_re) for k in self.raw_keys
+            )
         else:
             raise ValueError("key_or_keys must be a string or collection")
 
         super().__init__(alias, cleaned_key_or_keys, traceback)
 
+        # Filled in by CacheRecorder, for analysis by RedundantCacheOpDetector:
+        # the values written by set() and set_many(), by key, and the return
+        # value, once the operation completes.
+        self.values: dict[str, Any] | None = None
+        self.result: Any = None
+
     @classmethod
     def clean_key(cls, key: str) -> str:
         """
         Replace things that look like variables with a '#' so tests aren't
         affected by random variables
         """
-        for var_re in cls.VARIABLE_RES:
-            key = var_re.sub("#", key)
-        return key
-
-    VARIABLE_RES: tuple[Pattern[str], ...] = (
-        # Django session keys for 'cache' backend
-        re.compile(r"(?<=django\.contrib\.sessions\.cache)[0-9a-z]{32}\b"),
-        # Django session keys for 'cached_db' backend
-        re.compile(r"(?<=django\.contrib\.sessions\.cached_db)[0-9a-z]{32}\b"),
-        # Long random hashes
-        re.compile(r"\b[0-9a-f]{32}\b"),
-        # UUIDs
-        re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"),
-        # Integers
-        re.compile(r"\d+"),
-    )
+        return clean_key(key, get_variable_re(perf_rec_settings.CACHE_KEY_PATTERNS))
 
     def __eq__(self, other: Any) -> bool:
         return super().__eq__(other) and self.operation == other.operation
@@ -73,58 +119,152 @@ class CacheOp(Operation):
 CacheFunc = TypeVar("CacheFunc", bound=Callable[..., Any])
 
 
-class CacheRecorder(BaseRecorder):
+class CachePatch:
     """
-    Monkey patches a cache class to call 'callback' on every operation it calls
+    Wraps the methods of a cache instance to call every callback in
+    'callbacks' on each operation.
+
+    Async methods get async wrappers, and are recorded under the names of
+    their sync counterparts, so sync callers pay nothing for them.
     """
 
-    def __enter__(self) -> None:
-        cache = caches[self.alias]
-
-        def call_callback(func: CacheFunc) -> CacheFunc:
-            alias = self.alias
-            callback = self.callback
-
-            @wraps(func)
-            def inner(self: Any, *args: Any, **kwargs: Any) -> Any:
-                # Ignore operations from the cache class calling itself
-
-                # Get the self of the parent via stack inspection
-                frame = inspect.currentframe()
-                assert frame is not None
-                try:
-                    frame = frame.f_back
-                    is_internal_call = (
-                        frame is not None and frame.f_locals.get("self", None) is self
-                    )
-                finally:
-                    # Always delete frame references to help garbage collector
-                    del frame
-
-                if not is_internal_call:
-                    if args:
-                        key_or_keys = args[0]
-                    elif "key" in kwargs:
-                        key_or_keys = kwargs["key"]
-                    else:
-                        key_or_keys = kwargs["keys"]
-                    callback(
-                        CacheOp(
-                            alias=alias,
-                            operation=str(func.__name__),
-                            key_or_keys=key_or_keys,
-                            traceback=traceback.extract_stack(),
-                        )
-                    )
+    def __init__(
+        self,
+        alias: str,
+        cache: Any,
+        method_names: Sequence[str],
+        async_method_names: Sequence[str],
+    ) -> None:
+        self.alias = alias
+        self.cache = cache
+        self.callbacks: list[Callable[[Operation], None]] = []
+        # Whether the current thread or task is inside a recorded operation
+        # on this cache. Cheaper than checking if the calling frame's self
+        # is the cache, which needs its f_locals. Context variables are
+        # copied into sync_to_async() threads, so async methods that run
+        # their sync counterparts aren't recorded twice.
+        self.calling: ContextVar[bool] = ContextVar(f"calling_{alias}", default=False)
+        # Whether to time operations, set when a recorder with the TIMINGS
+        # setting joins, so operations otherwise pay nothing for it
+        self.timed = False
+        self.orig_methods = {
+            name: getattr(cache, name) for name in (*method_names, *async_method_names)
+        }
+        for name in method_names:
+            wrapper = self.call_callbacks(self.orig_methods[name], name)
+            setattr(cache, name, MethodType(wrapper, cache))
+        for name in async_method_names:
+            # Named without the "a" prefix
+            wrapper = self.acall_callbacks(self.orig_methods[name], name[1:])
+            setattr(cache, name, MethodType(wrapper, cache))
+
+    def restore(self) -> None:
+        for name, orig_method in self.orig_methods.items():
+            setattr(self.cache, name, orig_method)
+
+    def start_op(
+        self, operation: str, args: tuple[Any, ...], kwargs: dict[str, Any]
+    ) -> CacheOp:
+        if args:
+            key_or_keys = args[0]
+        elif "key" in kwargs:
+            key_or_keys = kwargs["key"]
+        else:
+            key_or_keys = kwargs["keys"]
+        op = CacheOp(
+            alias=self.alias,
+            operation=operation,
+            key_or_keys=key_or_keys,
+            traceback=FrameSnapshot.capture(),
+        )
+        # Call back before running, so operations the cache itself runs, such
+        # as DatabaseCache's queries, are recorded after it. The duration is
+        # filled in afterwards.
+        if operation == "set":
+            value = args[1] if len(args) > 1 else kwargs.get("value")
+            op.values = {op.raw_keys[0]: value}
+        elif operation == "set_many" and isinstance(key_or_keys, dict):
+            op.values = key_or_keys
+        for callback in list(self.callbacks):
+            callback(op)
+        return op
+
+    def call_callbacks(self, func: CacheFunc, operation: str) -> CacheFunc:
+        patch = self
+        calling = self.calling
+        start_op = self.start_op
 
+        @wraps(func)
+        def inner(self: Any, *args: Any, **kwargs: Any) -> Any:
+            # Ignore operations from the cache class calling itself, such as
+            # get_or_set() calling get()
+            if calling.get():
                 return func(*args, **kwargs)
 
-            return cast(CacheFunc, inner)
+            op = start_op(operation, args, kwargs)
+            token = calling.set(True)
+            start = perf_counter() if patch.timed else None
+            try:
+                op.result = func(*args, **kwargs)
+            finally:
+                if start is not None:
+                    op.duration = perf_counter() - start
+                calling.reset(token)
+            return op.result
+
+        return cast(CacheFunc, inner)
+
+    def acall_callbacks(self, func: CacheFunc, operation: str) -> CacheFunc:
+        patch = self
+        calling = self.calling
+        start_op = self.start_op
+
+        @wraps(func)
+        async def inner(self: Any, *args: Any, **kwargs: Any) -> Any:
+            if calling.get():
+                return await func(*args, **kwargs)
+
+            op = start_op(operation, args, kwargs)
+            token = calling.set(True)
+            start = perf_counter() if patch.timed else None
+            try:
+                op.result = await func(*args, **kwargs)
+            finally:
+                if start is not None:
+                    op.duration = perf_counter() - start
+                calling.reset(token)
+            return op.result
+
+        return cast(CacheFunc, inner)
 
-        self.orig_methods = {name: getattr(cache, name) for name in self.cache_methods}
-        for name in self.cache_methods:
-            orig_method = self.orig_methods[name]
-            setattr(cache, name, MethodType(call_callback(orig_method), cache))
+
+# The patches applied to cache instances, by id()
+cache_patches: dict[int, CachePatch] = {}
+cache_patches_lock = Lock()
+
+
+class CacheRecorder(BaseRecorder):
+    """
+    Monkey patches a cache class to call 'callback' on every operation it calls.
+
+    Recorders on the same cache share one patch, which is removed when the
+    last of them exits, so they can exit in any order.
+    """
+
+    def __enter__(self) -> None:
+        self.cache = caches[self.alias]
+        with cache_patches_lock:
+            patch = cache_patches.get(id(self.cache))
+            if patch is None:
+                patch = cache_patches[id(self.cache)] = CachePatch(
+                    self.alias,
+                    self.cache,
+                    self.cache_methods,
+                    self.async_cache_methods,
+                )
+            if perf_rec_settings.TIMINGS:
+                patch.timed = True
+            patch.callbacks.append(self.callback)
 
     def __exit__(
         self,
@@ -132,10 +272,13 @@ class CacheRecorder(BaseRecorder):
         exc_value: BaseException | None,
         exc_traceback: TracebackType | None,
     ) -> None:
-        cache = caches[self.alias]
-        for name in self.cache_methods:
-            setattr(cache, name, self.orig_methods[name])
-        del self.orig_methods
+        with cache_patches_lock:
+            patch = cache_patches[id(self.cache)]
+            patch.callbacks.remove(self.callback)
+            if not patch.callbacks:
+                patch.restore()
+                del cache_patches[id(self.cache)]
+        del self.cache
 
     cache_methods = (
         "add",
@@ -145,11 +288,15 @@ class CacheRecorder(BaseRecorder):
         "get",
         "get_many",
         "get_or_set",
+        "has_key",
         "incr",
         "set",
         "set_many",
+        "touch",
     )
 
+    async_cache_methods = tuple(f"a{name}" for name in cache_methods)
+
 
 class AllCacheRecorder(AllSourceRecorder):
     """
@@ -1,14 +1,22 @@
 from __future__ import annotations
 
-import traceback
 from collections.abc import Callable
 from functools import wraps
+from threading import Lock, Thread, current_thread
+from time import perf_counter
 from types import MethodType, TracebackType
 from typing import Any, TypeVar, cast
 
 from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
 
-from django_perf_rec.operation import AllSourceRecorder, BaseRecorder, Operation
+from django_perf_rec.operation import (
+    AllSourceRecorder,
+    BaseRecorder,
+    FrameSnapshot,
+    Operation,
+    active_recorders,
+)
 from django_perf_rec.settings import perf_rec_settings
 from django_perf_rec.sql import sql_fingerprint
 
@@ -23,15 +31,113 @@ class DBOp(Operation):
 
 
 LastExecutedQuery = TypeVar("LastExecutedQuery", bound=Callable[..., str])
+ExecuteWrapper = Callable[[Callable[..., Any], str, Any, bool, dict[str, Any]], Any]
+
+
+def make_execute_wrapper(
+    alias: str,
+    connection: BaseDatabaseWrapper,
+    callback: Callable[[Operation], None],
+) -> ExecuteWrapper:
+    """
+    Make a wrapper for connection.execute_wrappers, which passes a DBOp for
+    each query to 'callback'. Settings are read once here, rather than for
+    every query, and queries are only timed with the TIMINGS setting.
+    """
+    hide_columns = perf_rec_settings.HIDE_COLUMNS
+    engine = perf_rec_settings.FINGERPRINT_ENGINE
+    cache_size = perf_rec_settings.FINGERPRINT_CACHE_SIZE
+    cache_path = perf_rec_settings.FINGERPRINT_CACHE_PATH
+    timed = perf_rec_settings.TIMINGS
+
+    def execute_wrapper(
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: dict[str, Any],
+    ) -> Any:
+        start = perf_counter() if timed else 0.0
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start if timed else None
+            if many:
+                # Fingerprint with the first set of params, if they can be
+                # inspected without consuming an iterator.
+                if isinstance(params, (list, tuple)) and params:
+                    params = params[0]
+                else:
+                    params = None
+            sql = connection.ops.last_executed_query(
+                context["cursor"].cursor, sql, params
+            )
+            op = DBOp(
+                alias=alias,
+                query=sql_fingerprint(
+                    sql,
+                    hide_columns=hide_columns,
+                    engine=engine,
+                    cache_size=cache_size,
+                    cache_path=cache_path,
+                ),
+                traceback=FrameSnapshot.capture(),
+            )
+            op.duration = duration
+            callback(op)
+
+    return execute_wrapper
 
 
 class DBRecorder(BaseRecorder):
     """
-    Monkey-patch-wraps a database connection to call 'callback' on every
-    query it runs.
+    Wraps a database connection to call 'callback' on every query it runs.
+
+    The engine used is picked by the DB_RECORDER setting.
     """
 
     def __enter__(self) -> None:
+        self.engine = perf_rec_settings.DB_RECORDER
+        if self.engine == "debug_cursor":
+            self.enter_debug_cursor()
+        else:
+            self.enter_execute_wrapper()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        if self.engine == "debug_cursor":
+            self.exit_debug_cursor()
+        else:
+            self.exit_execute_wrapper(exc_type, exc_value, exc_traceback)
+
+    def enter_execute_wrapper(self) -> None:
+        """
+        Install a wrapper in connection.execute_wrappers, which sees the
+        SQL and params of every execute() and executemany() call. The SQL is
+        interpolated with connection.ops.last_executed_query, as the debug
+        cursor does, but without its timing and queries_log bookkeeping.
+        """
+        connection = connections[self.alias]
+        execute_wrapper = make_execute_wrapper(self.alias, connection, self.callback)
+        # Rather than with connection.execute_wrapper(), which pops the last
+        # wrapper on exit, so recorders can exit in any order.
+        connection.execute_wrappers.append(execute_wrapper)
+        self.execute_wrapper = execute_wrapper
+
+    def exit_execute_wrapper(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        connections[self.alias].execute_wrappers.remove(self.execute_wrapper)
+        del self.execute_wrapper
+
+    def enter_debug_cursor(self) -> None:
         """
         When using the debug cursor wrapper, Django calls
         connection.ops.last_executed_query to get the SQL from the client
@@ -49,12 +155,17 @@ class DBRecorder(BaseRecorder):
             @wraps(func)
             def inner(self: Any, *args: Any, **kwargs: Any) -> str:
                 sql = func(*args, **kwargs)
-                hide_columns = perf_rec_settings.HIDE_COLUMNS
                 callback(
                     DBOp(
                         alias=alias,
-                        query=sql_fingerprint(sql, hide_columns=hide_columns),
-                        traceback=traceback.extract_stack(),
+                        query=sql_fingerprint(
+                            sql,
+                            hide_columns=perf_rec_settings.HIDE_COLUMNS,
+                            engine=perf_rec_settings.FINGERPRINT_ENGINE,
+                            cache_size=perf_rec_settings.FINGERPRINT_CACHE_SIZE,
+                            cache_path=perf_rec_settings.FINGERPRINT_CACHE_PATH,
+                        ),
+                        traceback=FrameSnapshot.capture(),
                     )
                 )
                 return sql
@@ -66,12 +177,7 @@ class DBRecorder(BaseRecorder):
             call_callback(connection.ops.last_executed_query), connection.ops
         )
 
-    def __exit__(
-        self,
-        exc_type: type[BaseException] | None,
-        exc_value: BaseException | None,
-        exc_traceback: TracebackType | None,
-    ) -> None:
+    def exit_debug_cursor(self) -> None:
         connection = connections[self.alias]
         connection.force_debug_cursor = self.orig_force_debug_cursor
         connection.ops.last_executed_query = (  # type: ignore [method-assign]
@@ -86,3 +192,82 @@ class AllDBRecorder(AllSourceRecorder):
 
     sources_setting = "DATABASES"
     recorder_class = DBRecorder
+
+
+class ThreadDBRecorder:
+    """
+    Records queries on the database connections other threads create while
+    it's active, such as in ThreadPoolExecutor workers or for
+    sync_to_async(thread_sensitive=False), which DBRecorders don't see, as
+    connections are thread-local.
+
+    Queries are held per thread and passed to 'callback' on exit, one thread
+    after another. Threads are ordered by their queries, rather than by when
+    they ran, so the result is deterministic as long as each thread's work is.
+    """
+
+    def __init__(self, callback: Callable[[Operation], None]) -> None:
+        self.callback = callback
+
+    def __enter__(self) -> None:
+        # Threads running code for another recording, with a copy of its
+        # context, are ignored
+        self.context_recorders = active_recorders.get()
+        self.thread_ops: dict[Thread, list[Operation]] = {}
+        self.execute_wrappers: list[tuple[BaseDatabaseWrapper, ExecuteWrapper]] = []
+        with thread_db_recorders_lock:
+            if not thread_db_recorders:
+                connections.create_connection = create_connection  # type: ignore [method-assign]
+            thread_db_recorders.append(self)
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        with thread_db_recorders_lock:
+            thread_db_recorders.remove(self)
+            if not thread_db_recorders:
+                del connections.create_connection
+            for connection, execute_wrapper in self.execute_wrappers:
+                connection.execute_wrappers.remove(execute_wrapper)
+            self.execute_wrappers = []
+
+        thread_ops = sorted(
+            self.thread_ops.values(),
+            key=lambda ops: [(op.name, op.query) for op in ops],
+        )
+        self.thread_ops = {}
+        for ops in thread_ops:
+            for op in ops:
+                self.callback(op)
+
+    def wrap_connection(self, alias: str, connection: BaseDatabaseWrapper) -> None:
+        execute_wrapper = make_execute_wrapper(alias, connection, self.on_op)
+        connection.execute_wrappers.append(execute_wrapper)
+        self.execute_wrappers.append((connection, execute_wrapper))
+
+    def on_op(self, op: Operation) -> None:
+        recorders = active_recorders.get()
+        if (
+            recorders
+            and self.context_recorders
+            and recorders.isdisjoint(self.context_recorders)
+        ):
+            return
+        self.thread_ops.setdefault(current_thread(), []).append(op)
+
+
+# The active ThreadDBRecorders, which are given each connection created while
+# create_connection() below is installed on the connection handler
+thread_db_recorders: list[ThreadDBRecorder] = []
+thread_db_recorders_lock = Lock()
+
+
+def create_connection(alias: str) -> BaseDatabaseWrapper:
+    connection = type(connections).create_connection(connections, alias)
+    with thread_db_recorders_lock:
+        for recorder in thread_db_recorders:
+            recorder.wrap_connection(alias, connection)
+    return connection
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from random import random
+from typing import Any
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponseBase
+
+from django_perf_rec.cache import AllCacheRecorder
+from django_perf_rec.db import AllDBRecorder
+from django_perf_rec.operation import AllSourceRecorder, Operation
+from django_perf_rec.settings import perf_rec_settings
+from django_perf_rec.timings import get_timing_key
+
+SamplingStats = dict[str, Any]
+
+
+def histogram_bucket(value: int) -> str:
+    """
+    Return the power of two bucket a count falls in, e.g. '4-7' for 5, so
+    histograms have a bounded number of buckets.
+    """
+    if value < 2:
+        return str(value)
+    low = 1 << (value.bit_length() - 1)
+    return f"{low}-{2 * low - 1}"
+
+
+class ViewStats:
+    """
+    Aggregates the sampled requests to one view: histograms of how many
+    operations, and distinct operations, each ran, and the total count of
+    each operation. At most max_fingerprints operations are counted
+    individually, with the rest counted together.
+    """
+
+    def __init__(self, max_fingerprints: int) -> None:
+        self.max_fingerprints = max_fingerprints
+        self.requests = 0
+        self.ops_per_request: Counter[str] = Counter()
+        self.distinct_per_request: Counter[str] = Counter()
+        self.fingerprints: Counter[str] = Counter()
+        self.other_fingerprints = 0
+
+    def add(self, keys: list[str]) -> None:
+        counts = Counter(keys)
+        self.requests += 1
+        self.ops_per_request[histogram_bucket(len(keys))] += 1
+        self.distinct_per_request[histogram_bucket(len(counts))] += 1
+        for key, count in counts.items():
+            if (
+                key in self.fingerprints
+                or len(self.fingerprints) < self.max_fingerprints
+            ):
+                self.fingerprints[key] += count
+            else:
+                self.other_fingerprints += count
+
+    def as_dict(self) -> SamplingStats:
+        return {
+            "requests": self.requests,
+            "ops_per_request": dict(self.ops_per_request),
+            "distinct_per_request": dict(self.distinct_per_request),
+            "fingerprints": dict(self.fingerprints.most_common()),
+            "other_fingerprints": self.other_fingerprints,
+        }
+
+
+class Sampler:
+    """
+    Collects the operations of sampled requests by view, and passes their
+    statistics to the output every flush_interval seconds, from a background
+    thread, so requests never wait on it. The output is either a callable,
+    or the path of a file to append them to as JSON lines. Statistics are
+    reset after each flush.
+    """
+
+    def __init__(
+        self,
+        output: str | Callable[[SamplingStats], None],
+        flush_interval: float,
+        max_fingerprints: int,
+    ) -> None:
+        self.output = output
+        self.flush_interval = flush_interval
+        self.max_fingerprints = max_fingerprints
+        self.views: dict[str, ViewStats] = {}
+        self.lock = threading.Lock()
+        # Held while writing, so requests only wait on self.lock for take()
+        self.write_lock = threading.Lock()
+        # The process the flush thread runs in, as threads don't survive a
+        # fork, such as from a server preloading the application
+        self.flush_thread_pid: int | None = None
+        self.stopped = threading.Event()
+        register_sampler(self)
+
+    def add(self, view_name: str, keys: list[str]) -> None:
+        with self.lock:
+            view_stats = self.views.get(view_name)
+            if view_stats is None:
+                view_stats = self.views[view_name] = ViewStats(self.max_fingerprints)
+            view_stats.add(keys)
+            if self.flush_thread_pid != os.getpid():
+                self.start_flush_thread()
+
+    def start_flush_thread(self) -> None:
+        # Call with self.lock held
+        self.flush_thread_pid = os.getpid()
+        threading.Thread(
+            target=self.flush_loop,
+            name="django-perf-rec sampling flush",
+            daemon=True,
+        ).start()
+
+    def flush_loop(self) -> None:
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self) -> None:
+        """
+        Stop the flush thread, without flushing.
+        """
+        self.stopped.set()
+
+    def take(self) -> SamplingStats:
+        """
+        Remove and return the statistics gathered since the last flush.
+        """
+        with self.lock:
+            views = self.views
+            self.views = {}
+        return {
+            "time": round(time.time(), 3),
+            "pid": os.getpid(),
+            "views": {
+                view_name: view_stats.as_dict()
+                for view_name, view_stats in sorted(views.items())
+            },
+        }
+
+    def flush(self) -> None:
+        with self.write_lock:
+            stats = self.take()
+            if not stats["views"]:
+                return
+            if callable(self.output):
+                self.output(stats)
+            else:
+                with open(self.output, "a") as fp:
+                    fp.write(json.dumps(stats, sort_keys=True) + "\n")
+
+
+# Samplers created in this process, flushed together at exit
+samplers: weakref.WeakSet[Sampler] = weakref.WeakSet()
+samplers_lock = threading.Lock()
+atexit_registered = False
+
+
+def register_sampler(sampler: Sampler) -> None:
+    global atexit_registered
+    with samplers_lock:
+        samplers.add(sampler)
+        if not atexit_registered:
+            atexit.register(flush_samplers)
+            atexit_registered = True
+
+
+def flush_samplers() -> None:
+    """
+    Flush the statistics of every sampler in this process.
+    """
+    with samplers_lock:
+        to_flush = list(samplers)
+    for sampler in to_flush:
+        sampler.flush()
+
+
+def get_view_name(request: HttpRequest) -> str:
+    resolver_match = request.resolver_match
+    if resolver_match is None:
+        return "<unresolved>"
+    return resolver_match.view_name
+
+
+class SamplingMiddleware:
+    """
+    Records the operations of a fraction of requests, given by the
+    SAMPLING_RATE setting, into per-view statistics, fingerprinted as in
+    performance records. Other requests only cost a random number.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(
+        self,
+        get_response: Callable[[HttpRequest], HttpResponseBase]
+        | Callable[[HttpRequest], Awaitable[HttpResponseBase]],
+    ) -> None:
+        self.rate = perf_rec_settings.SAMPLING_RATE
+        if self.rate == 0:
+            raise MiddlewareNotUsed()
+        output = perf_rec_settings.SAMPLING_OUTPUT
+        assert output is not None, "SAMPLING_OUTPUT must be set to sample requests"
+        self.sampler = Sampler(
+            output,
+            perf_rec_settings.SAMPLING_FLUSH_INTERVAL,
+            perf_rec_settings.SAMPLING_MAX_FINGERPRINTS,
+        )
+
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> Any:
+        if self.async_mode:
+            return self.__acall__(request)
+        if random() >= self.rate:
+            return self.get_response(request)
+
+        keys: list[str] = []
+        recorders = self.get_recorders(keys)
+        self.enter_recorders(recorders)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.exit_recorders(recorders)
+        self.sampler.add(get_view_name(request), keys)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> Any:
+        if random() >= self.rate:
+            return await self.get_response(request)  # type: ignore [misc]
+
+        keys: list[str] = []
+        recorders = self.get_recorders(keys)
+        # Where the ORM runs sync code, as for async with record()
+        await sync_to_async(self.enter_recorders)(recorders)
+        try:
+            response = await self.get_response(request)  # type: ignore [misc]
+        finally:
+            await sync_to_async(self.exit_recorders)(recorders)
+        self.sampler.add(get_view_name(request), keys)
+        return response
+
+    def get_recorders(self, keys: list[str]) -> list[AllSourceRecorder]:
+        def on_op(op: Operation) -> None:
+            keys.append(get_timing_key(op))
+
+        return [AllDBRecorder(on_op), AllCacheRecorder(on_op)]
+
+    def enter_recorders(self, recorders: list[AllSourceRecorder]) -> None:
+        for recorder in recorders:
+            recorder.__enter__()
+
+    def exit_recorders(self, recorders: list[AllSourceRecorder]) -> None:
+        for recorder in reversed(recorders):
+            recorder.__exit__(None, None, None)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import warnings
+from collections import Counter
+from types import TracebackType
+from typing import Literal
+
+from django_perf_rec.db import AllDBRecorder
+from django_perf_rec.operation import Callsite, Operation, library_prefixes
+
+
+class NPlusOneWarning(UserWarning):
+    """
+    Warns of queries repeated from the same line of code.
+    """
+
+
+class NPlusOneDetector:
+    """
+    Counts queries by fingerprint and the line of code that ran them, and
+    reports any run at least 'threshold' times, a likely N+1 query pattern.
+    """
+
+    def __init__(
+        self, threshold: int, action: Literal["error", "warning"] = "error"
+    ) -> None:
+        assert threshold >= 2, "threshold must be at least 2"
+        assert action in ("error", "warning")
+        self.threshold = threshold
+        self.action = action
+        self.counts: Counter[tuple[str, str, Callsite | None]] = Counter()
+        self.db_recorder = AllDBRecorder(self.on_op)
+
+    def __enter__(self) -> NPlusOneDetector:
+        self.db_recorder.__enter__()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        self.db_recorder.__exit__(exc_type, exc_value, exc_traceback)
+
+        if exc_type is None:
+            self.check()
+
+    def on_op(self, op: Operation) -> None:
+        callsite = op.callsite(library_prefixes)
+        self.counts[(op.name, str(op.query), callsite)] += 1
+
+    def findings(self) -> list[tuple[int, str, str, Callsite | None]]:
+        """
+        Return the count, operation name, query, and callsite of each
+        repeated query, most repeated first.
+        """
+        return [
+            (count, name, query, callsite)
+            for (name, query, callsite), count in self.counts.most_common()
+            if count >= self.threshold
+        ]
+
+    def check(self) -> None:
+        findings = self.findings()
+        if not findings:
+            return
+
+        lines = ["Potential N+1 queries:"]
+        for count, name, query, callsite in findings:
+            lines.append(f"  {count} x {name}: {query}")
+            if callsite is not None:
+                filename, lineno, function = callsite
+                lines.append(f"    from {filename}:{lineno} in {function}")
+        message = "\n".join(lines)
+
+        if self.action == "error":
+            raise AssertionError(message)
+        warnings.warn(message, NPlusOneWarning, stacklevel=3)
+
+
+def detect_n_plus_one(
+    threshold: int = 5, action: Literal["error", "warning"] = "error"
+) -> NPlusOneDetector:
+    """
+    Report queries run at least threshold times from the same line of code
+    inside the block, by raising an AssertionError or warning.
+    """
+    return NPlusOneDetector(threshold, action)
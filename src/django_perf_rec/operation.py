@@ -1,22 +1,107 @@
 from __future__ import annotations
 
+import os
+import sys
 from collections.abc import Callable
-from traceback import StackSummary
-from types import TracebackType
+from contextvars import ContextVar
+from traceback import FrameSummary, StackSummary
+from types import CodeType, FrameType, TracebackType
 from typing import Any
 
+import django
 from django.conf import settings
 
 from django_perf_rec.utils import sorted_names
 
+# The filename, line number, and function name of a frame
+Callsite = tuple[str, int | None, str]
+
+# Frames in these packages are skipped when finding the code that ran an
+# operation
+library_prefixes = (
+    os.path.dirname(django.__file__) + os.sep,
+    os.path.dirname(__file__) + os.sep,
+)
+
+
+class FrameSnapshot:
+    """
+    A cheap capture of the call stack, holding only code objects and line
+    numbers. It is only turned into a StackSummary, which involves looking up
+    source lines, when needed.
+    """
+
+    __slots__ = ("frames",)
+
+    def __init__(self, frames: list[tuple[CodeType, int | None]]) -> None:
+        self.frames = frames
+
+    @classmethod
+    def capture(cls) -> FrameSnapshot:
+        """
+        Snapshot the stack of the caller, like traceback.extract_stack().
+        """
+        frames = []
+        frame: FrameType | None = sys._getframe(1)
+        while frame is not None:
+            frames.append((frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        frames.reverse()
+        return cls(frames)
+
+    def locations(self) -> list[Callsite]:
+        """
+        Return the filename, line number, and function name of each frame,
+        without looking up source lines.
+        """
+        return [
+            (code.co_filename, lineno, code.co_name) for code, lineno in self.frames
+        ]
+
+    def summary(self) -> StackSummary:
+        return StackSummary.from_list(
+            [
+                FrameSummary(code.co_filename, lineno, code.co_name, lookup_line=False)
+                for code, lineno in self.frames
+            ]
+        )
+
 
 class Operation:
     def __init__(
-        self, alias: str, query: str | list[str], traceback: StackSummary
+        self,
+        alias: str,
+        query: str | list[str],
+        traceback: StackSummary | FrameSnapshot,
     ) -> None:
         self.alias = alias
         self.query = query
-        self.traceback = traceback
+        self._traceback = traceback
+        # Wall time in seconds, if the recorder measured it
+        self.duration: float | None = None
+
+    @property
+    def traceback(self) -> StackSummary:
+        if isinstance(self._traceback, FrameSnapshot):
+            self._traceback = self._traceback.summary()
+        return self._traceback
+
+    def callsite(self, skip_prefixes: tuple[str, ...] = ()) -> Callsite | None:
+        """
+        Return the filename, line number, and function name of the innermost
+        frame whose filename doesn't start with one of skip_prefixes, or None
+        if there's no such frame.
+        """
+        if isinstance(self._traceback, FrameSnapshot):
+            locations = self._traceback.locations()
+        else:
+            locations = [
+                (frame.filename, frame.lineno, frame.name) for frame in self._traceback
+            ]
+        for location in reversed(locations):
+            if not location[0].startswith(skip_prefixes):
+                return location
+        return None
 
     def __eq__(self, other: Any) -> bool:
         return (
@@ -48,9 +133,20 @@ class BaseRecorder:
         pass
 
 
+# The AllSourceRecorders entered in the current thread or task, and in
+# threads running sync code for it with asgiref's sync_to_async().
+active_recorders: ContextVar[frozenset[AllSourceRecorder]] = ContextVar(
+    "active_recorders", default=frozenset()
+)
+
+
 class AllSourceRecorder:
     """
-    Launches Recorders on all the active sources
+    Launches Recorders on all the active sources.
+
+    Only operations run in the context that entered it are passed on, so
+    concurrent tasks recording on the same connections or caches don't see
+    each other's operations.
     """
 
     sources_setting: str
@@ -60,9 +156,10 @@ class AllSourceRecorder:
         self.callback = callback
 
     def __enter__(self) -> None:
+        active_recorders.set(active_recorders.get() | {self})
         self.recorders = []
         for name in sorted_names(getattr(settings, self.sources_setting).keys()):
-            recorder = self.recorder_class(name, self.callback)
+            recorder = self.recorder_class(name, self.on_op)
             recorder.__enter__()
             self.recorders.append(recorder)
 
@@ -75,3 +172,8 @@ class AllSourceRecorder:
         for recorder in reversed(self.recorders):
             recorder.__exit__(exc_type, exc_value, exc_traceback)
         self.recorders = []
+        active_recorders.set(active_recorders.get() - {self})
+
+    def on_op(self, op: Operation) -> None:
+        if self in active_recorders.get():
+            self.callback(op)
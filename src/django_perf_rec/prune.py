@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections.abc import Collection, Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from django_perf_rec.yaml import KVFile
+
+# Record names used by record() blocks, by file name, once tracking starts
+used_records: dict[str, set[str]] | None = None
+used_records_lock = threading.Lock()
+
+
+def start_tracking() -> None:
+    global used_records
+    with used_records_lock:
+        if used_records is None:
+            used_records = {}
+
+
+def mark_used(file_name: str, record_name: str) -> None:
+    if used_records is None:
+        return
+    with used_records_lock:
+        if used_records is not None:
+            used_records.setdefault(file_name, set()).add(record_name)
+
+
+def take_used() -> dict[str, set[str]]:
+    """
+    Remove and return the record names used so far, by file name.
+    """
+    global used_records
+    with used_records_lock:
+        used = used_records or {}
+        if used_records is not None:
+            used_records = {}
+    return used
+
+
+def add_used(used: Mapping[str, Iterable[str]]) -> None:
+    """
+    Add record names from take_used() in another process.
+    """
+    with used_records_lock:
+        if used_records is None:
+            return
+        for file_name, record_names in used.items():
+            used_records.setdefault(file_name, set()).update(record_names)
+
+
+def is_test_record(record_name: str, base_names: Collection[str]) -> bool:
+    """
+    Return whether a record has one of the names get_record_name() gives the
+    tests with the given base names, from get_base_record_name(), including
+    the .2, .3 etc. suffixes of later records in the same test.
+    """
+    if record_name in base_names:
+        return True
+    prefix, _, counter = record_name.rpartition(".")
+    return counter.isdigit() and prefix in base_names
+
+
+# The names get_record_name() gives tests by default, for Pytest's default
+# 'test' prefix, such as 'test_foo', 'FooTests.test_foo[1]', or 'test_foo.2'
+default_record_name_re = re.compile(
+    r"(?:\w+\.)?test\w*(?:\[.*\])?(?:\.\d+)?", re.DOTALL
+)
+
+
+def is_default_record_name(record_name: str) -> bool:
+    return default_record_name_re.fullmatch(record_name) is not None
+
+
+def find_orphans(
+    file_name: str, used: Collection[str], base_names: Collection[str] | None
+) -> list[str]:
+    """
+    Return the names of records in the file that weren't used. If
+    base_names is given, only records of the tests with those base names
+    are orphans. Records with names that get_record_name() wouldn't give a
+    test, such as those passed to record() as record_name, are never orphans.
+    """
+    return sorted(
+        record_name
+        for record_name in KVFile.load_file(file_name)
+        if record_name not in used
+        and is_default_record_name(record_name)
+        and (base_names is None or is_test_record(record_name, base_names))
+    )
+
+
+def prune_file(
+    file_name: str,
+    used: Collection[str],
+    base_names: Collection[str] | None,
+    dry_run: bool = False,
+) -> list[str]:
+    orphans = find_orphans(file_name, used, base_names)
+    if orphans and not dry_run:
+        KVFile.delete(file_name, orphans)
+    return orphans
+
+
+def prune(
+    used: Mapping[str, Collection[str]],
+    base_names: Mapping[str, Collection[str]],
+    dry_run: bool = False,
+    max_workers: int | None = None,
+) -> dict[str, list[str]]:
+    """
+    Remove the records that weren't used from each file that any were used
+    from. For files in base_names, only remove the records of tests with
+    those base names, such as when other tests were skipped or failed before
+    reaching all their record() blocks, so may have used any record names.
+    Files are read and rewritten in parallel threads. Return the removed
+    record names by file name, for files with any, without removing them if
+    dry_run is set.
+    """
+    file_names = sorted(used)
+    with ThreadPoolExecutor(max_workers) as executor:
+        results = executor.map(
+            lambda file_name: prune_file(
+                file_name, used[file_name], base_names.get(file_name), dry_run
+            ),
+            file_names,
+        )
+        return {
+            file_name: orphans
+            for file_name, orphans in zip(file_names, results)
+            if orphans
+        }
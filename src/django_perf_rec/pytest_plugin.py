@@ -1,8 +1,286 @@
 from __future__ import annotations
 
-in_pytest = False
+from typing import TYPE_CHECKING, Any
 
+from django_perf_rec import _HAVE_PYTEST, state
 
-def pytest_configure() -> None:
-    global in_pytest
-    in_pytest = True
+if TYPE_CHECKING:
+    import pytest
+
+# Keys for records, timings, and what to prune, sent from pytest-xdist
+# workers in workeroutput
+workeroutput_key = "django_perf_rec_pending"
+timings_workeroutput_key = "django_perf_rec_timings"
+prune_workeroutput_key = "django_perf_rec_prune"
+
+# For --perf-rec-prune: the node IDs of tests that passed, including those
+# reported by pytest-xdist workers, the tests collected or deselected in this
+# process, and those of workers, as (node ID, performance file name, base
+# record name)
+passed_nodeids: set[str] = set()
+prune_items: list[pytest.Item] = []
+worker_tests: list[tuple[str, str, str]] = []
+# Also, the node IDs of the test modules found while collecting, by file path,
+# the node IDs of the tests and collectors in them, the collectors that
+# collected successfully, and the performance files of test modules that
+# pytest-xdist workers collected completely
+module_nodeids: dict[str, str] = {}
+found_nodeids: dict[str, set[str]] = {}
+collected_nodeids: set[str] = set()
+complete_files: set[str] = set()
+# The record names removed, or that would be, by file name
+pruned: dict[str, list[str]] | None = None
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("django-perf-rec")
+    group.addoption(
+        "--perf-rec-cache-stats",
+        action="store_true",
+        default=False,
+        help="Print SQL fingerprint cache statistics at the end of the session.",
+    )
+    group.addoption(
+        "--perf-rec-slowest",
+        type=int,
+        default=10,
+        metavar="N",
+        help=(
+            "With the TIMINGS setting, print the N slowest operations at the end "
+            + "of the session (default: 10, 0 to disable)."
+        ),
+    )
+    group.addoption(
+        "--perf-rec-prune",
+        action="store_true",
+        default=False,
+        help=(
+            "At the end of the session, remove records that no test produced "
+            + "from the performance files that tests used."
+        ),
+    )
+    group.addoption(
+        "--perf-rec-prune-dry-run",
+        action="store_true",
+        default=False,
+        help="Like --perf-rec-prune, but only list the records it would remove.",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    state.in_pytest = True
+    state.xdist_worker = hasattr(config, "workerinput")
+    state.pruning = config.getoption("perf_rec_prune") or config.getoption(
+        "perf_rec_prune_dry_run"
+    )
+    if state.pruning:
+        from django_perf_rec import prune
+
+        prune.start_tracking()
+
+
+def pytest_collectreport(report: pytest.CollectReport) -> None:
+    if not state.pruning:
+        return
+    import pytest
+
+    if report.passed:
+        collected_nodeids.add(report.nodeid)
+    for node in report.result:
+        if isinstance(node, pytest.Module):
+            module_nodeids[str(node.path)] = node.nodeid
+        found_nodeids.setdefault(str(node.path), set()).add(node.nodeid)
+
+
+def pytest_collection_finish(session: pytest.Session) -> None:
+    if state.pruning:
+        prune_items.extend(session.items)
+
+
+def pytest_deselected(items: list[pytest.Item]) -> None:
+    if state.pruning:
+        prune_items.extend(items)
+
+
+def pytest_runtest_logreport(report: pytest.TestReport) -> None:
+    if state.pruning and report.when == "call" and report.passed:
+        passed_nodeids.add(report.nodeid)
+
+
+def pytest_sessionfinish(session: pytest.Session) -> None:
+    global pruned
+    from django_perf_rec import prune
+    from django_perf_rec.timings import timings
+    from django_perf_rec.yaml import KVFile
+
+    if state.xdist_worker:
+        # Send records to the controller, which writes each file once
+        workeroutput = session.config.workeroutput  # type: ignore [attr-defined]
+        workeroutput[workeroutput_key] = KVFile.take_pending()
+        workeroutput[timings_workeroutput_key] = timings.take()
+        if state.pruning:
+            workeroutput[prune_workeroutput_key] = {
+                "used": {
+                    file_name: sorted(record_names)
+                    for file_name, record_names in prune.take_used().items()
+                },
+                "tests": get_tests(),
+                "complete": get_complete_files(),
+            }
+    else:
+        KVFile.flush()
+        timings.flush()
+        if state.pruning:
+            pruned = prune_records(
+                dry_run=session.config.getoption("perf_rec_prune_dry_run")
+            )
+
+
+def get_tests() -> list[tuple[str, str, str]]:
+    """
+    Return the tests collected or deselected in this process, with the
+    performance file and base record name record() gives them by default.
+    """
+    from django_perf_rec.api import get_base_record_name, get_perf_path
+
+    tests = []
+    for item in prune_items:
+        cls = getattr(item, "cls", None)
+        tests.append(
+            (
+                item.nodeid,
+                get_perf_path(str(item.path)),
+                get_base_record_name(
+                    item.name, cls.__name__ if cls is not None else None
+                ),
+            )
+        )
+    return tests
+
+
+def get_complete_files() -> list[str]:
+    """
+    Return the performance files of the test modules that were collected,
+    and whose tests were all collected or deselected, in this process.
+    Selecting tests by node ID leaves the rest of their module uncollected,
+    so their records can't be told apart from those of deleted tests.
+    """
+    from django_perf_rec.api import get_perf_path
+
+    selected_nodeids = collected_nodeids | {item.nodeid for item in prune_items}
+    return sorted(
+        get_perf_path(path)
+        for path, nodeid in module_nodeids.items()
+        if nodeid in collected_nodeids and found_nodeids[path] <= selected_nodeids
+    )
+
+
+def prune_records(dry_run: bool) -> dict[str, list[str]]:
+    """
+    Prune the files of the test modules that were collected completely. In
+    those where any test didn't pass, only prune the records of the tests
+    that did, since the others may not have reached all their record()
+    blocks.
+    """
+    from django_perf_rec import prune
+
+    passed_base_names: dict[str, set[str]] = {}
+    partial_files = set()
+    for nodeid, file_name, base_name in worker_tests + get_tests():
+        # Tests may pass on a different pytest-xdist worker
+        if nodeid in passed_nodeids:
+            passed_base_names.setdefault(file_name, set()).add(base_name)
+        else:
+            partial_files.add(file_name)
+    base_names = {
+        file_name: passed_base_names.get(file_name, set())
+        for file_name in partial_files
+    }
+    prunable_files = complete_files.union(get_complete_files())
+    used = {
+        file_name: record_names
+        for file_name, record_names in prune.take_used().items()
+        if file_name in prunable_files
+    }
+    return prune.prune(used, base_names, dry_run=dry_run)
+
+
+def pytest_testnodedown(node: Any, error: object) -> None:
+    from django_perf_rec import prune
+    from django_perf_rec.timings import timings
+    from django_perf_rec.yaml import KVFile
+
+    # Crashed workers may have no workeroutput
+    workeroutput = getattr(node, "workeroutput", {})
+    KVFile.add_pending(workeroutput.get(workeroutput_key, {}))
+    timings.merge(workeroutput.get(timings_workeroutput_key, {}))
+    prune_output = workeroutput.get(prune_workeroutput_key, {})
+    prune.add_used(prune_output.get("used", {}))
+    worker_tests.extend(tuple(test) for test in prune_output.get("tests", []))
+    complete_files.update(prune_output.get("complete", []))
+
+
+if _HAVE_PYTEST:
+    import pytest
+
+    # Only called with pytest-xdist installed
+    pytest_testnodedown = pytest.hookimpl(optionalhook=True)(pytest_testnodedown)
+
+
+def pytest_terminal_summary(
+    terminalreporter: pytest.TerminalReporter, config: pytest.Config
+) -> None:
+    if config.getoption("perf_rec_cache_stats"):
+        write_cache_stats(terminalreporter)
+
+    slowest = config.getoption("perf_rec_slowest")
+    if slowest:
+        write_slowest(terminalreporter, slowest)
+
+    if pruned is not None:
+        write_pruned(terminalreporter, config.getoption("perf_rec_prune_dry_run"))
+
+
+def write_cache_stats(terminalreporter: pytest.TerminalReporter) -> None:
+    from django_perf_rec.sql import fingerprint_cache
+
+    info = fingerprint_cache.info()
+    lookups = info.hits + info.misses
+    hit_rate = (info.hits / lookups * 100) if lookups else 0.0
+    terminalreporter.write_sep("-", "django-perf-rec fingerprint cache")
+    terminalreporter.write_line(
+        f"hits: {info.hits}, misses: {info.misses} ({hit_rate:.1f}% hit rate), "
+        + f"evictions: {info.evictions}, size: {info.currsize}/{info.maxsize}"
+    )
+
+
+def write_slowest(terminalreporter: pytest.TerminalReporter, count: int) -> None:
+    from django_perf_rec.timings import timings
+
+    slowest = timings.slowest(count)
+    if not slowest:
+        return
+
+    terminalreporter.write_sep(
+        "-", f"django-perf-rec slowest {len(slowest)} operations"
+    )
+    for key, stats in slowest:
+        terminalreporter.write_line(
+            f"{stats['p95_ms']:10.3f}ms p95 {stats['p50_ms']:10.3f}ms p50 "
+            + f"{stats['max_ms']:10.3f}ms max {stats['count']:6d}x  {key}"
+        )
+
+
+def write_pruned(terminalreporter: pytest.TerminalReporter, dry_run: bool) -> None:
+    assert pruned is not None
+    if dry_run:
+        terminalreporter.write_sep("-", "django-perf-rec records to prune")
+    else:
+        terminalreporter.write_sep("-", "django-perf-rec pruned records")
+    if not pruned:
+        terminalreporter.write_line("No unused records.")
+    for file_name, record_names in pruned.items():
+        plural = "" if len(record_names) == 1 else "s"
+        terminalreporter.write_line(f"{file_name}: {len(record_names)} record{plural}")
+        for record_name in record_names:
+            terminalreporter.write_line(f"  {record_name}")
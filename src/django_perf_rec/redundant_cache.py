@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import warnings
+from collections import Counter
+from types import TracebackType
+from typing import Any, Literal
+
+from django_perf_rec.cache import AllCacheRecorder, CacheOp
+from django_perf_rec.operation import Callsite, Operation, library_prefixes
+
+
+class RedundantCacheOpWarning(UserWarning):
+    """
+    Warns of cache operations that could be avoided or combined.
+    """
+
+
+# Operations that read keys, and those that change them
+fetch_operations = frozenset(("get", "get_many", "get_or_set"))
+write_operations = frozenset(("add", "decr", "incr", "set", "set_many"))
+delete_operations = frozenset(("delete", "delete_many"))
+
+# Marks a key whose value this block doesn't know
+unknown = object()
+
+
+class RedundantCacheOpDetector:
+    """
+    Looks through the cache operations run inside it for ones that could be
+    avoided or combined:
+
+    * fetching a key again, with no write to it since the last fetch
+    * setting a key to the value it was just fetched with
+    * consecutive get() calls from the same line, for at least
+      get_many_threshold different keys, which could be one get_many()
+    * deleting a key that isn't set
+
+    Values are compared with the cache's own return values, so operations
+    are analysed with their raw keys, rather than the cleaned ones in
+    records.
+    """
+
+    def __init__(
+        self,
+        action: Literal["error", "warning"] = "error",
+        get_many_threshold: int = 3,
+    ) -> None:
+        assert action in ("error", "warning")
+        assert get_many_threshold >= 2, "get_many_threshold must be at least 2"
+        self.action = action
+        self.get_many_threshold = get_many_threshold
+        self.ops: list[CacheOp] = []
+        self.cache_recorder = AllCacheRecorder(self.on_op)
+
+    def __enter__(self) -> RedundantCacheOpDetector:
+        self.cache_recorder.__enter__()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        self.cache_recorder.__exit__(exc_type, exc_value, exc_traceback)
+
+        if exc_type is None:
+            self.check()
+
+    def on_op(self, op: Operation) -> None:
+        if isinstance(op, CacheOp):
+            self.ops.append(op)
+
+    def findings(self) -> Counter[tuple[str, Callsite | None]]:
+        """
+        Return descriptions of redundant operations, with the callsite of
+        each, counted.
+        """
+        findings: Counter[tuple[str, Callsite | None]] = Counter()
+        # By alias, the values of keys, unknown if not fetched since the
+        # last write, or None if known to be missing
+        values: dict[str, dict[str, Any]] = {}
+        # By alias, whether each key has been fetched since the last write
+        fetched: dict[str, set[str]] = {}
+        # Consecutive get() calls on the same alias from the same callsite
+        get_run: list[CacheOp] = []
+        get_run_callsite: Callsite | None = None
+
+        for op in self.ops:
+            alias_values = values.setdefault(op.alias, {})
+            alias_fetched = fetched.setdefault(op.alias, set())
+            callsite = op.callsite(library_prefixes)
+
+            if (
+                op.operation == "get"
+                and get_run
+                and get_run[-1].alias == op.alias
+                and get_run_callsite == callsite
+            ):
+                get_run.append(op)
+            else:
+                self.check_get_run(get_run, get_run_callsite, findings)
+                get_run = [op] if op.operation == "get" else []
+                get_run_callsite = callsite
+
+            if op.operation in fetch_operations:
+                if isinstance(op.result, dict):
+                    results = op.result
+                else:
+                    results = {op.raw_keys[0]: op.result}
+                for key in op.raw_keys:
+                    if key in alias_fetched:
+                        findings[
+                            (f"repeated fetch: {op.name} of {key!r}", callsite)
+                        ] += 1
+                    alias_fetched.add(key)
+                    alias_values[key] = results.get(key)
+            elif op.operation in write_operations:
+                for key in op.raw_keys:
+                    old_value = alias_values.get(key, unknown)
+                    if (
+                        op.values is not None
+                        and key in alias_fetched
+                        and old_value is not None
+                        and old_value is not unknown
+                        and safe_equal(op.values.get(key, unknown), old_value)
+                    ):
+                        findings[
+                            (
+                                f"unchanged set: {op.name} of {key!r} to the value "
+                                + "just fetched",
+                                callsite,
+                            )
+                        ] += 1
+                    alias_fetched.discard(key)
+                    alias_values[key] = unknown
+            elif op.operation in delete_operations:
+                for key in op.raw_keys:
+                    if op.result is False or (
+                        key in alias_values and alias_values[key] is None
+                    ):
+                        findings[
+                            (f"needless delete: {op.name} of unset {key!r}", callsite)
+                        ] += 1
+                    alias_fetched.discard(key)
+                    alias_values[key] = None
+
+        self.check_get_run(get_run, get_run_callsite, findings)
+        return findings
+
+    def check_get_run(
+        self,
+        get_run: list[CacheOp],
+        callsite: Callsite | None,
+        findings: Counter[tuple[str, Callsite | None]],
+    ) -> None:
+        keys = {key for op in get_run for key in op.raw_keys}
+        if len(keys) >= self.get_many_threshold:
+            findings[
+                (
+                    f"get loop: {len(get_run)} x {get_run[0].name} of different "
+                    + "keys could be one get_many()",
+                    callsite,
+                )
+            ] += 1
+
+    def check(self) -> None:
+        findings = self.findings()
+        if not findings:
+            return
+
+        lines = ["Redundant cache operations:"]
+        for (description, callsite), count in findings.items():
+            if count > 1:
+                description += f" ({count} times)"
+            lines.append(f"  {description}")
+            if callsite is not None:
+                filename, lineno, function = callsite
+                lines.append(f"    from {filename}:{lineno} in {function}")
+        message = "\n".join(lines)
+
+        if self.action == "error":
+            raise AssertionError(message)
+        warnings.warn(message, RedundantCacheOpWarning, stacklevel=3)
+
+
+def safe_equal(a: Any, b: Any) -> bool:
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+def detect_redundant_cache_ops(
+    action: Literal["error", "warning"] = "error", get_many_threshold: int = 3
+) -> RedundantCacheOpDetector:
+    """
+    Report cache operations inside the block that could be avoided or
+    combined, by raising an AssertionError or warning.
+    """
+    return RedundantCacheOpDetector(action, get_many_threshold)
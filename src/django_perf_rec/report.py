@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import subprocess
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from types import TracebackType
+from typing import IO, Any
+
+from django_perf_rec.sql import sql_tables
+from django_perf_rec.storage import detect_storage, get_backend, is_perf_file
+from django_perf_rec.types import PerformanceRecord
+from django_perf_rec.yaml import KVFile, get_journal_path
+
+RecordChange = dict[str, Any]
+
+
+def record_counts(record: PerformanceRecord) -> Counter[str]:
+    """
+    Count the operations in a record by fingerprint, as 'name: query' like
+    timing keys, counting items with a 'repeat' count that many times.
+    """
+    counts: Counter[str] = Counter()
+    for item in record:
+        repeat = item.get("repeat", 1)
+        assert isinstance(repeat, int)
+        for name, query in item.items():
+            if name not in ("repeat", "traceback"):
+                counts[f"{name}: {query}"] += repeat
+    return counts
+
+
+def is_query(fingerprint: str) -> bool:
+    return fingerprint.startswith(("db: ", "db|"))
+
+
+def is_cache_op(fingerprint: str) -> bool:
+    return fingerprint.startswith("cache|")
+
+
+class Report:
+    """
+    Compares the records of performance files, one file at a time, yielding
+    the changes to each record, and keeping totals across the changed
+    records only, so they don't depend on which files happen to differ.
+    """
+
+    def __init__(self) -> None:
+        self.changed_records = 0
+        self.totals: dict[str, dict[str, int]] = {
+            "queries": {"old": 0, "new": 0},
+            "cache_ops": {"old": 0, "new": 0},
+        }
+        self.tables: dict[str, dict[str, int]] = {}
+        # Tables by query fingerprint, since fingerprints repeat a lot
+        self.query_tables: dict[str, list[str]] = {}
+
+    def compare_file(
+        self,
+        file_name: str,
+        old_records: dict[str, PerformanceRecord],
+        new_records: dict[str, PerformanceRecord],
+    ) -> Iterator[RecordChange]:
+        for record_name in sorted(old_records.keys() | new_records.keys()):
+            old_record = old_records.get(record_name)
+            new_record = new_records.get(record_name)
+            old_counts = record_counts(old_record or [])
+            new_counts = record_counts(new_record or [])
+            if old_record is not None and new_record is not None:
+                if old_counts == new_counts:
+                    continue
+                status = "changed"
+            elif old_record is None:
+                status = "added"
+            else:
+                status = "removed"
+
+            self.changed_records += 1
+            self.add_totals("old", old_counts)
+            self.add_totals("new", new_counts)
+            yield {
+                "file": file_name,
+                "record": record_name,
+                "status": status,
+                "queries": count_change(old_counts, new_counts, is_query),
+                "cache_ops": count_change(old_counts, new_counts, is_cache_op),
+                "added": dict(sorted((new_counts - old_counts).items())),
+                "removed": dict(sorted((old_counts - new_counts).items())),
+            }
+
+    def add_totals(self, side: str, counts: Counter[str]) -> None:
+        for fingerprint, count in counts.items():
+            if is_cache_op(fingerprint):
+                self.totals["cache_ops"][side] += count
+            elif is_query(fingerprint):
+                self.totals["queries"][side] += count
+                for table in self.get_tables(fingerprint):
+                    table_totals = self.tables.get(table)
+                    if table_totals is None:
+                        table_totals = self.tables[table] = {"old": 0, "new": 0}
+                    table_totals[side] += count
+
+    def get_tables(self, fingerprint: str) -> list[str]:
+        tables = self.query_tables.get(fingerprint)
+        if tables is None:
+            query = fingerprint.partition(": ")[2]
+            tables = self.query_tables[fingerprint] = sql_tables(query)
+        return tables
+
+    def changed_tables(self) -> dict[str, dict[str, int]]:
+        return {
+            table: totals
+            for table, totals in sorted(self.tables.items())
+            if totals["old"] != totals["new"]
+        }
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "changed_records": self.changed_records,
+            "totals": self.totals,
+            "tables": self.changed_tables(),
+        }
+
+
+def count_change(
+    old_counts: Counter[str], new_counts: Counter[str], kind: Callable[[str], bool]
+) -> dict[str, int]:
+    return {
+        "old": sum(count for key, count in old_counts.items() if kind(key)),
+        "new": sum(count for key, count in new_counts.items() if kind(key)),
+    }
+
+
+class DirectorySource:
+    """
+    Reads performance files from a directory, including their journals.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def __enter__(self) -> DirectorySource:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        pass
+
+    def list_files(self) -> dict[str, str]:
+        """
+        Return the performance files, relative to the directory, with a
+        digest of each and its journal, that changes whenever either does.
+        """
+        files = {}
+        for dir_path, _, names in os.walk(self.directory):
+            for name in names:
+                if is_perf_file(name):
+                    path = os.path.join(dir_path, name)
+                    digest = hashlib.sha1(usedforsecurity=False)
+                    for digest_path in (path, get_journal_path(path)):
+                        try:
+                            with open(digest_path, "rb") as fp:
+                                digest.update(fp.read())
+                        except FileNotFoundError:
+                            pass
+                        digest.update(b"\0")
+                    files[os.path.relpath(path, self.directory)] = digest.hexdigest()
+        return files
+
+    def load(self, file_name: str) -> dict[str, PerformanceRecord]:
+        return KVFile.load_file(os.path.join(self.directory, file_name))
+
+
+class GitSource:
+    """
+    Reads performance files from a git revision, through a single
+    'git cat-file --batch' process, so each file costs no extra process.
+    File names are relative to the repository root. Journals aren't read,
+    since they're not usually committed.
+    """
+
+    def __init__(self, revision: str, paths: Sequence[str]) -> None:
+        self.revision = revision
+        self.paths = paths
+        self.process: subprocess.Popen[bytes] | None = None
+        # Object IDs by file name, from list_files()
+        self.files: dict[str, str] = {}
+
+    def __enter__(self) -> GitSource:
+        self.process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_traceback: TracebackType | None,
+    ) -> None:
+        assert self.process is not None
+        # Closes the pipes, ending cat-file, and waits for it
+        with self.process:
+            pass
+        self.process = None
+
+    def list_files(self) -> dict[str, str]:
+        """
+        Return the performance files in the revision, with their object IDs.
+        """
+        output = subprocess.run(
+            ["git", "ls-tree", "-r", "-z", "--full-name", self.revision, "--"]
+            + list(self.paths),
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout.decode()
+        files = {}
+        for line in output.split("\0"):
+            info, _, file_name = line.partition("\t")
+            if is_perf_file(file_name):
+                files[file_name] = info.split()[2]
+        self.files = files
+        return files
+
+    def load(self, file_name: str) -> dict[str, PerformanceRecord]:
+        assert self.process is not None
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+        stdin.write(self.files[file_name].encode() + b"\n")
+        stdin.flush()
+        size = int(stdout.readline().split()[2])
+        content = stdout.read(size)
+        stdout.read(1)  # Trailing newline
+        detected = detect_storage(file_name)
+        assert detected is not None
+        return get_backend(*detected).parse(file_name, content)
+
+
+def compare(
+    report: Report,
+    old_source: DirectorySource | GitSource,
+    new_source: DirectorySource | GitSource,
+) -> Iterator[RecordChange]:
+    """
+    Yield the changed records between two sources, loading one pair of files
+    at a time. Files that are identical in both are skipped without loading
+    them, so aren't included in the report's totals.
+    """
+    old_files = old_source.list_files()
+    new_files = new_source.list_files()
+    for file_name in sorted(old_files.keys() | new_files.keys()):
+        old_version = old_files.get(file_name)
+        new_version = new_files.get(file_name)
+        if old_version == new_version:
+            continue
+        yield from report.compare_file(
+            file_name,
+            {} if old_version is None else old_source.load(file_name),
+            {} if new_version is None else new_source.load(file_name),
+        )
+
+
+def format_change(old: int, new: int) -> str:
+    if old == new:
+        return str(new)
+    return f"{old} -> {new} ({new - old:+d})"
+
+
+def write_text(report: Report, changes: Iterable[RecordChange], fp: IO[str]) -> None:
+    file_name = None
+    for change in changes:
+        if change["file"] != file_name:
+            file_name = change["file"]
+            fp.write(f"{file_name}\n")
+        status = "" if change["status"] == "changed" else f" ({change['status']})"
+        fp.write(
+            f"  {change['record']}{status}: queries "
+            + format_change(**change["queries"])
+            + ", cache operations "
+            + format_change(**change["cache_ops"])
+            + "\n"
+        )
+        for sign, fingerprints in (("+", change["added"]), ("-", change["removed"])):
+            for fingerprint, count in fingerprints.items():
+                times = f" ({count} times)" if count > 1 else ""
+                fp.write(f"    {sign} {fingerprint}{times}\n")
+
+    if report.changed_records == 0:
+        fp.write("No changed records.\n")
+        return
+
+    tables = report.changed_tables()
+    if tables:
+        fp.write("Tables:\n")
+        for table, totals in tables.items():
+            fp.write(f"  {table}: {format_change(**totals)}\n")
+    fp.write(
+        f"Total: {report.changed_records} changed records, queries "
+        + format_change(**report.totals["queries"])
+        + ", cache operations "
+        + format_change(**report.totals["cache_ops"])
+        + "\n"
+    )
+
+
+def write_json(report: Report, changes: Iterable[RecordChange], fp: IO[str]) -> None:
+    # Written a record at a time, so the changes aren't all held in memory
+    fp.write('{"records": [')
+    separator = "\n"
+    for change in changes:
+        fp.write(separator + json.dumps(change, ensure_ascii=False))
+        separator = ",\n"
+    summary = json.dumps(report.summary(), ensure_ascii=False)
+    fp.write("\n], " + summary[1:] + "\n")
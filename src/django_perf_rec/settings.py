@@ -1,28 +1,166 @@
 from __future__ import annotations
 
+from collections.abc import Callable
 from typing import Any, Literal
 
 from django.conf import settings
 
 
 class Settings:
-    defaults = {"HIDE_COLUMNS": True, "MODE": "once"}
+    defaults = {
+        "CACHE_KEY_PATTERNS": None,
+        "CAPTURE_THREADS": False,
+        "COLLAPSE_REPEATS": False,
+        "COMPRESSION": None,
+        "DB_RECORDER": "execute_wrapper",
+        "FINGERPRINT_CACHE_PATH": None,
+        "FINGERPRINT_CACHE_SIZE": 500,
+        "FINGERPRINT_ENGINE": "sqlparse",
+        "HIDE_COLUMNS": True,
+        "LOAD_CACHE_SIZE": 10_000,
+        "MODE": "once",
+        "N_PLUS_ONE_ACTION": "error",
+        "N_PLUS_ONE_THRESHOLD": None,
+        "REDUNDANT_CACHE_OPS": None,
+        "SAMPLING_FLUSH_INTERVAL": 60,
+        "SAMPLING_MAX_FINGERPRINTS": 100,
+        "SAMPLING_OUTPUT": None,
+        "SAMPLING_RATE": 0,
+        "STORAGE": "yaml",
+        "TIMINGS": False,
+        "WRITE_MODE": "immediate",
+    }
 
     def get_setting(self, key: str) -> Any:
+        # Without raising KeyError for unset keys, as some settings are read
+        # for every operation
         try:
-            return settings.PERF_REC[key]
-        except (AttributeError, KeyError):
+            perf_rec = settings.PERF_REC
+        except AttributeError:
             return self.defaults.get(key, None)
+        return perf_rec.get(key, self.defaults.get(key, None))
+
+    @property
+    def CACHE_KEY_PATTERNS(self) -> tuple[str, ...] | None:
+        value = self.get_setting("CACHE_KEY_PATTERNS")
+        if value is None:
+            return None
+        assert isinstance(value, (list, tuple))
+        assert all(isinstance(pattern, str) for pattern in value)
+        return tuple(value)
+
+    @property
+    def CAPTURE_THREADS(self) -> bool:
+        return bool(self.get_setting("CAPTURE_THREADS"))
+
+    @property
+    def COLLAPSE_REPEATS(self) -> bool:
+        return bool(self.get_setting("COLLAPSE_REPEATS"))
+
+    @property
+    def COMPRESSION(self) -> Literal["gzip", "zstd"] | None:
+        value = self.get_setting("COMPRESSION")
+        assert value in (None, "gzip", "zstd")
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def DB_RECORDER(self) -> Literal["debug_cursor", "execute_wrapper"]:
+        value = self.get_setting("DB_RECORDER")
+        assert value in ("debug_cursor", "execute_wrapper")
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def FINGERPRINT_CACHE_PATH(self) -> str | None:
+        value = self.get_setting("FINGERPRINT_CACHE_PATH")
+        if value is None:
+            return None
+        return str(value)
+
+    @property
+    def FINGERPRINT_CACHE_SIZE(self) -> int:
+        value = self.get_setting("FINGERPRINT_CACHE_SIZE")
+        assert isinstance(value, int) and value >= 0
+        return value
+
+    @property
+    def FINGERPRINT_ENGINE(self) -> Literal["native", "sqlparse"]:
+        value = self.get_setting("FINGERPRINT_ENGINE")
+        assert value in ("native", "sqlparse")
+        return value  # type: ignore [no-any-return]
 
     @property
     def HIDE_COLUMNS(self) -> bool:
         return bool(self.get_setting("HIDE_COLUMNS"))
 
+    @property
+    def LOAD_CACHE_SIZE(self) -> int:
+        value = self.get_setting("LOAD_CACHE_SIZE")
+        assert isinstance(value, int) and value >= 0
+        return value
+
     @property
     def MODE(self) -> Literal["all", "none", "once", "overwrite"]:
         value = self.get_setting("MODE")
         assert value in ("all", "none", "once", "overwrite")
         return value  # type: ignore [no-any-return]
 
+    @property
+    def N_PLUS_ONE_ACTION(self) -> Literal["error", "warning"]:
+        value = self.get_setting("N_PLUS_ONE_ACTION")
+        assert value in ("error", "warning")
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def N_PLUS_ONE_THRESHOLD(self) -> int | None:
+        value = self.get_setting("N_PLUS_ONE_THRESHOLD")
+        assert value is None or (isinstance(value, int) and value >= 2)
+        return value
+
+    @property
+    def REDUNDANT_CACHE_OPS(self) -> Literal["error", "warning"] | None:
+        value = self.get_setting("REDUNDANT_CACHE_OPS")
+        assert value in (None, "error", "warning")
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def SAMPLING_FLUSH_INTERVAL(self) -> float:
+        value = self.get_setting("SAMPLING_FLUSH_INTERVAL")
+        assert isinstance(value, (int, float)) and value > 0
+        return value
+
+    @property
+    def SAMPLING_MAX_FINGERPRINTS(self) -> int:
+        value = self.get_setting("SAMPLING_MAX_FINGERPRINTS")
+        assert isinstance(value, int) and value >= 0
+        return value
+
+    @property
+    def SAMPLING_OUTPUT(self) -> str | Callable[[dict[str, Any]], None] | None:
+        value = self.get_setting("SAMPLING_OUTPUT")
+        assert value is None or isinstance(value, str) or callable(value)
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def SAMPLING_RATE(self) -> float:
+        value = self.get_setting("SAMPLING_RATE")
+        assert isinstance(value, (int, float)) and 0 <= value <= 1
+        return value
+
+    @property
+    def STORAGE(self) -> Literal["json", "sqlite", "yaml"]:
+        value = self.get_setting("STORAGE")
+        assert value in ("json", "sqlite", "yaml")
+        return value  # type: ignore [no-any-return]
+
+    @property
+    def TIMINGS(self) -> bool:
+        return bool(self.get_setting("TIMINGS"))
+
+    @property
+    def WRITE_MODE(self) -> Literal["deferred", "immediate", "journal"]:
+        value = self.get_setting("WRITE_MODE")
+        assert value in ("deferred", "immediate", "journal")
+        return value  # type: ignore [no-any-return]
+
 
 perf_rec_settings = Settings()
@@ -1,19 +1,280 @@
 from __future__ import annotations
 
-from functools import lru_cache
-from typing import Any
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import warnings
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import cache, lru_cache
+from typing import Any, NamedTuple
 
+import sqlparse
 from sqlparse import parse, tokens
+from sqlparse.lexer import Lexer
 from sqlparse.sql import Comment, IdentifierList, Parenthesis, Token, TokenList
 
 
-@lru_cache(maxsize=500)
-def sql_fingerprint(query: str, hide_columns: bool = True) -> str:
+class FingerprintCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class FingerprintCache:
+    """
+    A least-recently-used cache of query fingerprints. Entries are keyed on a
+    digest of the query, so large queries aren't kept alive by the cache.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict[tuple[bytes, bool, str], str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(query: str, hide_columns: bool, engine: str) -> tuple[bytes, bool, str]:
+        digest = hashlib.blake2b(query.encode(), digest_size=16).digest()
+        return (digest, hide_columns, engine)
+
+    def get(self, key: tuple[bytes, bool, str]) -> str | None:
+        with self.lock:
+            try:
+                fingerprint = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return fingerprint
+
+    def set(self, key: tuple[bytes, bool, str], fingerprint: str) -> None:
+        if self.maxsize == 0:
+            return
+        with self.lock:
+            self.entries[key] = fingerprint
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def resize(self, maxsize: int) -> None:
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    def evict(self) -> None:
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def info(self) -> FingerprintCacheInfo:
+        with self.lock:
+            return FingerprintCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                maxsize=self.maxsize,
+                currsize=len(self.entries),
+            )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+fingerprint_cache = FingerprintCache(maxsize=500)
+
+# Bump whenever the native engine's output changes, to invalidate persistent
+# caches.
+NATIVE_ENGINE_VERSION = 1
+
+
+class PersistentFingerprintCache:
+    """
+    A fingerprint cache stored in a SQLite database, so fingerprints can be
+    shared between test runs and processes such as pytest-xdist workers.
+    Entries are keyed on the sqlparse and native engine versions, so upgrades
+    don't reuse stale fingerprints.
+
+    SQLite's WAL mode allows concurrent readers alongside a writer, and its
+    busy timeout makes writers wait for each other. Any database error
+    disables the cache for the rest of the process, with a warning, rather
+    than failing tests.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.version = (
+            f"sqlparse=={sqlparse.__version__};native=={NATIVE_ENGINE_VERSION}"
+        )
+        self.local = threading.local()
+        self.disabled = False
+        # Every connection opened, with the process that opened it, so
+        # close() can close those of all threads. Bumping the generation
+        # makes threads open new connections after close().
+        self.connections: list[tuple[int, sqlite3.Connection]] = []
+        self.connections_lock = threading.Lock()
+        self.generation = 0
+
+    def connection(self) -> sqlite3.Connection:
+        # Connections can't be shared between threads or forked processes.
+        pid = os.getpid()
+        connection: sqlite3.Connection | None = getattr(self.local, "connection", None)
+        if (
+            connection is None
+            or self.local.pid != pid
+            or self.local.generation != self.generation
+        ):
+            # Only used by this thread, but closed from whichever calls close()
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            with self.connections_lock:
+                self.connections.append((pid, connection))
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    digest BLOB NOT NULL,
+                    hide_columns INTEGER NOT NULL,
+                    engine TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (digest, hide_columns, engine, version)
+                ) WITHOUT ROWID
+                """
+            )
+            self.local.connection = connection
+            self.local.pid = pid
+            self.local.generation = self.generation
+        return connection
+
+    def close(self) -> None:
+        """
+        Close the connections this process opened, in any thread.
+        """
+        pid = os.getpid()
+        with self.connections_lock:
+            connections = self.connections
+            self.connections = []
+            self.generation += 1
+        for connection_pid, connection in connections:
+            # A forked child mustn't close its parent's connections
+            if connection_pid == pid:
+                connection.close()
+
+    def get(self, key: tuple[bytes, bool, str]) -> str | None:
+        if self.disabled:
+            return None
+        try:
+            row = (
+                self.connection()
+                .execute(
+                    """
+                    SELECT fingerprint FROM fingerprints
+                    WHERE digest = ? AND hide_columns = ? AND engine = ?
+                    AND version = ?
+                    """,
+                    (*key, self.version),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as exc:
+            self.disable(exc)
+            return None
+        if row is None:
+            return None
+        return row[0]  # type: ignore [no-any-return]
+
+    def set(self, key: tuple[bytes, bool, str], fingerprint: str) -> None:
+        if self.disabled:
+            return
+        try:
+            self.connection().execute(
+                """
+                INSERT OR IGNORE INTO fingerprints
+                (digest, hide_columns, engine, version, fingerprint)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (*key, self.version, fingerprint),
+            )
+        except sqlite3.Error as exc:
+            self.disable(exc)
+
+    def disable(self, exc: sqlite3.Error) -> None:
+        self.disabled = True
+        warnings.warn(
+            f"django-perf-rec: disabling the fingerprint cache at {self.path!r}"
+            + f" after a database error: {exc}",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+
+
+@cache
+def get_persistent_fingerprint_cache(path: str) -> PersistentFingerprintCache:
+    persistent_cache = PersistentFingerprintCache(path)
+    atexit.register(persistent_cache.close)
+    return persistent_cache
+
+
+def sql_fingerprint(
+    query: str,
+    hide_columns: bool = True,
+    engine: str = "sqlparse",
+    cache_size: int = 500,
+    cache_path: str | None = None,
+) -> str:
     """
     Simplify a query, taking away exact values and fields selected.
 
     Imperfect but better than super explicit, value-dependent queries.
+
+    The 'native' engine handles the SQL Django generates in a single pass,
+    falling back to sqlparse for anything else.
+
+    Fingerprints are cached in fingerprint_cache, which is resized to
+    cache_size if that has changed. If cache_path is given, misses are then
+    looked up in a persistent cache stored at that path.
     """
+    if cache_size != fingerprint_cache.maxsize:
+        fingerprint_cache.resize(cache_size)
+
+    key = fingerprint_cache.key(query, hide_columns, engine)
+    fingerprint = fingerprint_cache.get(key)
+    if fingerprint is None:
+        if cache_path is not None:
+            persistent_cache = get_persistent_fingerprint_cache(cache_path)
+            fingerprint = persistent_cache.get(key)
+            if fingerprint is None:
+                fingerprint = uncached_sql_fingerprint(query, hide_columns, engine)
+                persistent_cache.set(key, fingerprint)
+        else:
+            fingerprint = uncached_sql_fingerprint(query, hide_columns, engine)
+        fingerprint_cache.set(key, fingerprint)
+    return fingerprint
+
+
+def uncached_sql_fingerprint(query: str, hide_columns: bool, engine: str) -> str:
+    if engine == "native":
+        fingerprint = native_sql_fingerprint(query, hide_columns=hide_columns)
+        if fingerprint is not None:
+            return fingerprint
+    return sqlparse_sql_fingerprint(query, hide_columns=hide_columns)
+
+
+def sqlparse_sql_fingerprint(query: str, hide_columns: bool = True) -> str:
     parsed_queries = parse(query)
 
     if not parsed_queries:
@@ -159,3 +420,628 @@ def sql_recursively_simplify(node: TokenList, hide_columns: bool = True) -> None
 
         if not token.is_whitespace:
             prev_word_token = token
+
+
+class NativeUnsupported(Exception):
+    """
+    Raised when the native engine meets SQL it doesn't recognize.
+    """
+
+
+_native_token_re = re.compile(
+    r"""
+    (?P<space>\x20)?
+    (?:
+        (?P<qname>"[^"\\]+"(?!")|`[^`\\]+`(?!`))
+      | (?P<string>'(?:[^'\\]|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?)(?![\w.])
+      | (?P<word>[A-Za-z][A-Za-z0-9_]*)(?![$#])
+      | (?P<punct>[(),.])
+      | (?P<op>(?:[<>=!]+|[-+*/]|\|\|)(?=\x20))
+      | (?P<star>\*)
+    )
+    """,
+    re.VERBOSE,
+)
+
+_native_comparison_ops = frozenset(("=", "<>", "!=", "<", ">", "<=", ">="))
+_native_arithmetic_ops = frozenset(("+", "-", "*", "/", "||"))
+# Words that sqlparse lexes as keywords, even when directly followed by a
+# parenthesis.
+_native_non_function_words = frozenset(("CASE", "IN", "VALUES", "USING", "FROM", "AS"))
+_native_join_words = (("INNER", "JOIN"), ("LEFT", "OUTER", "JOIN"))
+
+NativeToken = tuple[str, str, bool]
+
+
+@lru_cache(maxsize=1000)
+def _native_word_ttype(word: str) -> Any:
+    return Lexer.get_default_instance().is_keyword(word)[0]  # type: ignore [no-untyped-call]
+
+
+def native_tokenize(query: str) -> list[NativeToken]:
+    """
+    Split a query into (kind, text, preceded_by_space) tuples, raising
+    NativeUnsupported for any whitespace or characters that sqlparse might
+    treat differently.
+    """
+    if query.endswith(" "):
+        raise NativeUnsupported()
+    result = []
+    pos = 0
+    end = len(query)
+    match = _native_token_re.match
+    while pos < end:
+        m = match(query, pos)
+        if m is None:
+            raise NativeUnsupported()
+        kind = m.lastgroup
+        assert kind is not None
+        result.append((kind, m.group(kind), m.start("space") != -1))
+        pos = m.end()
+    return result
+
+
+class NativeFingerprinter:
+    """
+    A single-pass recursive descent fingerprinter for the SQL that Django's
+    query compiler emits. It produces the same output as the sqlparse engine
+    for the statements it understands, and raises NativeUnsupported for
+    anything else.
+    """
+
+    def __init__(self, tokens: list[NativeToken], hide_columns: bool) -> None:
+        self.tokens = tokens
+        self.pos = 0
+        self.hide_columns = hide_columns
+
+    def fingerprint(self) -> str:
+        if self.at_word("SELECT"):
+            result = self.select()
+        elif self.at_word("INSERT"):
+            result = self.insert()
+        elif self.at_word("UPDATE"):
+            result = self.update()
+        elif self.at_word("DELETE"):
+            result = self.delete()
+        elif self.at_word("DECLARE"):
+            result = self.declare()
+        else:
+            result = self.transaction()
+        if self.pos != len(self.tokens):
+            raise NativeUnsupported()
+        return result.strip()
+
+    # Token helpers
+
+    def peek(self, offset: int = 0) -> NativeToken | None:
+        index = self.pos + offset
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return None
+
+    def at(self, kind: str, *texts: str, offset: int = 0) -> bool:
+        token = self.peek(offset)
+        return token is not None and token[0] == kind and token[1] in texts
+
+    def at_word(self, *words: str, offset: int = 0) -> bool:
+        return self.at("word", *words, offset=offset)
+
+    def at_punct(self, punct: str, offset: int = 0) -> bool:
+        return self.at("punct", punct, offset=offset)
+
+    def take(self, replacement: str | None = None) -> str:
+        token = self.peek()
+        if token is None:
+            raise NativeUnsupported()
+        self.pos += 1
+        text = token[1] if replacement is None else replacement
+        return " " + text if token[2] else text
+
+    def expect_word(self, word: str) -> str:
+        if not self.at_word(word):
+            raise NativeUnsupported()
+        return self.take()
+
+    def expect_punct(self, punct: str, *, space: bool) -> str:
+        token = self.peek()
+        if token is None or token[0] != "punct" or token[1] != punct:
+            raise NativeUnsupported()
+        if token[2] != space:
+            raise NativeUnsupported()
+        return self.take()
+
+    def open_paren(self, *, space: bool) -> str:
+        text = self.expect_punct("(", space=space)
+        # sqlparse trims whitespace inside parentheses.
+        token = self.peek()
+        if token is None or token[2]:
+            raise NativeUnsupported()
+        return text
+
+    def close_paren(self) -> str:
+        return self.expect_punct(")", space=False)
+
+    def collapsed(self, start: int) -> str:
+        return " ..." if self.tokens[start][2] else "..."
+
+    # Statements
+
+    def transaction(self) -> str:
+        if len(self.tokens) == 1 and self.at_word("BEGIN", "COMMIT", "ROLLBACK"):
+            return self.take()
+
+        # Savepoint names are non-deterministic
+        words = tuple(token[1] for token in self.tokens[:-1])
+        if (
+            words
+            in (
+                ("SAVEPOINT",),
+                ("RELEASE", "SAVEPOINT"),
+                ("ROLLBACK", "TO", "SAVEPOINT"),
+            )
+            and self.tokens[-1][0] == "qname"
+            and all(token[2] for token in self.tokens[1:])
+            and all(token[0] == "word" for token in self.tokens[:-1])
+        ):
+            self.pos = len(self.tokens)
+            return " ".join(words) + " `#`"
+
+        raise NativeUnsupported()
+
+    def declare(self) -> str:
+        result = self.take()
+        token = self.peek()
+        if (
+            token is None
+            or token[0] != "qname"
+            or not token[1].startswith('"_django_curs_')
+        ):
+            raise NativeUnsupported()
+        # Erase volatile part of PG cursor name
+        result += self.take('"_django_curs_#"')
+        while self.at_word("NO", "SCROLL", "CURSOR", "WITH", "WITHOUT", "HOLD"):
+            result += self.take()
+        if self.at_word("FOR"):
+            result += self.take()
+            result += self.select()
+        return result
+
+    def select(self) -> str:
+        result = self.expect_word("SELECT")
+        if self.at_word("DISTINCT"):
+            result += self.take()
+        result += self.item_list(self.select_item, collapse=self.hide_columns)
+        if self.at_word("FROM"):
+            result += self.take()
+            result += self.from_clause()
+        if self.at_word("WHERE"):
+            result += self.take()
+            result += self.condition(where=True)
+        if self.at_word("GROUP") and self.at_word("BY", offset=1):
+            result += self.take() + self.take()
+            result += self.item_list(self.group_item, collapse=False)
+        if self.at_word("HAVING"):
+            result += self.take()
+            result += self.condition(where=False)
+        if self.at_word("ORDER") and self.at_word("BY", offset=1):
+            result += self.take() + self.take()
+            result += self.item_list(self.order_item, collapse=False)
+        if self.at_word("LIMIT"):
+            result += self.take()
+            result += self.number()
+        if self.at_word("OFFSET"):
+            result += self.take()
+            result += self.number()
+        return result
+
+    def insert(self) -> str:
+        result = self.expect_word("INSERT")
+        result += self.expect_word("INTO")
+        result += self.table_name()
+        if self.at_punct("("):
+            result += self.open_paren(space=True)
+            result += self.item_list(self.column_item, collapse=self.hide_columns)
+            result += self.close_paren()
+        result += self.expect_word("VALUES")
+        while True:
+            result += self.open_paren(space=True)
+            result += self.item_list(self.select_item, collapse=self.hide_columns)
+            result += self.close_paren()
+            if not self.at_punct(","):
+                break
+            result += self.expect_punct(",", space=False)
+        result += self.returning()
+        return result
+
+    def update(self) -> str:
+        result = self.expect_word("UPDATE")
+        result += self.table_name()
+        result += self.expect_word("SET")
+        # Erase which fields are being updated, up to the WHERE clause
+        depth = 0
+        while self.pos < len(self.tokens):
+            if depth == 0 and self.at_word("WHERE"):
+                break
+            if self.at_punct("("):
+                depth += 1
+            elif self.at_punct(")"):
+                depth -= 1
+            self.pos += 1
+        if depth != 0:
+            raise NativeUnsupported()
+        result += " ..."
+        if self.at_word("WHERE"):
+            result += self.take()
+            result += self.condition(where=True)
+            result += self.returning()
+        return result
+
+    def delete(self) -> str:
+        result = self.expect_word("DELETE")
+        result += self.expect_word("FROM")
+        result += self.table_name()
+        if self.at_word("WHERE"):
+            result += self.take()
+            result += self.condition(where=True)
+        return result
+
+    def returning(self) -> str:
+        if not self.at_word("RETURNING"):
+            return ""
+        result = self.take()
+        result += self.item_list(self.select_item, collapse=self.hide_columns)
+        return result
+
+    # Clauses
+
+    def table_name(self) -> str:
+        token = self.peek()
+        if token is None or not token[2]:
+            raise NativeUnsupported()
+        if token[0] != "qname" and not (
+            token[0] == "word" and _native_word_ttype(token[1]) is tokens.Name
+        ):
+            raise NativeUnsupported()
+        return self.take()
+
+    def table_ref(self) -> str:
+        if self.at_punct("("):
+            result = self.open_paren(space=True)
+            result += self.select()
+            result += self.close_paren()
+        else:
+            result = self.table_name()
+        token = self.peek()
+        if (
+            token is not None
+            and token[0] == "word"
+            and token[2]
+            and _native_word_ttype(token[1]) is tokens.Name
+        ):
+            result += self.take()
+        return result
+
+    def from_clause(self) -> str:
+        result = self.table_ref()
+        while True:
+            for words in _native_join_words:
+                if all(self.at_word(word, offset=i) for i, word in enumerate(words)):
+                    break
+            else:
+                return result
+            for _ in words:
+                result += self.take()
+            result += self.table_ref()
+            result += self.expect_word("ON")
+            result += self.open_paren(space=True)
+            result += self.condition(where=False)
+            result += self.close_paren()
+
+    def item_list(self, item: Callable[[], tuple[str, bool]], *, collapse: bool) -> str:
+        """
+        Parse a comma separated list. sqlparse groups lists into an
+        IdentifierList only when every item is a single valid token, so
+        anything else is unsupported.
+        """
+        start = self.pos
+        texts = []
+        all_valid = True
+        count = 0
+        while True:
+            text, valid = item()
+            texts.append(text)
+            all_valid = all_valid and valid
+            count += 1
+            if not self.at_punct(","):
+                break
+            texts.append(self.expect_punct(",", space=False))
+        if count == 1:
+            return texts[0]
+        if not all_valid:
+            raise NativeUnsupported()
+        if collapse:
+            return self.collapsed(start)
+        return "".join(texts)
+
+    def select_item(self) -> tuple[str, bool]:
+        text, kind = self.expression()
+        if self.at_word("AS"):
+            if kind == "keyword" and not text.endswith("#"):
+                raise NativeUnsupported()
+            text += self.take()
+            token = self.peek()
+            if token is None or token[0] != "qname":
+                raise NativeUnsupported()
+            text += self.take()
+            return text, True
+        return text, kind != "paren"
+
+    def column_item(self) -> tuple[str, bool]:
+        token = self.peek()
+        if token is None or token[0] != "qname":
+            raise NativeUnsupported()
+        return self.take(), True
+
+    def group_item(self) -> tuple[str, bool]:
+        text, kind = self.expression()
+        return text, kind not in ("paren", "wildcard")
+
+    def order_item(self) -> tuple[str, bool]:
+        text, kind = self.expression()
+        if self.at_word("ASC", "DESC"):
+            text += self.take()
+            return text, kind == "ident"
+        return text, kind not in ("paren", "wildcard")
+
+    def function_argument(self) -> tuple[str, bool]:
+        text, kind = self.expression()
+        if self.at_word("AS"):
+            # CAST(x AS type)
+            if kind == "keyword" and not text.endswith("#"):
+                raise NativeUnsupported()
+            text += self.take()
+            token = self.peek()
+            if token is None or token[0] != "word" or not token[2]:
+                raise NativeUnsupported()
+            if self.at_punct("(", offset=1):
+                text += self.function()
+            else:
+                if _native_word_ttype(token[1]) not in (
+                    tokens.Name,
+                    tokens.Name.Builtin,
+                ):
+                    raise NativeUnsupported()
+                text += self.take()
+            return text, True
+        return text, kind != "paren"
+
+    # Conditions
+
+    def condition(self, *, where: bool) -> str:
+        result = self.predicate(where=where)
+        while self.at_word("AND", "OR"):
+            result += self.take()
+            result += self.predicate(where=where)
+        return result
+
+    def predicate(self, *, where: bool) -> str:
+        if self.at_word("NOT"):
+            # sqlparse reads NOT NULL as one keyword, keeping the NULL
+            if self.at_word("NULL", offset=1):
+                raise NativeUnsupported()
+            return self.take() + self.predicate(where=where)
+
+        if self.at_punct("(") and not self.at_word("SELECT", offset=1):
+            result = self.open_paren(space=self.tokens[self.pos][2])
+            result += self.condition(where=False)
+            result += self.close_paren()
+            return result
+
+        result, _ = self.expression()
+        token = self.peek()
+        if token is None:
+            return result
+        kind, text, _ = token
+        if kind == "op" and text in _native_comparison_ops:
+            result += self.take()
+            result += self.expression()[0]
+        elif kind == "word":
+            if text == "NOT" and self.at_word("IN", "LIKE", "ILIKE", offset=1):
+                result += self.take()
+                token = self.peek()
+                assert token is not None
+                text = token[1]
+            if text == "IN":
+                result += self.take()
+                result += self.in_list(where=where)
+            elif text in ("LIKE", "ILIKE"):
+                result += self.take()
+                result += self.expression()[0]
+            elif text == "IS":
+                result += self.take()
+                if self.at_word("NOT") and self.at_word("NULL", offset=1):
+                    result += self.take() + self.take()
+                elif self.at_word("NULL"):
+                    result += self.take("#")
+                else:
+                    raise NativeUnsupported()
+            elif text == "BETWEEN":
+                result += self.take()
+                result += self.expression()[0]
+                result += self.expect_word("AND")
+                result += self.expression()[0]
+        return result
+
+    def in_list(self, *, where: bool) -> str:
+        result = self.open_paren(space=True)
+        if self.at_word("SELECT"):
+            result += self.select()
+        else:
+            start = self.pos
+            result += self.item_list(self.select_item, collapse=self.hide_columns)
+            # IN clauses with a single simple value in a WHERE simplify to ...
+            if (
+                where
+                and self.pos == start + 1
+                and self.tokens[start][0] in ("number", "string")
+            ):
+                result = result[: -len("#")] + "..."
+        result += self.close_paren()
+        return result
+
+    # Expressions
+
+    def number(self) -> str:
+        token = self.peek()
+        if token is None or token[0] != "number":
+            raise NativeUnsupported()
+        return self.take("#")
+
+    def expression(self) -> tuple[str, str]:
+        """
+        Parse an expression, returning its text and a kind that says how
+        sqlparse would group it.
+        """
+        result, kind = self.operand()
+        while self.at("op", *_native_arithmetic_ops):
+            if kind in ("keyword", "case", "wildcard"):
+                raise NativeUnsupported()
+            result += self.take()
+            text, right_kind = self.operand()
+            if right_kind in ("keyword", "case", "wildcard"):
+                raise NativeUnsupported()
+            result += text
+            kind = "operation"
+        return result, kind
+
+    def operand(self) -> tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise NativeUnsupported()
+        kind, text, _ = token
+
+        if kind in ("number", "string"):
+            return self.take("#"), "literal"
+
+        if kind == "qname":
+            if text.startswith('"_django_curs_'):
+                raise NativeUnsupported()
+            return self.qualified_name(), "ident"
+
+        if kind == "star":
+            return self.take(), "wildcard"
+
+        if kind == "punct" and text == "(":
+            result = self.open_paren(space=token[2])
+            if self.at_word("SELECT"):
+                result += self.select()
+            else:
+                result += self.expression()[0]
+            result += self.close_paren()
+            return result, "paren"
+
+        if kind != "word":
+            raise NativeUnsupported()
+
+        if self.at_punct("(", offset=1) and not self.tokens[self.pos + 1][2]:
+            return self.function(), "function"
+        if self.at_punct(".", offset=1):
+            return self.qualified_name(), "ident"
+        if text == "NULL":
+            return self.take("#"), "keyword"
+        if text == "CASE":
+            return self.case(), "case"
+        if text in ("TRUE", "FALSE", "true", "false"):
+            return self.take(), "keyword"
+        if _native_word_ttype(text) is tokens.Name:
+            return self.take(), "ident"
+        raise NativeUnsupported()
+
+    def qualified_name(self) -> str:
+        result = self.take()
+        if self.at_punct("."):
+            token = self.peek(1)
+            if token is None or token[2]:
+                raise NativeUnsupported()
+            if token[0] != "qname" and not (
+                token[0] == "word" and _native_word_ttype(token[1]) is tokens.Name
+            ):
+                raise NativeUnsupported()
+            if self.tokens[self.pos][2]:
+                raise NativeUnsupported()
+            result += self.take() + self.take()
+        return result
+
+    def function(self) -> str:
+        token = self.peek()
+        assert token is not None
+        if token[1].upper() in _native_non_function_words:
+            raise NativeUnsupported()
+        result = self.take()
+        result += self.open_paren(space=False)
+        if self.at_punct(")"):
+            pass
+        elif self.at("star", "*") and self.at_punct(")", offset=1):
+            result += self.take()
+        elif self.at_word("SELECT"):
+            result += self.select()
+        else:
+            if self.at_word("DISTINCT"):
+                result += self.take()
+            result += self.item_list(self.function_argument, collapse=self.hide_columns)
+        result += self.close_paren()
+        if self.at_word("OVER", "FILTER"):
+            raise NativeUnsupported()
+        return result
+
+    def case(self) -> str:
+        result = self.expect_word("CASE")
+        if not self.at_word("WHEN"):
+            result += self.expression()[0]
+        if not self.at_word("WHEN"):
+            raise NativeUnsupported()
+        while self.at_word("WHEN"):
+            result += self.take()
+            result += self.condition(where=False)
+            result += self.expect_word("THEN")
+            result += self.expression()[0]
+        if self.at_word("ELSE"):
+            result += self.take()
+            result += self.expression()[0]
+        result += self.expect_word("END")
+        return result
+
+
+def native_sql_fingerprint(query: str, hide_columns: bool = True) -> str | None:
+    """
+    Fingerprint a query with the native engine, returning None if it isn't
+    recognized.
+    """
+    try:
+        return NativeFingerprinter(native_tokenize(query), hide_columns).fingerprint()
+    except (NativeUnsupported, RecursionError):
+        return None
+
+
+_table_re = re.compile(
+    r"\b(?:FROM|JOIN|INTO|UPDATE)\s+(?:\"((?:[^\"]|\"\")+)\"|`([^`]+)`|(\w+))",
+    re.IGNORECASE,
+)
+
+
+def sql_tables(query: str) -> list[str]:
+    """
+    Return the names of the tables a query, or its fingerprint, reads from
+    or writes to, in order of first appearance.
+    """
+    tables: dict[str, None] = {}
+    for match in _table_re.finditer(query):
+        quoted, backquoted, bare = match.groups()
+        if quoted is not None:
+            tables[quoted.replace('""', '"')] = None
+        elif backquoted is not None:
+            tables[backquoted] = None
+        elif bare.upper() not in ("SELECT", "LATERAL", "ONLY"):
+            tables[bare] = None
+    return list(tables)
@@ -0,0 +1,12 @@
+from __future__ import annotations
+
+# State of the test session, set by the Pytest plugin. Kept apart from the
+# plugin so that importing django_perf_rec never imports pytest.
+
+# Whether running under Pytest
+in_pytest = False
+# Whether running in a pytest-xdist worker, which leaves writing files to the
+# controller
+xdist_worker = False
+# Whether --perf-rec-prune or --perf-rec-prune-dry-run was passed
+pruning = False
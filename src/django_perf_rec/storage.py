@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import errno
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from collections.abc import Collection
+from typing import Any, BinaryIO
+
+import yaml
+from django.core.files import locks
+
+from django_perf_rec.types import PerformanceRecord
+
+try:
+    from yaml import CSafeDumper, CSafeLoader
+except ImportError:  # pragma: no cover
+    HAVE_LIBYAML = False
+else:
+    HAVE_LIBYAML = True
+
+
+def load_yaml(stream: Any) -> Any:
+    """
+    Load YAML with libyaml's loader if PyYAML was built with it.
+    """
+    if HAVE_LIBYAML:
+        return yaml.load(stream, Loader=CSafeLoader)
+    return yaml.safe_load(stream)
+
+
+# Wide enough not to break most SQL across lines
+yaml_width = 10000
+
+
+def dump_yaml(data: Any, stream: Any) -> None:
+    """
+    Dump YAML with libyaml's dumper if PyYAML was built with it and the data
+    contains nothing it would emit differently from the pure Python dumper,
+    so files are byte-identical regardless of which is used.
+    """
+    if HAVE_LIBYAML and libyaml_dumps_identically(data):
+        dumper: type[yaml.SafeDumper | CSafeDumper] = CSafeDumper
+    else:
+        dumper = yaml.SafeDumper
+    yaml.dump(
+        data,
+        stream,
+        Dumper=dumper,
+        default_flow_style=False,
+        allow_unicode=True,
+        width=yaml_width,
+    )
+
+
+# Outside of these limits, the two dumpers choose different styles: libyaml
+# escapes characters outside the Basic Multilingual Plane, and U+0085 (NEXT
+# LINE), measures when keys need the explicit "? " syntax differently, and
+# writes empty keys with it. They also break long lines, and the
+# double-quoted strings needed for control characters and line breaks,
+# in different places. Strings are limited to half the width, leaving room
+# for their indentation and key.
+_max_libyaml_key_length = 64
+_max_libyaml_string_length = yaml_width // 2
+_max_libyaml_char = "\uffff"
+
+
+def libyaml_dumps_identically(data: Any) -> bool:
+    if isinstance(data, str):
+        return len(data) <= _max_libyaml_string_length and (
+            not data or (data.isprintable() and max(data) <= _max_libyaml_char)
+        )
+    elif isinstance(data, dict):
+        return all(
+            isinstance(key, str)
+            and 0 < len(key) <= _max_libyaml_key_length
+            and key.isascii()
+            and key.isprintable()
+            and libyaml_dumps_identically(value)
+            for key, value in data.items()
+        )
+    elif isinstance(data, list):
+        return all(libyaml_dumps_identically(item) for item in data)
+    return True
+
+
+class Compressor:
+    name: str
+    extension: str
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    name = "gzip"
+    extension = ".gz"
+
+    def compress(self, data: bytes) -> bytes:
+        # Fixed mtime so unchanged records give unchanged files
+        return gzip.compress(data, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    name = "zstd"
+    extension = ".zst"
+
+    def __init__(self) -> None:
+        try:
+            from compression import zstd  # type: ignore [import-not-found]
+        except ImportError:
+            try:
+                import zstandard  # type: ignore [import-not-found]
+            except ImportError:
+                raise ImportError(
+                    "zstd compression requires Python 3.14+ or the zstandard package."
+                ) from None
+            self.compress = zstandard.ZstdCompressor().compress  # type: ignore [method-assign]
+            self.decompress = zstandard.ZstdDecompressor().decompress  # type: ignore [method-assign]
+        else:
+            self.compress = zstd.compress  # type: ignore [method-assign]
+            self.decompress = zstd.decompress  # type: ignore [method-assign]
+
+
+compressors: dict[str, type[Compressor]] = {
+    "gzip": GzipCompressor,
+    "zstd": ZstdCompressor,
+}
+
+
+class StorageBackend:
+    """
+    Stores the records of a single performance file.
+    """
+
+    name: str
+    extension: str
+
+    def load(self, file_name: str) -> dict[str, PerformanceRecord]:
+        raise NotImplementedError
+
+    def parse(self, file_name: str, content: bytes) -> dict[str, PerformanceRecord]:
+        """
+        Return the records in the content of a file, such as a version read
+        from git, rather than from the file itself.
+        """
+        raise NotImplementedError
+
+    def save(self, file_name: str, records: dict[str, PerformanceRecord]) -> None:
+        """
+        Merge records into the file, without losing records saved concurrently
+        by other processes.
+        """
+        raise NotImplementedError
+
+    def delete(self, file_name: str, names: Collection[str]) -> None:
+        """
+        Remove records from the file, without losing records saved concurrently
+        by other processes. Missing records and files are ignored.
+        """
+        raise NotImplementedError
+
+
+class DocumentBackend(StorageBackend):
+    """
+    Stores records as a single serialized document, optionally compressed.
+    """
+
+    def __init__(self, compressor: Compressor | None = None) -> None:
+        self.compressor = compressor
+
+    def loads(self, content: bytes) -> Any:
+        raise NotImplementedError
+
+    def dumps(self, data: dict[str, PerformanceRecord]) -> bytes:
+        raise NotImplementedError
+
+    def parse(self, file_name: str, content: bytes) -> dict[str, PerformanceRecord]:
+        if self.compressor is not None and content:
+            content = self.compressor.decompress(content)
+
+        data = self.loads(content)
+
+        if data is None:
+            return {}
+        elif not isinstance(data, dict):
+            raise TypeError(f"{self.name} content of {file_name} is not a dictionary")
+
+        return data
+
+    def load(self, file_name: str) -> dict[str, PerformanceRecord]:
+        try:
+            with open(file_name, "rb") as fp:
+                locks.lock(fp, locks.LOCK_EX)
+                content = fp.read()
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return {}
+            else:
+                raise
+
+        return self.parse(file_name, content)
+
+    def save(self, file_name: str, records: dict[str, PerformanceRecord]) -> None:
+        fd = os.open(file_name, os.O_RDWR | os.O_CREAT, mode=0o666)
+        with os.fdopen(fd, "r+b") as fp:
+            locks.lock(fd, locks.LOCK_EX)
+
+            data = self.parse(file_name, fp.read())
+            data.update(records)
+
+            self.rewrite(fp, data)
+
+    def delete(self, file_name: str, names: Collection[str]) -> None:
+        try:
+            fd = os.open(file_name, os.O_RDWR)
+        except FileNotFoundError:
+            return
+        with os.fdopen(fd, "r+b") as fp:
+            locks.lock(fd, locks.LOCK_EX)
+            data = self.parse(file_name, fp.read())
+            if not any(name in data for name in names):
+                return
+            for name in names:
+                data.pop(name, None)
+            self.rewrite(fp, data)
+
+    def rewrite(self, fp: BinaryIO, data: dict[str, PerformanceRecord]) -> None:
+        """
+        Replace the content of the open, locked file with the records.
+        """
+        content = self.dumps(data)
+        if self.compressor is not None:
+            content = self.compressor.compress(content)
+
+        fp.seek(0)
+        fp.write(content)
+        fp.truncate()
+
+
+class YAMLBackend(DocumentBackend):
+    name = "YAML"
+    extension = ".yml"
+
+    def loads(self, content: bytes) -> Any:
+        return load_yaml(content)
+
+    def dumps(self, data: dict[str, PerformanceRecord]) -> bytes:
+        stream = io.StringIO()
+        dump_yaml(data, stream)
+        return stream.getvalue().encode()
+
+
+class JSONBackend(DocumentBackend):
+    """
+    Canonical JSON: sorted keys and fixed indentation, so unchanged records
+    give unchanged files.
+    """
+
+    name = "JSON"
+    extension = ".json"
+
+    def loads(self, content: bytes) -> Any:
+        if not content.strip():
+            return None
+        return json.loads(content)
+
+    def dumps(self, data: dict[str, PerformanceRecord]) -> bytes:
+        return (
+            json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True) + "\n"
+        ).encode()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores each record as a JSON-encoded row, so saving a record doesn't
+    rewrite the whole file. SQLite's locking handles concurrent writers.
+    """
+
+    name = "SQLite"
+    extension = ".sqlite3"
+
+    def connect(self, file_name: str) -> sqlite3.Connection:
+        connection = sqlite3.connect(file_name, timeout=30, isolation_level=None)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS records "
+            + "(name TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID"
+        )
+        return connection
+
+    def load(self, file_name: str) -> dict[str, PerformanceRecord]:
+        if not os.path.exists(file_name):
+            return {}
+        connection = self.connect(file_name)
+        try:
+            rows = connection.execute("SELECT name, record FROM records").fetchall()
+        finally:
+            connection.close()
+        return {name: json.loads(record) for name, record in rows}
+
+    def parse(self, file_name: str, content: bytes) -> dict[str, PerformanceRecord]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_name = os.path.join(temp_dir, os.path.basename(file_name))
+            with open(temp_name, "wb") as fp:
+                fp.write(content)
+            return self.load(temp_name)
+
+    def save(self, file_name: str, records: dict[str, PerformanceRecord]) -> None:
+        connection = self.connect(file_name)
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO records (name, record) VALUES (?, ?)",
+                    [
+                        (name, json.dumps(record, ensure_ascii=False, sort_keys=True))
+                        for name, record in records.items()
+                    ],
+                )
+        finally:
+            connection.close()
+
+    def delete(self, file_name: str, names: Collection[str]) -> None:
+        if not os.path.exists(file_name):
+            return
+        connection = self.connect(file_name)
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "DELETE FROM records WHERE name = ?", [(name,) for name in names]
+                )
+        finally:
+            connection.close()
+
+
+backends: dict[str, type[StorageBackend]] = {
+    "json": JSONBackend,
+    "sqlite": SQLiteBackend,
+    "yaml": YAMLBackend,
+}
+
+_backend_extensions = {
+    ".json": "json",
+    ".sqlite3": "sqlite",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+
+
+def get_extension(storage: str, compression: str | None) -> str:
+    extension = backends[storage].extension
+    if compression is not None:
+        extension += compressors[compression].extension
+    return extension
+
+
+def get_backend(storage: str, compression: str | None = None) -> StorageBackend:
+    backend_class = backends[storage]
+    if issubclass(backend_class, DocumentBackend):
+        compressor = None if compression is None else compressors[compression]()
+        return backend_class(compressor)
+    assert compression is None, f"{backend_class.name} files can't be compressed"
+    return backend_class()
+
+
+def detect_storage(file_name: str) -> tuple[str, str | None] | None:
+    """
+    Return the storage and compression names for a file name, from its
+    extensions, or None if they're unrecognized.
+    """
+    root, extension = os.path.splitext(file_name)
+    compression = None
+    for name, compressor_class in compressors.items():
+        if extension == compressor_class.extension:
+            compression = name
+            root, extension = os.path.splitext(root)
+            break
+    try:
+        storage = _backend_extensions[extension]
+    except KeyError:
+        return None
+    return storage, compression
+
+
+def is_perf_file(file_name: str) -> bool:
+    return ".perf." in os.path.basename(file_name) and (
+        detect_storage(file_name) is not None
+    )
+
+
+def convert(
+    file_name: str,
+    new_file_name: str,
+    storage: str,
+    compression: str | None = None,
+) -> None:
+    """
+    Copy the records of a performance file to a new file, with a different
+    storage backend or compression.
+    """
+    detected = detect_storage(file_name)
+    if detected is None:
+        raise ValueError(f"Unrecognized performance file extension for {file_name}")
+    records = get_backend(*detected).load(file_name)
+    get_backend(storage, compression).save(new_file_name, records)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import atexit
+import math
+import os
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+from django_perf_rec.operation import Operation
+from django_perf_rec.storage import JSONBackend, detect_storage
+
+TimingStats = dict[str, Any]
+
+
+def get_timings_path(file_name: str) -> str:
+    """
+    Return the path of the sidecar file holding timings for a performance
+    file, e.g. 'test_x.perf-timings.json' for 'test_x.perf.yml'. It doesn't
+    contain '.perf.', so it's never mistaken for a performance file.
+    """
+    root = file_name
+    while detect_storage(root) is not None:
+        root = os.path.splitext(root)[0]
+    if root.endswith(".perf"):
+        root = root[: -len(".perf")]
+    return root + ".perf-timings.json"
+
+
+def get_timing_key(op: Operation) -> str:
+    return f"{op.name}: {op.query}"
+
+
+def percentile(sorted_samples: list[float], percent: float) -> float:
+    # Nearest-rank method
+    rank = max(math.ceil(percent / 100 * len(sorted_samples)), 1)
+    return sorted_samples[rank - 1]
+
+
+def timing_stats(samples: list[float]) -> TimingStats:
+    """
+    Summarize durations in seconds, as milliseconds.
+    """
+    sorted_samples = sorted(samples)
+    return {
+        "count": len(sorted_samples),
+        "p50_ms": round(percentile(sorted_samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(sorted_samples, 95) * 1000, 3),
+        "max_ms": round(sorted_samples[-1] * 1000, 3),
+    }
+
+
+class Timings:
+    """
+    Collects the durations of recorded operations, by sidecar file and
+    operation, and writes their statistics on flush(). Timings are kept
+    apart from performance files so their noise can't fail comparisons.
+    """
+
+    def __init__(self) -> None:
+        self.samples: dict[str, dict[str, list[float]]] = {}
+        # Sidecar files with samples not yet written by flush()
+        self.dirty: set[str] = set()
+        self.lock = threading.Lock()
+        self.atexit_registered = False
+
+    def add(self, file_name: str, ops: Iterable[Operation]) -> None:
+        path = get_timings_path(file_name)
+        with self.lock:
+            file_samples = self.samples.setdefault(path, {})
+            for op in ops:
+                if op.duration is not None:
+                    file_samples.setdefault(get_timing_key(op), []).append(op.duration)
+            if file_samples:
+                self.dirty.add(path)
+                self.register_flush()
+
+    def register_flush(self) -> None:
+        # Call with lock held
+        if not self.atexit_registered:
+            atexit.register(self.flush)
+            self.atexit_registered = True
+
+    def take(self) -> dict[str, dict[str, list[float]]]:
+        """
+        Remove and return all samples, for another process to write.
+        """
+        with self.lock:
+            samples = self.samples
+            self.samples = {}
+            self.dirty = set()
+        return samples
+
+    def merge(self, samples: dict[str, dict[str, list[float]]]) -> None:
+        """
+        Add samples from take() in another process.
+        """
+        if not samples:
+            return
+        with self.lock:
+            for path, file_samples in samples.items():
+                ours = self.samples.setdefault(path, {})
+                for key, durations in file_samples.items():
+                    ours.setdefault(key, []).extend(durations)
+                self.dirty.add(path)
+            self.register_flush()
+
+    def flush(self) -> None:
+        """
+        Write statistics for every sidecar file with new samples, replacing
+        those of the same operations from previous runs.
+        """
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+            stats = {
+                path: {
+                    key: timing_stats(durations)
+                    for key, durations in self.samples[path].items()
+                }
+                for path in sorted(dirty)
+            }
+        # Stored like records, merged into the file under a lock
+        backend = JSONBackend()
+        for path, file_stats in stats.items():
+            backend.save(path, file_stats)  # type: ignore [arg-type]
+
+    def slowest(self, count: int) -> list[tuple[str, TimingStats]]:
+        """
+        Return the statistics of the count operations with the slowest 95th
+        percentile durations, across all files.
+        """
+        with self.lock:
+            merged: dict[str, list[float]] = {}
+            for file_samples in self.samples.values():
+                for key, durations in file_samples.items():
+                    merged.setdefault(key, []).extend(durations)
+        all_stats = [
+            (key, timing_stats(durations)) for key, durations in merged.items()
+        ]
+        all_stats.sort(key=lambda item: (-item[1]["p95_ms"], item[0]))
+        return all_stats[:count]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.samples = {}
+            self.dirty = set()
+
+
+timings = Timings()
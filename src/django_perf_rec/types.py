@@ -1,4 +1,5 @@
 from __future__ import annotations
 
-PerformanceRecordItem = dict[str, str | list[str]]
+# Items may have a 'repeat' count, from the COLLAPSE_REPEATS setting
+PerformanceRecordItem = dict[str, str | list[str] | int]
 PerformanceRecord = list[PerformanceRecordItem]
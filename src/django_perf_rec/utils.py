@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import difflib
+import hashlib
 import inspect
 from collections.abc import Iterable
 from types import FrameType
 from typing import Any
 
 from django_perf_rec import _HAVE_PYTEST
-from django_perf_rec.types import PerformanceRecord
+from django_perf_rec.types import PerformanceRecord, PerformanceRecordItem
 
 
 class TestDetails:
@@ -130,3 +131,83 @@ def record_diff(old: PerformanceRecord, new: PerformanceRecord) -> str:
             [f"{k}: {v}" for op in new for k, v in op.items()],
         )
     )
+
+
+def collapse_repeats(record: PerformanceRecord) -> PerformanceRecord:
+    """
+    Collapse runs of identical items into single items with a 'repeat'
+    count, as recorded with the COLLAPSE_REPEATS setting.
+    """
+    collapsed: PerformanceRecord = []
+    run_item: PerformanceRecordItem | None = None
+    for item in record:
+        repeat = item.get("repeat", 1)
+        assert isinstance(repeat, int)
+        if "repeat" in item:
+            item = {key: value for key, value in item.items() if key != "repeat"}
+        if item == run_item:
+            count = collapsed[-1].get("repeat", 1)
+            assert isinstance(count, int)
+            collapsed[-1] = {**item, "repeat": count + repeat}
+        else:
+            collapsed.append(item if repeat == 1 else {**item, "repeat": repeat})
+            run_item = item
+    return collapsed
+
+
+def expand_repeats(record: PerformanceRecord) -> PerformanceRecord:
+    """
+    Expand items with a 'repeat' count into that many identical items.
+    """
+    expanded: PerformanceRecord = []
+    for item in record:
+        repeat = item.get("repeat", 1)
+        assert isinstance(repeat, int)
+        if "repeat" in item:
+            item = {key: value for key, value in item.items() if key != "repeat"}
+        expanded.extend(item for _ in range(repeat))
+    return expanded
+
+
+class RecordDigest:
+    """
+    A digest of a performance record that can be built up as operations
+    arrive, so records can be compared without walking them again.
+    """
+
+    __slots__ = ("hasher",)
+
+    def __init__(self) -> None:
+        self.hasher = hashlib.blake2b(digest_size=16)
+
+    def update(self, item: PerformanceRecordItem) -> None:
+        # Length-prefix each string so different records can't encode the same
+        update = self.hasher.update
+        update(b"%d;" % len(item))
+        for key in sorted(item):
+            value = item[key]
+            encoded = key.encode()
+            update(b"%d:" % len(encoded))
+            update(encoded)
+            if isinstance(value, str):
+                encoded = value.encode()
+                update(b"s%d:" % len(encoded))
+                update(encoded)
+            elif isinstance(value, int):
+                update(b"i%d;" % value)
+            else:
+                update(b"l%d;" % len(value))
+                for line in value:
+                    encoded = line.encode()
+                    update(b"%d:" % len(encoded))
+                    update(encoded)
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+
+def record_digest(record: PerformanceRecord) -> str:
+    digest = RecordDigest()
+    for item in record:
+        digest.update(item)
+    return digest.hexdigest()
@@ -1,79 +1,428 @@
 from __future__ import annotations
 
-import errno
+import atexit
+import json
 import os
-from typing import Any
+import threading
+from collections import OrderedDict
+from collections.abc import Collection
 
-import yaml
 from django.core.files import locks
 
+from django_perf_rec.settings import perf_rec_settings
+from django_perf_rec.storage import StorageBackend, detect_storage, get_backend
 from django_perf_rec.types import PerformanceRecord
+from django_perf_rec.utils import record_digest
+
+
+def get_file_backend(file_name: str) -> StorageBackend:
+    """
+    Pick the storage backend from the file's extensions, falling back to the
+    STORAGE and COMPRESSION settings.
+    """
+    detected = detect_storage(file_name)
+    if detected is None:
+        detected = (perf_rec_settings.STORAGE, perf_rec_settings.COMPRESSION)
+    return get_backend(*detected)
+
+
+# Identifies a version of a file on disk, None if it doesn't exist
+FileVersion = tuple[int, int, int] | None
+
+
+def get_file_version(file_name: str) -> FileVersion:
+    try:
+        stat = os.stat(file_name)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def get_file_stamp(file_name: str) -> tuple[FileVersion, FileVersion]:
+    """
+    Return the versions of a performance file and its journal, which change
+    whenever either is rewritten, replaced, or appended to.
+    """
+    return (get_file_version(file_name), get_file_version(get_journal_path(file_name)))
+
+
+class LoadCacheEntry:
+    __slots__ = ("stamp", "data", "digests")
+
+    def __init__(
+        self,
+        stamp: tuple[FileVersion, FileVersion],
+        data: dict[str, PerformanceRecord],
+    ) -> None:
+        self.stamp = stamp
+        self.data = data
+        # Digests of records, as from RecordDigest, computed as needed
+        self.digests: dict[str, str] = {}
+
+
+class LoadCache:
+    """
+    A least-recently-used cache of loaded performance files, bounded by the
+    total number of records held. Entries are checked against the files'
+    inode, size, and modification time, so edits on disk are picked up.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, LoadCacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(
+        self, file_name: str, stamp: tuple[FileVersion, FileVersion]
+    ) -> LoadCacheEntry | None:
+        with self.lock:
+            entry = self.entries.get(file_name, None)
+            if entry is None:
+                return None
+            if entry.stamp != stamp:
+                del self.entries[file_name]
+                return None
+            self.entries.move_to_end(file_name)
+            return entry
+
+    def set(self, file_name: str, entry: LoadCacheEntry) -> None:
+        with self.lock:
+            if self.maxsize == 0:
+                return
+            self.entries[file_name] = entry
+            self.entries.move_to_end(file_name)
+            self.evict()
+
+    def saved(
+        self,
+        file_name: str,
+        stamp: tuple[FileVersion, FileVersion],
+        records: dict[str, PerformanceRecord],
+    ) -> None:
+        """
+        Update an entry after this process wrote records to its file. stamp
+        is from before the write: if the file had already changed on disk,
+        the entry is dropped rather than missing the other changes.
+        """
+        with self.lock:
+            entry = self.entries.get(file_name, None)
+            if entry is None:
+                return
+            if entry.stamp != stamp:
+                del self.entries[file_name]
+                return
+            entry.stamp = get_file_stamp(file_name)
+            for key, value in records.items():
+                if entry.data.get(key, None) is not value:
+                    entry.data[key] = value
+                    entry.digests.pop(key, None)
+            self.evict()
+
+    def discard(self, file_name: str) -> None:
+        with self.lock:
+            self.entries.pop(file_name, None)
+
+    def resize(self, maxsize: int) -> None:
+        with self.lock:
+            self.maxsize = maxsize
+            if maxsize == 0:
+                self.entries.clear()
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Evict least-recently-used entries until the cache is within its
+        bound, but never the most recently used one, so a single file with
+        more records than the bound stays cached while it's in use.
+        """
+        currsize = sum(len(entry.data) for entry in self.entries.values())
+        while currsize > self.maxsize and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            currsize -= len(entry.data)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
 
 
 class KVFile:
     def __init__(self, file_name: str) -> None:
         self.file_name = file_name
-        self.data = self.load(file_name)
+        entry = self.load_entry(file_name)
+        self.data = entry.data
+        self.digests = entry.digests
 
     def __len__(self) -> int:
         return len(self.data)
 
-    LOAD_CACHE: dict[str, dict[str, Any]] = {}
+    LOAD_CACHE = LoadCache(maxsize=10_000)
 
     @classmethod
     def load(cls, file_name: str) -> dict[str, PerformanceRecord]:
-        if file_name not in cls.LOAD_CACHE:
-            cls.LOAD_CACHE[file_name] = cls.load_file(file_name)
-        return cls.LOAD_CACHE[file_name]
+        return cls.load_entry(file_name).data
 
     @classmethod
-    def load_file(cls, file_name: str) -> dict[str, PerformanceRecord]:
-        try:
-            with open(file_name) as fp:
-                locks.lock(fp, locks.LOCK_EX)
-                content = fp.read()
-        except OSError as exc:
-            if exc.errno == errno.ENOENT:
-                content = "{}"
-            else:
-                raise
-
-        data = yaml.safe_load(content)
+    def load_entry(cls, file_name: str) -> LoadCacheEntry:
+        cache_size = perf_rec_settings.LOAD_CACHE_SIZE
+        if cache_size != cls.LOAD_CACHE.maxsize:
+            cls.LOAD_CACHE.resize(cache_size)
 
-        if data is None:
-            return {}
-        elif not isinstance(data, dict):
-            raise TypeError(f"YAML content of {file_name} is not a dictionary")
+        stamp = get_file_stamp(file_name)
+        entry = cls.LOAD_CACHE.get(file_name, stamp)
+        if entry is None:
+            data = cls.load_file(file_name)
+            # Records waiting for flush() aren't on disk yet
+            with cls.PENDING_LOCK:
+                data.update(cls.PENDING.get(file_name, {}))
+            entry = LoadCacheEntry(stamp, data)
+            cls.LOAD_CACHE.set(file_name, entry)
+        return entry
 
-        return data
+    @classmethod
+    def load_file(cls, file_name: str) -> dict[str, PerformanceRecord]:
+        """
+        Load a file with its journal applied. Both are read under the lock
+        compact() takes on the journal, so a concurrent compaction can't
+        move records from the journal to the file between the two reads.
+        """
+        backend = get_file_backend(file_name)
+        journal_path = get_journal_path(file_name)
+        while True:
+            try:
+                fd = os.open(journal_path, os.O_RDONLY)
+            except FileNotFoundError:
+                # Any compaction finished writing the file before removing
+                # the journal
+                return backend.load(file_name)
+            with os.fdopen(fd, "rb") as fp:
+                locks.lock(fd, locks.LOCK_EX)
+                # Retry if compact() removed the journal while we waited
+                if os.fstat(fd).st_nlink == 0:
+                    continue
+                data = backend.load(file_name)
+                data.update(parse_journal(fp.read()))
+                return data
 
     @classmethod
     def _clear_load_cache(cls) -> None:
         # Should really only be used in testing this class
-        cls.LOAD_CACHE = {}
+        cls.LOAD_CACHE.clear()
 
     def get(
         self, key: str, default: PerformanceRecord | None
     ) -> PerformanceRecord | None:
         return self.data.get(key, default)
 
-    def set_and_save(self, key: str, value: PerformanceRecord) -> None:
-        if self.data.get(key, object()) == value:
+    def get_digest(self, key: str) -> str | None:
+        """
+        Return the digest of a record, as from RecordDigest, or None if it
+        doesn't exist.
+        """
+        try:
+            return self.digests[key]
+        except KeyError:
+            pass
+        record = self.data.get(key, None)
+        if record is None:
+            return None
+        digest = self.digests[key] = record_digest(record)
+        return digest
+
+    def is_unchanged(
+        self, key: str, value: PerformanceRecord, digest: str | None
+    ) -> bool:
+        if digest is not None:
+            return self.get_digest(key) == digest
+        return self.data.get(key, object()) == value
+
+    def update_data(
+        self, key: str, value: PerformanceRecord, digest: str | None
+    ) -> None:
+        self.data[key] = value
+        if digest is None:
+            self.digests.pop(key, None)
+        else:
+            self.digests[key] = digest
+
+    def set_and_save(
+        self, key: str, value: PerformanceRecord, digest: str | None = None
+    ) -> None:
+        """
+        Set a record and save the file. If the record's digest is passed, it's
+        used to check for changes instead of comparing the whole record.
+        """
+        if self.is_unchanged(key, value, digest):
             return
 
-        fd = os.open(self.file_name, os.O_RDWR | os.O_CREAT, mode=0o666)
-        with os.fdopen(fd, "r+") as fp:
-            locks.lock(fd, locks.LOCK_EX)
+        self.update_data(key, value, digest)
+        self.save(self.file_name, {key: value})
+
+    # Records set with set_deferred(), by file name, waiting for flush()
+    PENDING: dict[str, dict[str, PerformanceRecord]] = {}
+    PENDING_LOCK = threading.Lock()
+    atexit_registered = False
+    # Files journaled to with set_journaled(), waiting for flush() to compact
+    JOURNALED: set[str] = set()
+
+    @classmethod
+    def register_flush(cls) -> None:
+        # Call with PENDING_LOCK held
+        if not cls.atexit_registered:
+            atexit.register(cls.flush)
+            cls.atexit_registered = True
+
+    def set_deferred(
+        self, key: str, value: PerformanceRecord, digest: str | None = None
+    ) -> None:
+        """
+        Like set_and_save(), but only write the file on the next flush(), so
+        many changed records cost a single write.
+        """
+        if self.is_unchanged(key, value, digest):
+            return
 
-            data = yaml.safe_load(fp)
-            if data is None:
-                data = {}
+        self.update_data(key, value, digest)
+        cls = type(self)
+        with cls.PENDING_LOCK:
+            cls.PENDING.setdefault(self.file_name, {})[key] = value
+            cls.register_flush()
 
-            self.data[key] = value
-            data[key] = value
+    @classmethod
+    def take_pending(cls) -> dict[str, dict[str, PerformanceRecord]]:
+        """
+        Remove and return the records set with set_deferred(), by file name,
+        for another process to write.
+        """
+        with cls.PENDING_LOCK:
+            pending = cls.PENDING
+            cls.PENDING = {}
+        return pending
 
-            fp.seek(0)
-            yaml.safe_dump(
-                data, fp, default_flow_style=False, allow_unicode=True, width=10000
+    @classmethod
+    def add_pending(cls, pending: dict[str, dict[str, PerformanceRecord]]) -> None:
+        """
+        Add records from take_pending() in another process, to be written on
+        the next flush().
+        """
+        if not pending:
+            return
+        with cls.PENDING_LOCK:
+            for file_name, records in pending.items():
+                cls.PENDING.setdefault(file_name, {}).update(records)
+            cls.register_flush()
+
+    def set_journaled(
+        self, key: str, value: PerformanceRecord, digest: str | None = None
+    ) -> None:
+        """
+        Like set_and_save(), but append the record to the file's journal,
+        rather than rewriting the file. flush() compacts journals back into
+        their files.
+        """
+        if self.is_unchanged(key, value, digest):
+            return
+
+        self.update_data(key, value, digest)
+        cls = type(self)
+        stamp = get_file_stamp(self.file_name)
+        cls.append_journal(get_journal_path(self.file_name), {key: value})
+        cls.LOAD_CACHE.saved(self.file_name, stamp, {key: value})
+        with cls.PENDING_LOCK:
+            cls.JOURNALED.add(self.file_name)
+            cls.register_flush()
+
+    @classmethod
+    def flush(cls) -> None:
+        """
+        Write all records set with set_deferred(), once per file, and compact
+        the journals written by set_journaled().
+        """
+        with cls.PENDING_LOCK:
+            pending = cls.PENDING
+            cls.PENDING = {}
+            journaled = cls.JOURNALED
+            cls.JOURNALED = set()
+        for file_name, records in pending.items():
+            cls.save(file_name, records)
+        for file_name in sorted(journaled):
+            cls.compact(file_name)
+
+    @classmethod
+    def save(cls, file_name: str, records: dict[str, PerformanceRecord]) -> None:
+        """
+        Merge records into the file, so concurrent processes don't lose each
+        other's changes.
+        """
+        stamp = get_file_stamp(file_name)
+        get_file_backend(file_name).save(file_name, records)
+        cls.LOAD_CACHE.saved(file_name, stamp, records)
+
+    @classmethod
+    def delete(cls, file_name: str, keys: Collection[str]) -> None:
+        """
+        Remove records from the file, compacting its journal first so they
+        aren't replayed.
+        """
+        cls.compact(file_name)
+        get_file_backend(file_name).delete(file_name, keys)
+        cls.LOAD_CACHE.discard(file_name)
+
+    @classmethod
+    def append_journal(
+        cls, journal_path: str, records: dict[str, PerformanceRecord]
+    ) -> None:
+        content = "".join(
+            json.dumps(
+                {"name": name, "record": record}, ensure_ascii=False, sort_keys=True
             )
-            fp.truncate()
+            + "\n"
+            for name, record in records.items()
+        ).encode()
+        while True:
+            fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            with os.fdopen(fd, "ab") as fp:
+                locks.lock(fd, locks.LOCK_EX)
+                # Retry if compact() removed the journal while we waited
+                if os.fstat(fd).st_nlink == 0:
+                    continue
+                fp.write(content)
+                return
+
+    @classmethod
+    def compact(cls, file_name: str) -> bool:
+        """
+        Fold a file's journal back into the file, returning whether there was
+        a journal to compact.
+        """
+        journal_path = get_journal_path(file_name)
+        try:
+            fd = os.open(journal_path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        with os.fdopen(fd, "r+b") as fp:
+            locks.lock(fd, locks.LOCK_EX)
+            if os.fstat(fd).st_nlink == 0:
+                # Another process compacted it first
+                return False
+            stamp = get_file_stamp(file_name)
+            records = parse_journal(fp.read())
+            if records:
+                get_file_backend(file_name).save(file_name, records)
+            os.unlink(journal_path)
+            cls.LOAD_CACHE.saved(file_name, stamp, records)
+        return True
+
+
+def get_journal_path(file_name: str) -> str:
+    return file_name + ".journal"
+
+
+def parse_journal(content: bytes) -> dict[str, PerformanceRecord]:
+    records = {}
+    for line in content.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            # Incomplete write, e.g. from a killed process
+            break
+        entry = json.loads(line)
+        records[entry["name"]] = entry["record"]
+    return records
@@ -1,17 +1,36 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from unittest import mock
 
 import pytest
 import yaml
+from asgiref.sync import sync_to_async
 from django.core.cache import caches
 from django.db.models import F, Q
 from django.db.models.functions import Upper
 from django.test import SimpleTestCase, TestCase, override_settings
 
-from django_perf_rec import TestCaseMixin, get_perf_path, get_record_name, record
+from django_perf_rec import (
+    TestCaseMixin,
+    flush,
+    get_perf_path,
+    get_record_name,
+    record,
+    state,
+)
+from django_perf_rec.yaml import KVFile
 from tests.testapp.models import Author
-from tests.utils import pretend_not_under_pytest, run_query, temporary_path
+from tests.utils import (
+    pretend_not_under_pytest,
+    run_query,
+    run_query_in_thread,
+    temporary_path,
+)
 
 FILE_DIR = os.path.dirname(__file__)
 
@@ -255,11 +274,271 @@ class RecordTests(TestCase):
 
             assert data == {"test_mode_overwrite": [{"cache|get": "baz"}]}
 
+    @override_settings(PERF_REC={"WRITE_MODE": "deferred"})
+    def test_write_mode_deferred(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir):
+            with record(path="perf_files/api/", record_name="test_deferred"):
+                caches["default"].get("foo")
+
+            full_path = os.path.join(FILE_DIR, "perf_files", "api", "test_api.perf.yml")
+            assert not os.path.exists(full_path)
+
+            # Deferred records are still compared against
+            with (
+                pytest.raises(AssertionError) as excinfo,
+                record(path="perf_files/api/", record_name="test_deferred"),
+            ):
+                caches["default"].get("bar")
+            assert "Performance record did not match" in str(excinfo.value)
+
+            flush()
+
+            with open(full_path) as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"test_deferred": [{"cache|get": "foo"}]}
+
+    @override_settings(PERF_REC={"WRITE_MODE": "journal"})
+    def test_write_mode_journal(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir):
+            with record(path="perf_files/api/", record_name="test_journal"):
+                caches["default"].get("foo")
+
+            full_path = os.path.join(FILE_DIR, "perf_files", "api", "test_api.perf.yml")
+            assert not os.path.exists(full_path)
+            assert os.path.exists(full_path + ".journal")
+
+            flush()
+
+            assert not os.path.exists(full_path + ".journal")
+            with open(full_path) as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"test_journal": [{"cache|get": "foo"}]}
+
+    @override_settings(PERF_REC={"WRITE_MODE": "journal"})
+    def test_xdist_worker_defers(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            mock.patch.object(state, "xdist_worker", True),
+        ):
+            with record(path="perf_files/api/", record_name="test_xdist"):
+                caches["default"].get("foo")
+
+            full_path = os.path.join(FILE_DIR, "perf_files", "api", "test_api.perf.yml")
+            assert not os.path.exists(full_path)
+            assert not os.path.exists(full_path + ".journal")
+            pending = KVFile.take_pending()
+
+        assert pending == {full_path: {"test_xdist": [{"cache|get": "foo"}]}}
+
+    @override_settings(PERF_REC={"STORAGE": "json"})
+    def test_storage_json(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir):
+            with record(path="perf_files/"):
+                caches["default"].get("foo")
+
+            full_path = os.path.join(FILE_DIR, "perf_files", "test_api.perf.json")
+            with open(full_path) as f:
+                data = json.load(f)
+            assert data == {"RecordTests.test_storage_json": [{"cache|get": "foo"}]}
+
+            with record(
+                path="perf_files/", record_name="RecordTests.test_storage_json"
+            ):
+                caches["default"].get("foo")
+
+    def test_matching_digest_skips_comparison(self):
+        with temporary_path("custom.perf.yml"):
+            with record(path="custom.perf.yml", record_name="digest"):
+                caches["default"].get("foo")
+
+            with (
+                pretend_not_under_pytest(),
+                mock.patch("django_perf_rec.api.record_diff") as mock_record_diff,
+                record(path="custom.perf.yml", record_name="digest"),
+            ):
+                caches["default"].get("foo")
+
+        mock_record_diff.assert_not_called()
+
+    @override_settings(PERF_REC={"COLLAPSE_REPEATS": True})
+    def test_collapse_repeats(self):
+        with temporary_path("custom.perf.yml"):
+            with record(path="custom.perf.yml", record_name="repeats"):
+                for _ in range(3):
+                    caches["default"].get("foo")
+                caches["default"].get("bar")
+                caches["default"].get("foo")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {
+                "repeats": [
+                    {"cache|get": "foo", "repeat": 3},
+                    {"cache|get": "bar"},
+                    {"cache|get": "foo"},
+                ]
+            }
+
+            # Digest matches the stored record, so no comparison is needed
+            with (
+                pretend_not_under_pytest(),
+                mock.patch("django_perf_rec.api.record_diff") as mock_record_diff,
+                record(path="custom.perf.yml", record_name="repeats"),
+            ):
+                for _ in range(3):
+                    caches["default"].get("foo")
+                caches["default"].get("bar")
+                caches["default"].get("foo")
+
+            mock_record_diff.assert_not_called()
+
+    @override_settings(PERF_REC={"COLLAPSE_REPEATS": True})
+    def test_collapse_repeats_mismatch(self):
+        with temporary_path("custom.perf.yml"):
+            with record(path="custom.perf.yml", record_name="repeats"):
+                for _ in range(3):
+                    caches["default"].get("foo")
+
+            with (
+                pretend_not_under_pytest(),
+                pytest.raises(AssertionError) as excinfo,
+                record(path="custom.perf.yml", record_name="repeats"),
+            ):
+                for _ in range(4):
+                    caches["default"].get("foo")
+
+        message = str(excinfo.value)
+        assert "- repeat: 3" in message
+        assert "+ repeat: 4" in message
+
+    def test_collapse_repeats_setting_changed(self):
+        with temporary_path("custom.perf.yml"):
+            with (
+                override_settings(PERF_REC={"COLLAPSE_REPEATS": True}),
+                record(path="custom.perf.yml", record_name="repeats"),
+            ):
+                caches["default"].get("foo")
+                caches["default"].get("foo")
+
+            # Expanded records still match collapsed ones
+            with record(path="custom.perf.yml", record_name="repeats"):
+                caches["default"].get("foo")
+                caches["default"].get("foo")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"repeats": [{"cache|get": "foo"}, {"cache|get": "foo"}]}
+
+            with (
+                pytest.raises(AssertionError),
+                record(path="custom.perf.yml", record_name="repeats"),
+            ):
+                caches["default"].get("foo")
+
     def test_delete_on_cascade_called_twice(self):
         arthur = Author.objects.create(name="Arthur", age=42)
         with record():
             arthur.delete()
 
+    @override_settings(PERF_REC={"CAPTURE_THREADS": True})
+    def test_capture_threads(self):
+        with temporary_path("custom.perf.yml"):
+            with (
+                record(path="custom.perf.yml", record_name="threads"),
+                ThreadPoolExecutor(max_workers=1) as pool,
+            ):
+                pool.submit(run_query_in_thread, "default", "SELECT 1 LIMIT 1").result()
+                run_query("default", "SELECT 1")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"threads": [{"db": "SELECT #"}, {"db": "SELECT # LIMIT #"}]}
+
+    @override_settings(PERF_REC={"CAPTURE_THREADS": True})
+    def test_capture_threads_existing_connection(self):
+        # Threads that used a connection before the block keep it, unrecorded
+        with (
+            temporary_path("custom.perf.yml"),
+            ThreadPoolExecutor(max_workers=1) as pool,
+        ):
+            pool.submit(run_query_in_thread, "default", "SELECT 2").result()
+            with record(path="custom.perf.yml", record_name="threads"):
+                pool.submit(run_query_in_thread, "default", "SELECT 1 LIMIT 1").result()
+                run_query("default", "SELECT 1")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"threads": [{"db": "SELECT #"}]}
+
+    def test_capture_threads_off(self):
+        with temporary_path("custom.perf.yml"):
+            with (
+                record(path="custom.perf.yml", record_name="threads"),
+                ThreadPoolExecutor(max_workers=1) as pool,
+            ):
+                pool.submit(run_query_in_thread, "default", "SELECT 1 LIMIT 1").result()
+                run_query("default", "SELECT 1")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"threads": [{"db": "SELECT #"}]}
+
+
+class AsyncRecordTests(TestCase):
+    async def test_async_with(self):
+        with temporary_path("custom.perf.yml"):
+            async with record(path="custom.perf.yml", record_name="async"):
+                await Author.objects.acount()
+                await caches["default"].aget("foo")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {
+                "async": [
+                    {"db": 'SELECT COUNT(*) AS "__count" FROM "testapp_author"'},
+                    {"cache|get": "foo"},
+                ]
+            }
+
+    @override_settings(PERF_REC={"CAPTURE_THREADS": True})
+    async def test_capture_threads_sync_to_async(self):
+        with temporary_path("custom.perf.yml"):
+            async with record(path="custom.perf.yml", record_name="threads"):
+                await sync_to_async(run_query_in_thread, thread_sensitive=False)(
+                    "default", "SELECT 1 LIMIT 1"
+                )
+                await sync_to_async(run_query)("default", "SELECT 1")
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            assert data == {"threads": [{"db": "SELECT #"}, {"db": "SELECT # LIMIT #"}]}
+
+    async def test_concurrent_records(self):
+        async def record_task(name: str, count: int) -> None:
+            async with record(path="custom.perf.yml", record_name=name):
+                for _ in range(count):
+                    await caches["default"].aget(name)
+                    await asyncio.sleep(0)
+                await Author.objects.filter(name=name).acount()
+
+        with temporary_path("custom.perf.yml"):
+            await asyncio.gather(record_task("one", 2), record_task("two", 3))
+
+            with open("custom.perf.yml") as f:
+                data = yaml.safe_load(f.read())
+            query = (
+                'SELECT COUNT(*) AS "__count" FROM "testapp_author" '
+                + 'WHERE "testapp_author"."name" = #'
+            )
+            assert data == {
+                "one": [{"cache|get": "one"}] * 2 + [{"db": query}],
+                "two": [{"cache|get": "two"}] * 3 + [{"db": query}],
+            }
+
 
 class GetPerfPathTests(SimpleTestCase):
     def test_py_file(self):
@@ -271,6 +550,10 @@ class GetPerfPathTests(SimpleTestCase):
     def test_unknown_file(self):
         assert get_perf_path("foo.plob") == "foo.plob.perf.yml"
 
+    @override_settings(PERF_REC={"STORAGE": "json", "COMPRESSION": "gzip"})
+    def test_storage(self):
+        assert get_perf_path("foo.py") == "foo.perf.json.gz"
+
 
 class GetRecordNameTests(SimpleTestCase):
     def test_class_and_test(self):
@@ -295,6 +578,15 @@ class GetRecordNameTests(SimpleTestCase):
 
         assert get_record_name(test_name="test_qux", file_name="foo.py") == "test_qux.2"
 
+    def test_multiple_calls_in_copied_context(self):
+        assert get_record_name(test_name="test_ctx") == "test_ctx"
+
+        context = copy_context()
+        assert context.run(get_record_name, test_name="test_ctx") == "test_ctx.2"
+
+        # The copy's counter doesn't affect this context
+        assert get_record_name(test_name="test_ctx") == "test_ctx.2"
+
 
 class TestCaseMixinTests(TestCaseMixin, TestCase):
     def test_record_performance(self):
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from django.core.cache import caches
+from django.test import TestCase
+
+from django_perf_rec import budget
+from tests.testapp.models import Author
+from tests.utils import run_query
+
+
+class BudgetTests(TestCase):
+    databases = {"default", "second"}
+
+    def test_within_budget(self):
+        with budget(
+            max_queries=2, max_cache_ops=2, max_per_table={"testapp_author": 1}
+        ):
+            list(Author.objects.all())
+            run_query("second", "SELECT 1")
+            caches["default"].get("foo")
+            caches["second"].set("bar", 1)
+
+    def test_no_limits(self):
+        with budget() as recorder:
+            run_query("default", "SELECT 1")
+            caches["default"].get("foo")
+
+        assert [op.query for op in recorder.queries] == ["SELECT #"]
+        assert [op.query for op in recorder.cache_ops] == ["foo"]
+
+    def test_max_queries_exceeded(self):
+        with pytest.raises(AssertionError) as excinfo, budget(max_queries=2):
+            run_query("default", "SELECT 1")
+            list(Author.objects.all())
+            run_query("default", "SELECT 2")
+
+        assert str(excinfo.value) == (
+            "Performance budget exceeded:\n"
+            + "  queries: 3 > 2\n"
+            + "    2 x db: SELECT #\n"
+            + '    1 x db: SELECT ... FROM "testapp_author"'
+        )
+
+    def test_max_cache_ops_total_exceeded(self):
+        with pytest.raises(AssertionError) as excinfo, budget(max_cache_ops=1):
+            caches["default"].get("foo")
+            caches["second"].get_many(["bar", "baz"])
+
+        assert str(excinfo.value) == (
+            "Performance budget exceeded:\n"
+            + "  cache operations: 2 > 1\n"
+            + "    1 x cache|get: foo\n"
+            + "    1 x cache|second|get_many: ['bar', 'baz']"
+        )
+
+    def test_max_cache_ops_by_operation(self):
+        with (
+            pytest.raises(AssertionError) as excinfo,
+            budget(max_cache_ops={"get": 1, "set": 1, "delete": 0}),
+        ):
+            caches["default"].get("foo")
+            caches["default"].get("foo")
+            caches["default"].set("foo", 1)
+
+        assert str(excinfo.value) == (
+            "Performance budget exceeded:\n"
+            + "  cache get: 2 > 1\n"
+            + "    2 x cache|get: foo"
+        )
+
+    def test_max_per_table_exceeded(self):
+        with (
+            pytest.raises(AssertionError) as excinfo,
+            budget(max_per_table={"testapp_author": 1, "testapp_book": 5}),
+        ):
+            Author.objects.create(name="Bob", age=42)
+            list(Author.objects.filter(name="Bob"))
+
+        message = str(excinfo.value)
+        assert message.startswith(
+            "Performance budget exceeded:\n  queries on testapp_author: 2 > 1\n"
+        )
+        assert "testapp_book" not in message
+
+    def test_grouped_failures(self):
+        with (
+            pytest.raises(AssertionError) as excinfo,
+            budget(max_queries=0, max_cache_ops=0),
+        ):
+            run_query("default", "SELECT 1")
+            caches["default"].get("foo")
+
+        assert str(excinfo.value) == (
+            "Performance budget exceeded:\n"
+            + "  queries: 1 > 0\n"
+            + "    1 x db: SELECT #\n"
+            + "  cache operations: 1 > 0\n"
+            + "    1 x cache|get: foo"
+        )
+
+    def test_summary_truncated(self):
+        with pytest.raises(AssertionError) as excinfo, budget(max_cache_ops=0):
+            for i in range(7):
+                caches["default"].get(f"key{'x' * i}")
+
+        assert str(excinfo.value).endswith("    ... and 2 more")
+
+    def test_exception_not_masked(self):
+        with pytest.raises(ValueError), budget(max_queries=0):
+            run_query("default", "SELECT 1")
+            raise ValueError("boom")
+
+    def test_no_file_io(self):
+        before = set(os.listdir(os.path.dirname(__file__)))
+        with budget(max_queries=1):
+            run_query("default", "SELECT 1")
+
+        assert set(os.listdir(os.path.dirname(__file__))) == before
@@ -4,11 +4,18 @@ from traceback import extract_stack
 from unittest import mock
 
 import pytest
+from asgiref.sync import sync_to_async
 from django.core.cache import caches
-from django.test import SimpleTestCase, TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
-from django_perf_rec.cache import AllCacheRecorder, CacheOp, CacheRecorder
-from tests.utils import override_extract_stack
+from django_perf_rec.cache import (
+    AllCacheRecorder,
+    CacheOp,
+    CacheRecorder,
+    clean_key,
+    default_key_patterns,
+)
+from tests.utils import override_frame_snapshot
 
 
 class CacheOpTests(SimpleTestCase):
@@ -29,6 +36,45 @@ class CacheOpTests(SimpleTestCase):
         key = "django.contrib.sessions.cached_db" + "abcdefghijklmnopqrstuvwxyz012345"
         assert CacheOp.clean_key(key) == "django.contrib.sessions.cached_db#"
 
+    def test_clean_key_multiple(self):
+        key = "user:42:bdfc9986-d461-4a5e-bf98-8688993abcfb"
+        assert CacheOp.clean_key(key) == "user:#:#"
+
+    def test_clean_key_integer_before_uuid(self):
+        key = "123bdfc9986-d461-4a5e-bf98-8688993abcfb"
+        assert CacheOp.clean_key(key) == "##"
+
+    def test_clean_key_uuid_before_hex(self):
+        # The UUID's last group starts a random hash, which is replaced first
+        key = "18d46530-1d7a-f646-cd60-0639a0155feea51511c5cdc2bc982262"
+        assert CacheOp.clean_key(key) == "#d#-#d#a-f#-cd#-#"
+
+    def test_clean_key_uuid_before_uuid(self):
+        key = (
+            "00e15d60-7553-4be5-7bdd-e1479e03d7b72187664543980ca57fff"
+            + "-22d0-edbe-650a-6cc213c0fab3"
+        )
+        assert CacheOp.clean_key(key) == "#e#d#-#-#be#-#bdd-#-#d#-edbe-#a-#cc#c#fab#"
+
+    @override_settings(PERF_REC={"CACHE_KEY_PATTERNS": [r"(?<=user:)[a-z]+"]})
+    def test_clean_key_patterns_replaced(self):
+        assert CacheOp.clean_key("user:adam:1") == "user:#:1"
+
+    @override_settings(
+        PERF_REC={"CACHE_KEY_PATTERNS": [r"(?<=user:)[a-z]+", *default_key_patterns]}
+    )
+    def test_clean_key_patterns_added(self):
+        assert CacheOp.clean_key("user:adam:1") == "user:#:#"
+
+    @override_settings(PERF_REC={"CACHE_KEY_PATTERNS": []})
+    def test_clean_key_no_patterns(self):
+        assert CacheOp.clean_key("user:1") == "user:1"
+
+    def test_clean_key_memoized(self):
+        clean_key.cache_clear()
+        CacheOp("default", "get_many", ["foo1", "foo1"], extract_stack())
+        assert clean_key.cache_info().hits == 1
+
     def test_key(self):
         summary = extract_stack()
         op = CacheOp("default", "foo", "bar", summary)
@@ -90,7 +136,7 @@ class CacheOpTests(SimpleTestCase):
 
 
 class CacheRecorderTests(TestCase):
-    @override_extract_stack
+    @override_frame_snapshot
     def test_default(self, stack_summary):
         callback = mock.Mock()
         with CacheRecorder("default", callback):
@@ -99,7 +145,7 @@ class CacheRecorderTests(TestCase):
             CacheOp("default", "get", "foo", stack_summary)
         )
 
-    @override_extract_stack
+    @override_frame_snapshot
     def test_secondary(self, stack_summary):
         callback = mock.Mock()
         with CacheRecorder("second", callback):
@@ -122,9 +168,118 @@ class CacheRecorderTests(TestCase):
             callback.call_args_list[0][0][0].traceback
         )
 
+    @override_frame_snapshot
+    def test_internal_calls_not_recorded(self, stack_summary):
+        callback = mock.Mock()
+        with CacheRecorder("default", callback):
+            caches["default"].get_or_set("foo", 42)
+            caches["default"].get("foo")
+
+        assert callback.mock_calls == [
+            mock.call(CacheOp("default", "get_or_set", "foo", stack_summary)),
+            mock.call(CacheOp("default", "get", "foo", stack_summary)),
+        ]
+
+    def test_other_cache_inside_operation_recorded(self):
+        callback = mock.Mock()
+        caches["default"].delete("missing")
+        with CacheRecorder("default", callback), CacheRecorder("second", callback):
+            caches["default"].get_or_set("missing", lambda: caches["second"].get("bar"))
+
+        assert [op.name for call in callback.mock_calls for op in call.args] == [
+            "cache|get_or_set",
+            "cache|second|get",
+        ]
+
+    def test_touch_and_has_key(self):
+        callback = mock.Mock()
+        caches["default"].set("foo", 1)
+        with CacheRecorder("default", callback):
+            caches["default"].touch("foo")
+            caches["default"].has_key("foo")
+            assert "foo" in caches["default"]
+
+        assert [op.name for call in callback.mock_calls for op in call.args] == [
+            "cache|touch",
+            "cache|has_key",
+            "cache|has_key",
+        ]
+
+    async def test_async_methods(self):
+        callback = mock.Mock()
+        cache = caches["default"]
+        await cache.adelete("missing")
+        with CacheRecorder("default", callback):
+            await cache.aset("foo", 1)
+            await cache.aget("foo")
+            await cache.aget_many(["foo", "bar"])
+            await cache.aget_or_set("missing", 2)
+            await cache.aset_many({"foo": 1})
+            await cache.aadd("foo", 1)
+            await cache.aincr("foo")
+            await cache.adecr("foo")
+            await cache.atouch("foo")
+            await cache.ahas_key("foo")
+            await cache.adelete("foo")
+            await cache.adelete_many(["foo", "missing"])
+
+        assert [op.name for call in callback.mock_calls for op in call.args] == [
+            "cache|set",
+            "cache|get",
+            "cache|get_many",
+            "cache|get_or_set",
+            "cache|set_many",
+            "cache|add",
+            "cache|incr",
+            "cache|decr",
+            "cache|touch",
+            "cache|has_key",
+            "cache|delete",
+            "cache|delete_many",
+        ]
+
+    async def test_async_same_op_as_sync(self):
+        callback = mock.Mock()
+        with CacheRecorder("default", callback):
+            await caches["default"].aset("foo", 42)
+            await sync_to_async(caches["default"].set)("foo", 42)
+
+        async_op, sync_op = (call.args[0] for call in callback.mock_calls)
+        assert async_op.name == sync_op.name == "cache|set"
+        assert async_op.query == sync_op.query == "foo"
+        assert async_op.values == sync_op.values == {"foo": 42}
+
+    def test_nested(self):
+        callback1 = mock.Mock()
+        callback2 = mock.Mock()
+        with CacheRecorder("default", callback1):
+            with CacheRecorder("default", callback2):
+                caches["default"].get("foo")
+            caches["default"].get("bar")
+
+        assert len(callback1.mock_calls) == 2
+        assert len(callback2.mock_calls) == 1
+
+    def test_exit_out_of_order(self):
+        orig_get = caches["default"].get
+        callback1 = mock.Mock()
+        callback2 = mock.Mock()
+        recorder1 = CacheRecorder("default", callback1)
+        recorder2 = CacheRecorder("default", callback2)
+        recorder1.__enter__()
+        recorder2.__enter__()
+        recorder1.__exit__(None, None, None)
+        caches["default"].get("foo")
+        recorder2.__exit__(None, None, None)
+        caches["default"].get("bar")
+
+        assert len(callback1.mock_calls) == 0
+        assert len(callback2.mock_calls) == 1
+        assert caches["default"].get == orig_get
+
 
 class AllCacheRecorderTests(TestCase):
-    @override_extract_stack
+    @override_frame_snapshot
     def test_records_all(self, stack_summary):
         callback = mock.Mock()
         with AllCacheRecorder(callback):
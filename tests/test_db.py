@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Barrier, Thread
 from traceback import StackSummary, extract_stack
 from unittest import mock
 
-from django.test import SimpleTestCase, TestCase
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
 
-from django_perf_rec.db import AllDBRecorder, DBOp, DBRecorder
-from tests.utils import override_extract_stack, run_query
+from django_perf_rec.db import AllDBRecorder, DBOp, DBRecorder, ThreadDBRecorder
+from tests.testapp.models import Author
+from tests.utils import override_frame_snapshot, run_query, run_query_in_thread
 
 
 class DBOpTests(SimpleTestCase):
@@ -37,21 +42,21 @@ class DBOpTests(SimpleTestCase):
 class DBRecorderTests(TestCase):
     databases = {"default", "second", "replica"}
 
-    @override_extract_stack
+    @override_frame_snapshot
     def test_default(self, stack_summary):
         callback = mock.Mock()
         with DBRecorder("default", callback):
             run_query("default", "SELECT 1")
         callback.assert_called_once_with(DBOp("default", "SELECT #", stack_summary))
 
-    @override_extract_stack
+    @override_frame_snapshot
     def test_secondary(self, stack_summary):
         callback = mock.Mock()
         with DBRecorder("second", callback):
             run_query("second", "SELECT 1")
         callback.assert_called_once_with(DBOp("second", "SELECT #", stack_summary))
 
-    @override_extract_stack
+    @override_frame_snapshot
     def test_replica(self, stack_summary):
         callback = mock.Mock()
         with DBRecorder("replica", callback):
@@ -74,11 +79,110 @@ class DBRecorderTests(TestCase):
             callback.call_args_list[0][0][0].traceback
         )
 
+    @override_frame_snapshot
+    def test_params(self, stack_summary):
+        callback = mock.Mock()
+        with DBRecorder("default", callback):
+            run_query("default", "SELECT %s", ["a"])
+        callback.assert_called_once_with(DBOp("default", "SELECT #", stack_summary))
+
+    def test_no_debug_cursor(self):
+        connection = connections["default"]
+        callback = mock.Mock()
+        with DBRecorder("default", callback):
+            assert not connection.force_debug_cursor
+            run_query("default", "SELECT 1")
+        assert len(connection.queries_log) == 0
+
+    @override_frame_snapshot
+    def test_executemany(self, stack_summary):
+        callback = mock.Mock()
+        with DBRecorder("second", callback), connections["second"].cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO testapp_author (name, age) VALUES (%s, %s)",
+                [["a", 1], ["b", 2]],
+            )
+        callback.assert_called_once_with(
+            DBOp(
+                "second",
+                "INSERT INTO testapp_author (...) VALUES (...)",
+                stack_summary,
+            )
+        )
+
+    @override_frame_snapshot
+    def test_executemany_iterator(self, stack_summary):
+        callback = mock.Mock()
+        with DBRecorder("second", callback), connections["second"].cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO testapp_author (name, age) VALUES (%s, %s)",
+                iter([["a", 1], ["b", 2]]),  # type: ignore [arg-type]
+            )
+        callback.assert_called_once_with(
+            DBOp(
+                "second",
+                "INSERT INTO testapp_author (...) VALUES (...)",
+                stack_summary,
+            )
+        )
+
+    @override_settings(PERF_REC={"DB_RECORDER": "debug_cursor"})
+    @override_frame_snapshot
+    def test_debug_cursor(self, stack_summary):
+        connection = connections["default"]
+        callback = mock.Mock()
+        with DBRecorder("default", callback):
+            forced = connection.force_debug_cursor
+            run_query("default", "SELECT 1")
+        assert forced
+        assert not connection.force_debug_cursor
+        callback.assert_called_once_with(DBOp("default", "SELECT #", stack_summary))
+
+    @override_settings(PERF_REC={"DB_RECORDER": "debug_cursor"})
+    def test_debug_cursor_executemany_not_recorded(self):
+        callback = mock.Mock()
+        with DBRecorder("second", callback), connections["second"].cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO testapp_author (name, age) VALUES (%s, %s)",
+                [["a", 1], ["b", 2]],
+            )
+        assert len(callback.mock_calls) == 0
+
+    @override_settings(PERF_REC={"FINGERPRINT_ENGINE": "native"})
+    @override_frame_snapshot
+    def test_native_fingerprint_engine(self, stack_summary):
+        callback = mock.Mock()
+        with DBRecorder("default", callback):
+            list(Author.objects.filter(name__in=["a", "b"]))
+        callback.assert_called_once_with(
+            DBOp(
+                "default",
+                'SELECT ... FROM "testapp_author" WHERE "testapp_author"."name" IN (...)',
+                stack_summary,
+            )
+        )
+
+    def test_exit_out_of_order(self):
+        callback1 = mock.Mock()
+        callback2 = mock.Mock()
+        recorder1 = DBRecorder("default", callback1)
+        recorder2 = DBRecorder("default", callback2)
+        recorder1.__enter__()
+        recorder2.__enter__()
+        recorder1.__exit__(None, None, None)
+        run_query("default", "SELECT 1")
+        recorder2.__exit__(None, None, None)
+        run_query("default", "SELECT 2")
+
+        assert len(callback1.mock_calls) == 0
+        assert len(callback2.mock_calls) == 1
+        assert connections["default"].execute_wrappers == []
+
 
 class AllDBRecorderTests(TestCase):
     databases = {"default", "second", "replica"}
 
-    @override_extract_stack
+    @override_frame_snapshot
     def test_records_all(self, stack_summary):
         callback = mock.Mock()
         with AllDBRecorder(callback):
@@ -91,3 +195,71 @@ class AllDBRecorderTests(TestCase):
             mock.call(DBOp("default", "SELECT #", stack_summary)),
             mock.call(DBOp("second", "SELECT #", stack_summary)),
         ]
+
+
+class ThreadDBRecorderTests(TestCase):
+    databases = {"default", "second"}
+
+    def test_records_other_threads(self):
+        callback = mock.Mock()
+        with ThreadDBRecorder(callback), ThreadPoolExecutor(max_workers=1) as pool:
+            # Left to DBRecorder
+            run_query("default", "SELECT 1")
+            pool.submit(run_query_in_thread, "second", "SELECT 2").result()
+            pool.submit(run_query_in_thread, "default", "SELECT 'b'").result()
+
+        assert [
+            (op.alias, op.query) for call in callback.mock_calls for op in call.args
+        ] == [
+            ("second", "SELECT #"),
+            ("default", "SELECT #"),
+        ]
+
+    def test_deterministic_order(self):
+        barrier = Barrier(2)
+
+        def work(sql: str, wait: bool) -> None:
+            if wait:
+                barrier.wait()
+            run_query_in_thread("default", sql)
+            if not wait:
+                barrier.wait()
+
+        for limit_runs_last in (False, True):
+            callback = mock.Mock()
+            with ThreadDBRecorder(callback):
+                threads = [
+                    Thread(target=work, args=("SELECT 1 LIMIT 1", limit_runs_last)),
+                    Thread(target=work, args=("SELECT 1", not limit_runs_last)),
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            assert [call.args[0].query for call in callback.mock_calls] == [
+                "SELECT #",
+                "SELECT # LIMIT #",
+            ]
+
+    def test_ignores_other_recordings_contexts(self):
+        callback = mock.Mock()
+        other_callback = mock.Mock()
+        other = AllDBRecorder(other_callback)
+        context = copy_context()
+        with AllDBRecorder(mock.Mock()), ThreadDBRecorder(callback):
+            context.run(other.__enter__)
+            thread = Thread(
+                target=context.run, args=(run_query_in_thread, "default", "SELECT 1")
+            )
+            thread.start()
+            thread.join()
+            context.run(other.__exit__, None, None, None)
+
+        assert len(callback.mock_calls) == 0
+
+    def test_exit_restores(self):
+        with ThreadDBRecorder(mock.Mock()), ThreadDBRecorder(mock.Mock()):
+            pass
+
+        assert "create_connection" not in vars(connections)
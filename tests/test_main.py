@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import subprocess
+from contextlib import redirect_stdout
+from tempfile import mkdtemp
+from unittest import mock
+
+import pytest
+from django.test import SimpleTestCase
+
+from django_perf_rec.__main__ import main
+from django_perf_rec.report import DirectorySource
+from django_perf_rec.storage import get_backend
+from django_perf_rec.yaml import KVFile
+
+
+class ConvertCommandTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = mkdtemp()
+        self.yaml_name = os.path.join(self.temp_dir, "test_x.perf.yml")
+        with open(self.yaml_name, "w") as fp:
+            fp.write("foo:\n- db: 'SELECT #'\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def test_convert_file(self):
+        status = main(["convert", "--to", "json", self.yaml_name])
+
+        assert status == 0
+        json_name = os.path.join(self.temp_dir, "test_x.perf.json")
+        assert get_backend("json").load(json_name) == {"foo": [{"db": "SELECT #"}]}
+        assert not os.path.exists(self.yaml_name)
+
+    def test_convert_directory(self):
+        os.mkdir(os.path.join(self.temp_dir, "sub"))
+        other_name = os.path.join(self.temp_dir, "sub", "test_y.perf.yml")
+        shutil.copy(self.yaml_name, other_name)
+        notes_name = os.path.join(self.temp_dir, "notes.yml")
+        with open(notes_name, "w") as fp:
+            fp.write("not: a perf file\n")
+
+        status = main(["convert", "--to", "sqlite", self.temp_dir])
+
+        assert status == 0
+        for name in ("test_x.perf.sqlite3", os.path.join("sub", "test_y.perf.sqlite3")):
+            sqlite_name = os.path.join(self.temp_dir, name)
+            assert get_backend("sqlite").load(sqlite_name) == {
+                "foo": [{"db": "SELECT #"}]
+            }
+        assert os.path.exists(notes_name)
+
+    def test_convert_sqlite_compressed(self):
+        with pytest.raises(SystemExit):
+            main(["convert", "--to", "sqlite", "--compression", "gzip", self.temp_dir])
+
+    def test_convert_compressed_keep(self):
+        status = main(
+            [
+                "convert",
+                "--to",
+                "json",
+                "--compression",
+                "gzip",
+                "--keep",
+                self.temp_dir,
+            ]
+        )
+
+        assert status == 0
+        gz_name = os.path.join(self.temp_dir, "test_x.perf.json.gz")
+        assert get_backend("json", "gzip").load(gz_name) == {
+            "foo": [{"db": "SELECT #"}]
+        }
+        assert os.path.exists(self.yaml_name)
+
+    def test_convert_back(self):
+        main(["convert", "--to", "json", self.yaml_name])
+        json_name = os.path.join(self.temp_dir, "test_x.perf.json")
+        status = main(["convert", self.temp_dir])
+
+        assert status == 0
+        assert not os.path.exists(json_name)
+        with open(self.yaml_name) as fp:
+            assert fp.read() == "foo:\n- db: 'SELECT #'\n"
+
+    def test_convert_same_format(self):
+        status = main(["convert", "--to", "yaml", self.yaml_name])
+
+        assert status == 0
+        assert os.path.exists(self.yaml_name)
+
+    def test_convert_existing_target(self):
+        json_name = os.path.join(self.temp_dir, "test_x.perf.json")
+        with open(json_name, "w") as fp:
+            fp.write("{}")
+
+        status = main(["convert", "--to", "json", self.yaml_name])
+
+        assert status == 1
+        assert os.path.exists(self.yaml_name)
+
+    def test_convert_compacts_journal(self):
+        KVFile(self.yaml_name).set_journaled("bar", [])
+
+        status = main(["convert", "--to", "json", self.yaml_name])
+
+        assert status == 0
+        json_name = os.path.join(self.temp_dir, "test_x.perf.json")
+        assert get_backend("json").load(json_name) == {
+            "bar": [],
+            "foo": [{"db": "SELECT #"}],
+        }
+        assert not os.path.exists(self.yaml_name + ".journal")
+
+    def test_convert_unrecognized(self):
+        file_name = os.path.join(self.temp_dir, "notes.txt")
+        open(file_name, "w").close()
+
+        status = main(["convert", "--to", "json", file_name])
+
+        assert status == 1
+
+
+class CompactCommandTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        KVFile._clear_load_cache()
+        self.temp_dir = mkdtemp()
+        self.yaml_name = os.path.join(self.temp_dir, "test_x.perf.yml")
+        with open(self.yaml_name, "w") as fp:
+            fp.write("foo:\n- db: 'SELECT #'\n")
+
+    def tearDown(self):
+        KVFile.JOURNALED.clear()
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def test_compact_directory(self):
+        KVFile(self.yaml_name).set_journaled("bar", [{"cache|get": "baz"}])
+        # A journal without its performance file yet
+        other_name = os.path.join(self.temp_dir, "test_y.perf.json")
+        KVFile(other_name).set_journaled("foo", [])
+
+        status = main(["compact", self.temp_dir])
+
+        assert status == 0
+        assert sorted(os.listdir(self.temp_dir)) == [
+            "test_x.perf.yml",
+            "test_y.perf.json",
+        ]
+        with open(self.yaml_name) as fp:
+            assert fp.read() == ("bar:\n- cache|get: baz\nfoo:\n- db: 'SELECT #'\n")
+        assert get_backend("json").load(other_name) == {"foo": []}
+
+    def test_compact_nothing(self):
+        status = main(["compact", self.yaml_name])
+
+        assert status == 0
+        with open(self.yaml_name) as fp:
+            assert fp.read() == "foo:\n- db: 'SELECT #'\n"
+
+    def test_compact_unrecognized(self):
+        file_name = os.path.join(self.temp_dir, "notes.txt")
+        open(file_name, "w").close()
+
+        status = main(["compact", file_name])
+
+        assert status == 1
+
+
+class DiffCommandTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        KVFile._clear_load_cache()
+        self.temp_dir = mkdtemp()
+        self.old_dir = os.path.join(self.temp_dir, "old")
+        self.new_dir = os.path.join(self.temp_dir, "new")
+        self.write(
+            self.old_dir,
+            'foo:\n- db: SELECT ... FROM "author"\n- cache|get: bar\n'
+            + "gone:\n- db: 'SELECT #'\n",
+        )
+        self.write(
+            self.new_dir,
+            'foo:\n- db: SELECT ... FROM "author"\n  repeat: 3\n- cache|get: baz\n',
+        )
+
+    def tearDown(self):
+        KVFile.JOURNALED.clear()
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def write(self, directory: str, content: str) -> None:
+        os.makedirs(os.path.join(directory, "app"), exist_ok=True)
+        with open(os.path.join(directory, "app", "test_x.perf.yml"), "w") as fp:
+            fp.write(content)
+
+    def run_main(self, argv: list[str]) -> tuple[int, str]:
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            status = main(argv)
+        return status, stdout.getvalue()
+
+    def test_diff_directories(self):
+        status, output = self.run_main(["diff", self.old_dir, self.new_dir])
+
+        assert status == 0
+        assert output == (
+            "app/test_x.perf.yml\n"
+            + "  foo: queries 1 -> 3 (+2), cache operations 1\n"
+            + "    + cache|get: baz\n"
+            + '    + db: SELECT ... FROM "author" (2 times)\n'
+            + "    - cache|get: bar\n"
+            + "  gone (removed): queries 1 -> 0 (-1), cache operations 0\n"
+            + "    - db: SELECT #\n"
+            + "Tables:\n"
+            + "  author: 1 -> 3 (+2)\n"
+            + "Total: 2 changed records, queries 2 -> 3 (+1), cache operations 1\n"
+        )
+
+    def test_diff_directories_json(self):
+        status, output = self.run_main(
+            ["diff", "--format", "json", self.old_dir, self.new_dir]
+        )
+
+        assert status == 0
+        report = json.loads(output)
+        assert [record["record"] for record in report["records"]] == ["foo", "gone"]
+        assert report["records"][0] == {
+            "file": "app/test_x.perf.yml",
+            "record": "foo",
+            "status": "changed",
+            "queries": {"old": 1, "new": 3},
+            "cache_ops": {"old": 1, "new": 1},
+            "added": {"cache|get: baz": 1, 'db: SELECT ... FROM "author"': 2},
+            "removed": {"cache|get: bar": 1},
+        }
+        assert report["changed_records"] == 2
+        assert report["tables"] == {"author": {"old": 1, "new": 3}}
+
+    def test_diff_directories_unchanged(self):
+        status, output = self.run_main(["diff", self.old_dir, self.old_dir])
+
+        assert status == 0
+        assert output == "No changed records.\n"
+
+    def test_diff_directories_totals_changed_records(self):
+        for directory in (self.old_dir, self.new_dir):
+            with open(os.path.join(directory, "app", "test_y.perf.yml"), "w") as fp:
+                fp.write('bar:\n- db: SELECT ... FROM "book"\n- cache|get: qux\n')
+            with open(os.path.join(directory, "app", "test_x.perf.yml"), "a") as fp:
+                fp.write('same:\n- db: SELECT ... FROM "book"\n')
+
+        status, output = self.run_main(
+            ["diff", "--format", "json", self.old_dir, self.new_dir]
+        )
+
+        assert status == 0
+        report = json.loads(output)
+        assert report["changed_records"] == 2
+        assert report["totals"] == {
+            "queries": {"old": 2, "new": 3},
+            "cache_ops": {"old": 1, "new": 1},
+        }
+        assert report["tables"] == {"author": {"old": 1, "new": 3}}
+
+    def test_diff_directories_skips_identical_files(self):
+        with mock.patch.object(DirectorySource, "load") as mock_load:
+            status, output = self.run_main(["diff", self.old_dir, self.old_dir])
+
+        assert status == 0
+        mock_load.assert_not_called()
+
+    def test_diff_directories_journal(self):
+        KVFile(os.path.join(self.old_dir, "app", "test_x.perf.yml")).set_journaled(
+            "foo", []
+        )
+
+        status, output = self.run_main(["diff", self.new_dir, self.old_dir])
+
+        assert status == 0
+        assert output.splitlines()[1] == (
+            "  foo: queries 3 -> 0 (-3), cache operations 1 -> 0 (-1)"
+        )
+
+    def test_diff_directories_paths(self):
+        with pytest.raises(SystemExit):
+            self.run_main(["diff", self.old_dir, self.new_dir, "app"])
+
+    def test_diff_git(self):
+        def git(*args: str) -> None:
+            subprocess.run(
+                [
+                    "git",
+                    "-c",
+                    "user.name=Test",
+                    "-c",
+                    "user.email=test@example.com",
+                    "-c",
+                    "commit.gpgsign=false",
+                    *args,
+                ],
+                check=True,
+                capture_output=True,
+            )
+
+        orig_dir = os.getcwd()
+        os.chdir(self.old_dir)
+        self.addCleanup(os.chdir, orig_dir)
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "Old")
+        shutil.copy(
+            os.path.join(self.new_dir, "app", "test_x.perf.yml"),
+            os.path.join(self.old_dir, "app", "test_x.perf.yml"),
+        )
+        with open(os.path.join(self.old_dir, "app", "test_y.perf.json"), "w") as fp:
+            fp.write('{"bar": [{"db": "SELECT #"}]}')
+        git("add", ".")
+        git("commit", "-q", "-m", "New")
+
+        status, output = self.run_main(
+            ["diff", "--format", "json", "HEAD~1", "HEAD", "app"]
+        )
+
+        assert status == 0
+        report = json.loads(output)
+        assert [
+            (record["file"], record["record"], record["status"])
+            for record in report["records"]
+        ] == [
+            ("app/test_x.perf.yml", "foo", "changed"),
+            ("app/test_x.perf.yml", "gone", "removed"),
+            ("app/test_y.perf.json", "bar", "added"),
+        ]
+        assert report["totals"]["queries"] == {"old": 2, "new": 4}
+
+    def test_diff_git_unknown_revision(self):
+        status, output = self.run_main(["diff", "unknown-revision", "HEAD"])
+
+        assert status == 1
+        assert output == ""
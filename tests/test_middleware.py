@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from unittest import mock
+
+import pytest
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from django_perf_rec.middleware import (
+    Sampler,
+    SamplingMiddleware,
+    ViewStats,
+    flush_samplers,
+    histogram_bucket,
+    samplers,
+)
+from tests.testapp.models import Author
+from tests.utils import temporary_path
+
+
+def authors_view(request: HttpRequest) -> HttpResponse:
+    caches["default"].get("authors")
+    return HttpResponse(str(Author.objects.count()))
+
+
+async def async_authors_view(request: HttpRequest) -> HttpResponse:
+    await caches["default"].aget("authors")
+    return HttpResponse(str(await Author.objects.acount()))
+
+
+urlpatterns = [
+    path("authors/", authors_view, name="authors"),
+    path("async-authors/", async_authors_view, name="async-authors"),
+]
+
+count_query = 'db: SELECT COUNT(*) AS "__count" FROM "testapp_author"'
+
+
+class HistogramBucketTests(SimpleTestCase):
+    def test_small(self):
+        assert histogram_bucket(0) == "0"
+        assert histogram_bucket(1) == "1"
+
+    def test_powers_of_two(self):
+        assert histogram_bucket(2) == "2-3"
+        assert histogram_bucket(3) == "2-3"
+        assert histogram_bucket(5) == "4-7"
+        assert histogram_bucket(1000) == "512-1023"
+
+
+class ViewStatsTests(SimpleTestCase):
+    def test_add(self):
+        stats = ViewStats(max_fingerprints=10)
+        stats.add(["a", "a", "b"])
+        stats.add([])
+
+        assert stats.as_dict() == {
+            "requests": 2,
+            "ops_per_request": {"2-3": 1, "0": 1},
+            "distinct_per_request": {"2-3": 1, "0": 1},
+            "fingerprints": {"a": 2, "b": 1},
+            "other_fingerprints": 0,
+        }
+
+    def test_max_fingerprints(self):
+        stats = ViewStats(max_fingerprints=2)
+        stats.add(["a", "b", "c", "c"])
+        stats.add(["a", "d"])
+
+        result = stats.as_dict()
+        assert result["fingerprints"] == {"a": 2, "b": 1}
+        assert result["other_fingerprints"] == 3
+
+
+def stop_samplers() -> None:
+    for sampler in list(samplers):
+        sampler.stop()
+
+
+class SamplerTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(stop_samplers)
+
+    def test_flush_callback(self):
+        callback = mock.Mock()
+        sampler = Sampler(callback, flush_interval=60, max_fingerprints=10)
+        sampler.add("view", ["a"])
+        sampler.flush()
+
+        callback.assert_called_once()
+        stats = callback.call_args[0][0]
+        assert stats["pid"] == os.getpid()
+        assert stats["views"] == {
+            "view": {
+                "requests": 1,
+                "ops_per_request": {"1": 1},
+                "distinct_per_request": {"1": 1},
+                "fingerprints": {"a": 1},
+                "other_fingerprints": 0,
+            }
+        }
+
+    def test_flush_resets(self):
+        callback = mock.Mock()
+        sampler = Sampler(callback, flush_interval=60, max_fingerprints=10)
+        sampler.add("view", ["a"])
+        sampler.flush()
+        sampler.flush()
+
+        assert len(callback.mock_calls) == 1
+
+    def test_flush_file(self):
+        with temporary_path("sampling.jsonl"):
+            sampler = Sampler("sampling.jsonl", flush_interval=60, max_fingerprints=10)
+            sampler.add("view", ["a"])
+            sampler.flush()
+            sampler.add("view", ["b"])
+            sampler.flush()
+
+            with open("sampling.jsonl") as fp:
+                lines = [json.loads(line) for line in fp]
+            assert [line["views"]["view"]["fingerprints"] for line in lines] == [
+                {"a": 1},
+                {"b": 1},
+            ]
+
+    def test_flush_thread(self):
+        flushed = threading.Event()
+        callback = mock.Mock(side_effect=lambda stats: flushed.set())
+        sampler = Sampler(callback, flush_interval=0.01, max_fingerprints=10)
+        sampler.add("view", ["a"])
+
+        assert flushed.wait(timeout=10)
+        assert callback.call_args[0][0]["views"]["view"]["fingerprints"] == {"a": 1}
+
+    def test_flush_thread_started_once(self):
+        sampler = Sampler(mock.Mock(), flush_interval=60, max_fingerprints=10)
+        with mock.patch.object(sampler, "start_flush_thread") as start_flush_thread:
+            sampler.add("view", ["a"])
+            sampler.flush_thread_pid = os.getpid()
+            sampler.add("view", ["b"])
+
+        start_flush_thread.assert_called_once_with()
+
+    def test_flush_samplers(self):
+        callback = mock.Mock()
+        sampler = Sampler(callback, flush_interval=60, max_fingerprints=10)
+        sampler.add("view", ["a"])
+        sampler.stop()
+
+        flush_samplers()
+
+        callback.assert_called_once()
+
+
+middleware = ["django_perf_rec.middleware.SamplingMiddleware"]
+
+
+@override_settings(ROOT_URLCONF=__name__, MIDDLEWARE=middleware)
+class SamplingMiddlewareTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.callback = mock.Mock()
+        self.addCleanup(stop_samplers)
+
+    def sampling_settings(self, rate: float = 1) -> override_settings:
+        return override_settings(
+            PERF_REC={
+                "SAMPLING_OUTPUT": self.callback,
+                "SAMPLING_RATE": rate,
+            }
+        )
+
+    def test_not_used_by_default(self):
+        with pytest.raises(MiddlewareNotUsed):
+            SamplingMiddleware(mock.Mock())
+
+    def test_output_required(self):
+        with (
+            override_settings(PERF_REC={"SAMPLING_RATE": 1}),
+            pytest.raises(AssertionError),
+        ):
+            SamplingMiddleware(mock.Mock())
+
+    def test_sampled(self):
+        with self.sampling_settings():
+            response = self.client.get("/authors/")
+        flush_samplers()
+
+        assert response.content == b"0"
+        self.callback.assert_called_once()
+        assert self.callback.call_args[0][0]["views"] == {
+            "authors": {
+                "requests": 1,
+                "ops_per_request": {"2-3": 1},
+                "distinct_per_request": {"2-3": 1},
+                "fingerprints": {"cache|get: authors": 1, count_query: 1},
+                "other_fingerprints": 0,
+            }
+        }
+
+    def test_not_sampled(self):
+        with (
+            self.sampling_settings(rate=0.5),
+            mock.patch("django_perf_rec.middleware.random", return_value=0.5),
+            mock.patch.object(Sampler, "add") as mock_add,
+        ):
+            response = self.client.get("/authors/")
+
+        assert response.content == b"0"
+        mock_add.assert_not_called()
+
+    def test_not_flushed_in_request(self):
+        with self.sampling_settings():
+            self.client.get("/authors/")
+            self.client.get("/authors/")
+
+        self.callback.assert_not_called()
+
+    def test_unresolved(self):
+        with self.sampling_settings():
+            response = self.client.get("/missing/")
+        flush_samplers()
+
+        assert response.status_code == 404
+        assert list(self.callback.call_args[0][0]["views"]) == ["<unresolved>"]
+
+    async def test_async(self):
+        with self.sampling_settings():
+            response = await self.async_client.get("/async-authors/")
+        flush_samplers()
+
+        assert response.content == b"0"
+        self.callback.assert_called_once()
+        fingerprints = self.callback.call_args[0][0]["views"]["async-authors"][
+            "fingerprints"
+        ]
+        assert fingerprints == {"cache|get: authors": 1, count_query: 1}
+
+    async def test_async_not_sampled(self):
+        with (
+            self.sampling_settings(rate=0.5),
+            mock.patch("django_perf_rec.middleware.random", return_value=0.9),
+        ):
+            response = await self.async_client.get("/async-authors/")
+        flush_samplers()
+
+        assert response.content == b"0"
+        self.callback.assert_not_called()
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from django.test import TestCase, override_settings
+
+from django_perf_rec import NPlusOneWarning, detect_n_plus_one, record
+from tests.testapp.models import Author, Book
+from tests.utils import run_query, temporary_path
+
+FILE_DIR = os.path.dirname(__file__)
+
+
+def create_authors_with_books(count: int) -> None:
+    for i in range(count):
+        author = Author.objects.create(name=f"Author {i}", age=i)
+        Book.objects.create(title=f"Book {i}", author=author)
+
+
+def list_book_authors() -> list[str]:
+    return [book.author.name for book in Book.objects.order_by("id")]
+
+
+class DetectNPlusOneTests(TestCase):
+    def test_no_repeats(self):
+        create_authors_with_books(3)
+        with detect_n_plus_one(threshold=2):
+            list(Book.objects.select_related("author"))
+
+    def test_below_threshold(self):
+        create_authors_with_books(2)
+        with detect_n_plus_one(threshold=3):
+            list_book_authors()
+
+    def test_error(self):
+        create_authors_with_books(3)
+        with pytest.raises(AssertionError) as excinfo, detect_n_plus_one(threshold=3):
+            list_book_authors()
+
+        lines = str(excinfo.value).splitlines()
+        assert lines[0] == "Potential N+1 queries:"
+        assert lines[1] == (
+            '  3 x db: SELECT ... FROM "testapp_author" '
+            + 'WHERE "testapp_author"."id" = # LIMIT #'
+        )
+        assert lines[2].startswith(f"    from {__file__}:")
+        assert lines[2].endswith(" in <listcomp>") or lines[2].endswith(
+            " in list_book_authors"
+        )
+        assert len(lines) == 3
+
+    def test_warning(self):
+        create_authors_with_books(3)
+        with (
+            pytest.warns(NPlusOneWarning, match="Potential N\\+1 queries") as record,
+            detect_n_plus_one(threshold=3, action="warning"),
+        ):
+            list_book_authors()
+
+        assert record[0].filename == __file__
+
+    def test_grouped_by_callsite(self):
+        with detect_n_plus_one(threshold=5) as detector:
+            for _ in range(2):
+                run_query("default", "SELECT 1")
+            for _ in range(2):
+                run_query("default", "SELECT 1")
+
+        assert len(detector.counts) == 1
+        ((_, _, callsite),) = detector.counts
+        assert callsite is not None
+        assert callsite[0].endswith(os.path.join("tests", "utils.py"))
+
+    def test_counted_separately_by_callsite(self):
+        with detect_n_plus_one(threshold=3) as detector:
+            for _ in range(2):
+                list(Author.objects.filter(id=1))
+            for _ in range(2):
+                list(Author.objects.filter(id=1))
+
+        assert sorted(detector.counts.values()) == [2, 2]
+
+    def test_exception_not_masked(self):
+        with pytest.raises(ValueError), detect_n_plus_one(threshold=2):
+            for _ in range(2):
+                list(Author.objects.filter(id=1))
+            raise ValueError("boom")
+
+    def test_threshold_validated(self):
+        with pytest.raises(AssertionError):
+            detect_n_plus_one(threshold=1)
+
+
+class RecordNPlusOneTests(TestCase):
+    @override_settings(PERF_REC={"N_PLUS_ONE_THRESHOLD": 3, "MODE": "overwrite"})
+    def test_record_error(self):
+        create_authors_with_books(3)
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.raises(AssertionError, match="Potential N\\+1 queries"),
+            record(path="perf_files/"),
+        ):
+            list_book_authors()
+
+    @override_settings(
+        PERF_REC={
+            "N_PLUS_ONE_THRESHOLD": 3,
+            "N_PLUS_ONE_ACTION": "warning",
+            "MODE": "overwrite",
+        }
+    )
+    def test_record_warning(self):
+        create_authors_with_books(3)
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.warns(NPlusOneWarning),
+            record(path="perf_files/"),
+        ):
+            list_book_authors()
+
+    @override_settings(PERF_REC={"N_PLUS_ONE_THRESHOLD": 3, "MODE": "overwrite"})
+    def test_record_ignores_capture_operation(self):
+        create_authors_with_books(3)
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.raises(AssertionError, match="Potential N\\+1 queries"),
+            record(path="perf_files/", capture_operation=lambda op: False),
+        ):
+            list_book_authors()
+
+    @override_settings(PERF_REC={"MODE": "overwrite"})
+    def test_record_disabled_by_default(self):
+        create_authors_with_books(3)
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir), record(path="perf_files/"):
+            list_book_authors()
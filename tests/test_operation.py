@@ -1,11 +1,23 @@
 from __future__ import annotations
 
-from traceback import extract_stack
+from traceback import StackSummary, extract_stack
 
 import pytest
 from django.test import SimpleTestCase
 
-from django_perf_rec.operation import Operation
+from django_perf_rec.operation import FrameSnapshot, Operation
+
+
+class FrameSnapshotTests(SimpleTestCase):
+    def test_summary_matches_extract_stack(self):
+        snapshot, summary = FrameSnapshot.capture(), extract_stack()
+        assert snapshot.summary() == summary
+        assert snapshot.summary().format() == summary.format()
+
+    def test_innermost_frame_is_caller(self):
+        snapshot = FrameSnapshot.capture()
+        code, _ = snapshot.frames[-1]
+        assert code.co_name == "test_innermost_frame_is_caller"
 
 
 class OperationTests(SimpleTestCase):
@@ -14,3 +26,39 @@ class OperationTests(SimpleTestCase):
 
         with pytest.raises(TypeError):
             operation.name  # noqa: B018
+
+    def test_traceback_from_snapshot(self):
+        snapshot = FrameSnapshot.capture()
+        operation = Operation("hi", "world", snapshot)
+
+        assert isinstance(operation.traceback, StackSummary)
+        assert operation.traceback == snapshot.summary()
+        assert operation.traceback is operation.traceback
+
+    def test_callsite_from_snapshot(self):
+        operation = Operation("hi", "world", FrameSnapshot.capture())
+
+        callsite = operation.callsite()
+        assert callsite is not None
+        filename, lineno, name = callsite
+        assert filename == __file__
+        assert name == "test_callsite_from_snapshot"
+
+    def test_callsite_from_summary(self):
+        operation = Operation("hi", "world", extract_stack())
+
+        callsite = operation.callsite()
+        assert callsite is not None
+        assert callsite[2] == "test_callsite_from_summary"
+
+    def test_callsite_skips_prefixes(self):
+        operation = Operation("hi", "world", FrameSnapshot.capture())
+
+        callsite = operation.callsite((__file__,))
+        assert callsite is not None
+        assert callsite[0] != __file__
+
+    def test_callsite_all_skipped(self):
+        operation = Operation("hi", "world", FrameSnapshot.capture())
+
+        assert operation.callsite(("",)) is None
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import shutil
+from tempfile import mkdtemp
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from django_perf_rec import prune
+from django_perf_rec.api import record
+from django_perf_rec.yaml import KVFile
+
+
+class TrackingTests(SimpleTestCase):
+    def test_not_tracking(self):
+        with mock.patch.object(prune, "used_records", None):
+            prune.mark_used("foo.perf.yml", "foo")
+            assert prune.take_used() == {}
+
+    def test_take_used(self):
+        with mock.patch.object(prune, "used_records", None):
+            prune.start_tracking()
+            prune.mark_used("foo.perf.yml", "foo")
+            prune.mark_used("foo.perf.yml", "foo.2")
+            prune.add_used({"foo.perf.yml": ["bar"], "bar.perf.yml": ["bar"]})
+
+            assert prune.take_used() == {
+                "foo.perf.yml": {"foo", "foo.2", "bar"},
+                "bar.perf.yml": {"bar"},
+            }
+            assert prune.take_used() == {}
+
+    def test_record_marks_used(self):
+        temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with mock.patch.object(prune, "used_records", {}):
+            with record(path=temp_dir + "/"):
+                pass
+            with record(path=temp_dir + "/"):
+                pass
+
+            used = prune.take_used()
+
+        assert used == {
+            temp_dir + "/test_prune.perf.yml": {
+                "TrackingTests.test_record_marks_used",
+                "TrackingTests.test_record_marks_used.2",
+            }
+        }
+
+
+class IsTestRecordTests(SimpleTestCase):
+    def test_base_name(self):
+        assert prune.is_test_record("FooTests.test_foo", {"FooTests.test_foo"})
+
+    def test_suffixed(self):
+        assert prune.is_test_record("FooTests.test_foo.2", {"FooTests.test_foo"})
+        assert prune.is_test_record("test_foo.12", {"test_foo"})
+
+    def test_other_test(self):
+        assert not prune.is_test_record("FooTests.test_foo2", {"FooTests.test_foo"})
+        assert not prune.is_test_record("FooTests.test_foo.x", {"FooTests.test_foo"})
+        assert not prune.is_test_record("FooTests.test_foo", {"test_foo"})
+
+
+class IsDefaultRecordNameTests(SimpleTestCase):
+    def test_default(self):
+        assert prune.is_default_record_name("test_foo")
+        assert prune.is_default_record_name("test_foo.2")
+        assert prune.is_default_record_name("FooTests.test_foo")
+        assert prune.is_default_record_name("FooTests.test_foo.12")
+        assert prune.is_default_record_name("test_foo[a.b-1]")
+        assert prune.is_default_record_name("FooTests.test_foo[1].2")
+
+    def test_custom(self):
+        assert not prune.is_default_record_name("custom")
+        assert not prune.is_default_record_name("custom.2")
+        assert not prune.is_default_record_name("FooTests.custom")
+        assert not prune.is_default_record_name("a.FooTests.test_foo")
+        assert not prune.is_default_record_name("test foo")
+
+
+class PruneTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        KVFile._clear_load_cache()
+        self.temp_dir = mkdtemp()
+        self.foo = self.temp_dir + "/foo.perf.yml"
+        self.bar = self.temp_dir + "/bar.perf.json"
+        KVFile.save(
+            self.foo,
+            {"test_a": [], "test_a.2": [], "test_b": [], "test_c": [], "test_c.2": []},
+        )
+        KVFile.save(self.bar, {"test_a": [], "test_b": []})
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def test_prune(self):
+        removed = prune.prune(
+            {self.foo: {"test_a", "test_b"}, self.bar: {"test_a", "test_b"}},
+            {self.foo: {"test_a", "test_b"}},
+        )
+
+        assert removed == {self.foo: ["test_a.2"]}
+        assert KVFile.load_file(self.foo).keys() == {
+            "test_a",
+            "test_b",
+            "test_c",
+            "test_c.2",
+        }
+        assert KVFile.load_file(self.bar).keys() == {"test_a", "test_b"}
+
+    def test_prune_dry_run(self):
+        removed = prune.prune(
+            {self.foo: {"test_a"}, self.bar: {"test_a"}}, {}, dry_run=True
+        )
+
+        assert removed == {
+            self.bar: ["test_b"],
+            self.foo: ["test_a.2", "test_b", "test_c", "test_c.2"],
+        }
+        assert len(KVFile.load_file(self.foo)) == 5
+        assert len(KVFile.load_file(self.bar)) == 2
+
+    def test_prune_only_used_files(self):
+        removed = prune.prune({self.foo: {"test_a"}}, {})
+
+        assert removed == {self.foo: ["test_a.2", "test_b", "test_c", "test_c.2"]}
+        assert len(KVFile.load_file(self.bar)) == 2
+
+    def test_prune_no_passed_tests(self):
+        removed = prune.prune({self.foo: {"test_a"}}, {self.foo: set()})
+
+        assert removed == {}
+        assert len(KVFile.load_file(self.foo)) == 5
+
+    def test_prune_custom_names(self):
+        KVFile.save(self.foo, {"custom": [], "custom.2": [], "FooTests.custom": []})
+
+        removed = prune.prune({self.foo: {"test_a"}}, {})
+
+        assert removed == {self.foo: ["test_a.2", "test_b", "test_c", "test_c.2"]}
+        assert KVFile.load_file(self.foo).keys() == {
+            "test_a",
+            "custom",
+            "custom.2",
+            "FooTests.custom",
+        }
+
+    def test_prune_journaled(self):
+        KVFile(self.foo).set_journaled("test_d", [])
+
+        removed = prune.prune({self.foo: {"test_a", "test_a.2"}}, {})
+
+        assert removed == {self.foo: ["test_b", "test_c", "test_c.2", "test_d"]}
+        assert KVFile.load_file(self.foo) == {"test_a": [], "test_a.2": []}
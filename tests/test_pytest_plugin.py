@@ -1,17 +1,475 @@
 from __future__ import annotations
 
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import mkdtemp
+from typing import Any
+from unittest import mock
+
+import pytest
 from django.test import SimpleTestCase
 
-from django_perf_rec import pytest_plugin
+from django_perf_rec import prune, pytest_plugin, state
+from django_perf_rec.sql import fingerprint_cache
+from django_perf_rec.timings import timings
+from django_perf_rec.yaml import KVFile
 from tests.utils import pretend_not_under_pytest
 
 
 class PytestPluginTests(SimpleTestCase):
     def test_in_pytest(self):
         # We always run our tests in pytest
-        assert pytest_plugin.in_pytest
+        assert state.in_pytest
 
     def test_in_pytest_pretend(self):
         # The test helper should work to ignore it
         with pretend_not_under_pytest():
-            assert not pytest_plugin.in_pytest
+            assert not state.in_pytest
+
+    def test_terminal_summary_cache_stats(self):
+        config = mock.Mock()
+        config.getoption.side_effect = {
+            "perf_rec_cache_stats": True,
+            "perf_rec_slowest": 0,
+        }.__getitem__
+        terminalreporter = mock.Mock()
+        with (
+            mock.patch.object(fingerprint_cache, "hits", 3),
+            mock.patch.object(fingerprint_cache, "misses", 1),
+            mock.patch.object(fingerprint_cache, "evictions", 2),
+        ):
+            pytest_plugin.pytest_terminal_summary(terminalreporter, config)
+
+        line = terminalreporter.write_line.call_args[0][0]
+        assert line.startswith(
+            "hits: 3, misses: 1 (75.0% hit rate), evictions: 2, size: "
+        )
+
+    def test_terminal_summary_cache_stats_disabled(self):
+        config = mock.Mock()
+        config.getoption.side_effect = {
+            "perf_rec_cache_stats": False,
+            "perf_rec_slowest": 10,
+        }.__getitem__
+        terminalreporter = mock.Mock()
+        pytest_plugin.pytest_terminal_summary(terminalreporter, config)
+        assert terminalreporter.mock_calls == []
+
+    def test_terminal_summary_slowest(self):
+        config = mock.Mock()
+        config.getoption.side_effect = {
+            "perf_rec_cache_stats": False,
+            "perf_rec_slowest": 1,
+        }.__getitem__
+        terminalreporter = mock.Mock()
+        samples = {
+            "/tmp/foo.perf-timings.json": {
+                "db: SELECT #": [0.001, 0.003],
+                "cache|get: foo": [0.002],
+            }
+        }
+        with mock.patch.object(timings, "samples", samples):
+            pytest_plugin.pytest_terminal_summary(terminalreporter, config)
+
+        terminalreporter.write_sep.assert_called_once_with(
+            "-", "django-perf-rec slowest 1 operations"
+        )
+        terminalreporter.write_line.assert_called_once_with(
+            "     3.000ms p95      1.000ms p50      3.000ms max      2x  db: SELECT #"
+        )
+
+    def test_import_without_pytest(self):
+        # pytest is optional, outside of running the plugin
+        code = (
+            "import sys\n"
+            + "sys.modules['pytest'] = sys.modules['_pytest'] = None\n"
+            + "import django_perf_rec, django_perf_rec.middleware\n"
+            + "import django_perf_rec.pytest_plugin\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_not_xdist_worker(self):
+        assert not state.xdist_worker
+
+    def test_sessionfinish_flushes(self):
+        session = mock.Mock()
+        with mock.patch.object(KVFile, "flush") as flush:
+            pytest_plugin.pytest_sessionfinish(session)
+        flush.assert_called_once_with()
+
+    def test_sessionfinish_xdist_worker_sends_pending(self):
+        session = mock.Mock()
+        session.config.workeroutput = {}
+        pending = {"/tmp/foo.perf.yml": {"foo": [{"cache|get": "bar"}]}}
+        with (
+            mock.patch.object(state, "xdist_worker", True),
+            mock.patch.object(state, "pruning", False),
+            mock.patch.object(KVFile, "PENDING", dict(pending)),
+            mock.patch.object(KVFile, "flush") as flush,
+        ):
+            pytest_plugin.pytest_sessionfinish(session)
+            remaining = KVFile.PENDING
+
+        flush.assert_not_called()
+        assert session.config.workeroutput == {
+            pytest_plugin.workeroutput_key: pending,
+            pytest_plugin.timings_workeroutput_key: {},
+        }
+        assert remaining == {}
+
+    def test_testnodedown_adds_pending(self):
+        node = mock.Mock()
+        node.workeroutput = {
+            pytest_plugin.workeroutput_key: {
+                "/tmp/foo.perf.yml": {"foo2": [{"cache|get": "baz"}]},
+            }
+        }
+        with (
+            mock.patch.object(
+                KVFile, "PENDING", {"/tmp/foo.perf.yml": {"foo": [{"db": "SELECT #"}]}}
+            ),
+            mock.patch.object(KVFile, "register_flush"),
+        ):
+            pytest_plugin.pytest_testnodedown(node, None)
+            pending = KVFile.PENDING
+
+        assert pending == {
+            "/tmp/foo.perf.yml": {
+                "foo": [{"db": "SELECT #"}],
+                "foo2": [{"cache|get": "baz"}],
+            }
+        }
+
+    def test_testnodedown_merges_timings(self):
+        node = mock.Mock()
+        node.workeroutput = {
+            pytest_plugin.timings_workeroutput_key: {
+                "/tmp/foo.perf-timings.json": {"db: SELECT #": [0.5]},
+            }
+        }
+        with (
+            mock.patch.object(timings, "samples", {}),
+            mock.patch.object(timings, "dirty", set()),
+            mock.patch.object(timings, "register_flush"),
+        ):
+            pytest_plugin.pytest_testnodedown(node, None)
+            samples = timings.samples
+
+        assert samples == {"/tmp/foo.perf-timings.json": {"db: SELECT #": [0.5]}}
+
+    def test_testnodedown_crashed(self):
+        node = mock.Mock(spec=[])
+        with mock.patch.object(KVFile, "PENDING", {}):
+            pytest_plugin.pytest_testnodedown(node, "crashed")
+            pending = KVFile.PENDING
+
+        assert pending == {}
+
+
+class PytestPluginPruneTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patchers: list[Any] = [
+            mock.patch.object(state, "pruning", True),
+            mock.patch.object(pytest_plugin, "passed_nodeids", set()),
+            mock.patch.object(pytest_plugin, "prune_items", []),
+            mock.patch.object(pytest_plugin, "worker_tests", []),
+            mock.patch.object(pytest_plugin, "module_nodeids", {}),
+            mock.patch.object(pytest_plugin, "found_nodeids", {}),
+            mock.patch.object(pytest_plugin, "collected_nodeids", set()),
+            mock.patch.object(pytest_plugin, "complete_files", set()),
+            mock.patch.object(pytest_plugin, "pruned", None),
+            mock.patch.object(prune, "used_records", {}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_item(self, nodeid: str, name: str, cls: type | None) -> mock.Mock:
+        item = mock.Mock(nodeid=nodeid, path=Path("/tmp/test_foo.py"), cls=cls)
+        item.name = name
+        return item
+
+    def test_runtest_logreport(self):
+        for when, outcome in [
+            ("setup", "passed"),
+            ("call", "passed"),
+            ("call", "failed"),
+            ("call", "skipped"),
+        ]:
+            report = mock.Mock(
+                nodeid=f"{when}-{outcome}", when=when, passed=outcome == "passed"
+            )
+            pytest_plugin.pytest_runtest_logreport(report)
+
+        assert pytest_plugin.passed_nodeids == {"call-passed"}
+
+    def collect_module(self, deselected: bool = False) -> None:
+        module = mock.Mock(
+            spec=pytest.Module, nodeid="test_foo.py", path=Path("/tmp/test_foo.py")
+        )
+        items: list[Any] = [
+            self.make_item("test_foo.py::test_a", "test_a", None),
+            self.make_item("test_foo.py::test_b", "test_b", None),
+        ]
+        pytest_plugin.pytest_collectreport(
+            mock.Mock(nodeid="", passed=True, result=[module])
+        )
+        pytest_plugin.pytest_collectreport(
+            mock.Mock(nodeid="test_foo.py", passed=True, result=items)
+        )
+        pytest_plugin.pytest_collection_finish(mock.Mock(items=items[:1]))
+        if deselected:
+            pytest_plugin.pytest_deselected(items[1:])
+
+    def test_get_tests(self):
+        class FooTests:
+            pass
+
+        pytest_plugin.pytest_deselected(
+            [self.make_item("test_foo.py::test_a", "test_a", None)]
+        )
+        pytest_plugin.prune_items.append(
+            self.make_item("test_foo.py::FooTests::test_b", "test_b", FooTests)
+        )
+
+        assert pytest_plugin.get_tests() == [
+            ("test_foo.py::test_a", "/tmp/test_foo.perf.yml", "test_a"),
+            (
+                "test_foo.py::FooTests::test_b",
+                "/tmp/test_foo.perf.yml",
+                "FooTests.test_b",
+            ),
+        ]
+
+    def test_get_complete_files(self):
+        self.collect_module(deselected=True)
+
+        assert pytest_plugin.get_complete_files() == ["/tmp/test_foo.perf.yml"]
+
+    def test_get_complete_files_partly_collected(self):
+        # As when selecting test_a by node ID
+        self.collect_module()
+
+        assert pytest_plugin.get_complete_files() == []
+
+    def test_get_complete_files_module_not_collected(self):
+        # Selecting tests by node ID reports them without their module
+        item = self.make_item("test_foo.py::test_a", "test_a", None)
+        pytest_plugin.pytest_collectreport(
+            mock.Mock(nodeid="", passed=True, result=[item])
+        )
+        pytest_plugin.pytest_collection_finish(mock.Mock(items=[item]))
+
+        assert pytest_plugin.get_complete_files() == []
+
+    def test_sessionfinish_prunes(self):
+        session = mock.Mock()
+        session.config.getoption.return_value = True
+        self.collect_module(deselected=True)
+        pytest_plugin.worker_tests.append(
+            ("test_bar.py::test_c", "/tmp/test_bar.perf.yml", "test_c")
+        )
+        pytest_plugin.complete_files.add("/tmp/test_bar.perf.yml")
+        pytest_plugin.passed_nodeids.update(
+            ["test_foo.py::test_a", "test_bar.py::test_c"]
+        )
+        prune.mark_used("/tmp/test_foo.perf.yml", "test_a")
+        prune.mark_used("/tmp/test_bar.perf.yml", "test_c")
+        prune.mark_used("/tmp/test_baz.perf.yml", "test_d")
+
+        with (
+            mock.patch.object(KVFile, "flush"),
+            mock.patch.object(
+                prune, "prune", return_value={"/tmp/test_foo.perf.yml": ["test_a.2"]}
+            ) as mock_prune,
+        ):
+            pytest_plugin.pytest_sessionfinish(session)
+
+        session.config.getoption.assert_called_once_with("perf_rec_prune_dry_run")
+        mock_prune.assert_called_once_with(
+            {
+                "/tmp/test_foo.perf.yml": {"test_a"},
+                "/tmp/test_bar.perf.yml": {"test_c"},
+            },
+            {"/tmp/test_foo.perf.yml": {"test_a"}},
+            dry_run=True,
+        )
+        assert pytest_plugin.pruned == {"/tmp/test_foo.perf.yml": ["test_a.2"]}
+
+    def test_sessionfinish_xdist_worker_sends_prune(self):
+        session = mock.Mock()
+        session.config.workeroutput = {}
+        self.collect_module(deselected=True)
+        prune.mark_used("/tmp/test_foo.perf.yml", "test_b")
+
+        with (
+            mock.patch.object(state, "xdist_worker", True),
+            mock.patch.object(prune, "prune") as mock_prune,
+        ):
+            pytest_plugin.pytest_sessionfinish(session)
+
+        mock_prune.assert_not_called()
+        assert session.config.workeroutput[pytest_plugin.prune_workeroutput_key] == {
+            "used": {"/tmp/test_foo.perf.yml": ["test_b"]},
+            "tests": [
+                ("test_foo.py::test_a", "/tmp/test_foo.perf.yml", "test_a"),
+                ("test_foo.py::test_b", "/tmp/test_foo.perf.yml", "test_b"),
+            ],
+            "complete": ["/tmp/test_foo.perf.yml"],
+        }
+
+    def test_testnodedown_adds_prune(self):
+        node = mock.Mock()
+        node.workeroutput = {
+            pytest_plugin.prune_workeroutput_key: {
+                "used": {"/tmp/test_foo.perf.yml": ["test_b"]},
+                "tests": [["test_foo.py::test_a", "/tmp/test_foo.perf.yml", "test_a"]],
+                "complete": ["/tmp/test_foo.perf.yml"],
+            }
+        }
+
+        pytest_plugin.pytest_testnodedown(node, None)
+
+        assert prune.take_used() == {"/tmp/test_foo.perf.yml": {"test_b"}}
+        assert pytest_plugin.worker_tests == [
+            ("test_foo.py::test_a", "/tmp/test_foo.perf.yml", "test_a")
+        ]
+        assert pytest_plugin.complete_files == {"/tmp/test_foo.perf.yml"}
+
+    def test_terminal_summary_pruned(self):
+        config = mock.Mock()
+        config.getoption.side_effect = {
+            "perf_rec_cache_stats": False,
+            "perf_rec_slowest": 0,
+            "perf_rec_prune_dry_run": False,
+        }.__getitem__
+        terminalreporter = mock.Mock()
+        pytest_plugin.pruned = {
+            "/tmp/test_foo.perf.yml": ["test_a.2"],
+            "/tmp/test_bar.perf.yml": ["test_a", "test_b"],
+        }
+
+        pytest_plugin.pytest_terminal_summary(terminalreporter, config)
+
+        terminalreporter.write_sep.assert_called_once_with(
+            "-", "django-perf-rec pruned records"
+        )
+        assert terminalreporter.write_line.mock_calls == [
+            mock.call("/tmp/test_foo.perf.yml: 1 record"),
+            mock.call("  test_a.2"),
+            mock.call("/tmp/test_bar.perf.yml: 2 records"),
+            mock.call("  test_a"),
+            mock.call("  test_b"),
+        ]
+
+    def test_terminal_summary_pruned_dry_run_none(self):
+        config = mock.Mock()
+        config.getoption.side_effect = {
+            "perf_rec_cache_stats": False,
+            "perf_rec_slowest": 0,
+            "perf_rec_prune_dry_run": True,
+        }.__getitem__
+        terminalreporter = mock.Mock()
+        pytest_plugin.pruned = {}
+
+        pytest_plugin.pytest_terminal_summary(terminalreporter, config)
+
+        terminalreporter.write_sep.assert_called_once_with(
+            "-", "django-perf-rec records to prune"
+        )
+        terminalreporter.write_line.assert_called_once_with("No unused records.")
+
+
+class PytestPluginPruneRunTests(SimpleTestCase):
+    """
+    Run Pytest with the plugin on a test module, with the records of its
+    tests, a deleted test, and a custom record name.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        with open(os.path.join(self.temp_dir, "test_foo.py"), "w") as fp:
+            fp.write(
+                "from django.test import SimpleTestCase\n"
+                + "from django_perf_rec import record\n"
+                + "\n"
+                + "class FooTests(SimpleTestCase):\n"
+                + "    def test_a(self):\n"
+                + "        with record():\n"
+                + "            pass\n"
+                + "\n"
+                + "    def test_b(self):\n"
+                + "        with record():\n"
+                + "            pass\n"
+                + "\n"
+                + "def test_c():\n"
+                + "    with record():\n"
+                + "        pass\n"
+            )
+        self.perf_file = os.path.join(self.temp_dir, "test_foo.perf.yml")
+        KVFile._clear_load_cache()
+        KVFile.save(
+            self.perf_file,
+            {
+                "FooTests.test_a": [],
+                "FooTests.test_b": [],
+                "test_c": [],
+                "test_c.2": [],
+                "test_gone": [],
+                "custom": [],
+            },
+        )
+        self.addCleanup(KVFile._clear_load_cache)
+
+    def run_pytest(self, *args: str) -> set[str]:
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE="tests.settings",
+            PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        subprocess.run(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider"]
+            + ["-c", os.devnull, "--rootdir", self.temp_dir, "--perf-rec-prune"]
+            + list(args),
+            cwd=self.temp_dir,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        KVFile._clear_load_cache()
+        return set(KVFile.load_file(self.perf_file))
+
+    def test_node_id(self):
+        records = self.run_pytest("test_foo.py::FooTests::test_a")
+
+        assert records == {
+            "FooTests.test_a",
+            "FooTests.test_b",
+            "test_c",
+            "test_c.2",
+            "test_gone",
+            "custom",
+        }
+
+    def test_deselected(self):
+        records = self.run_pytest("test_foo.py", "-k", "test_a")
+
+        assert records == {
+            "FooTests.test_a",
+            "FooTests.test_b",
+            "test_c",
+            "test_c.2",
+            "test_gone",
+            "custom",
+        }
+
+    def test_module(self):
+        records = self.run_pytest("test_foo.py")
+
+        assert records == {"FooTests.test_a", "FooTests.test_b", "test_c", "custom"}
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from django_perf_rec import (
+    RedundantCacheOpWarning,
+    detect_redundant_cache_ops,
+    record,
+)
+from tests.utils import temporary_path
+
+FILE_DIR = os.path.dirname(__file__)
+
+
+def get_each(keys: list[str]) -> None:
+    for key in keys:
+        caches["default"].get(key)
+
+
+class DetectRedundantCacheOpsTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        caches["second"].clear()
+
+    def test_no_findings(self):
+        with detect_redundant_cache_ops() as detector:
+            caches["default"].get("foo")
+            caches["default"].set("foo", 1)
+            caches["default"].get("foo")
+            caches["default"].get_many(["bar", "baz"])
+            caches["default"].delete("foo")
+
+        assert detector.findings() == {}
+
+    def test_repeated_fetch(self):
+        with pytest.raises(AssertionError) as excinfo, detect_redundant_cache_ops():
+            caches["default"].get("foo")
+            caches["default"].get_many(["foo", "bar"])
+
+        lines = str(excinfo.value).splitlines()
+        assert lines[0] == "Redundant cache operations:"
+        assert lines[1] == "  repeated fetch: cache|get_many of 'foo'"
+        assert lines[2].startswith(f"    from {__file__}:")
+        assert lines[2].endswith(" in test_repeated_fetch")
+        assert len(lines) == 3
+
+    def test_repeated_fetch_counted(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            for _ in range(3):
+                caches["default"].get("foo")
+
+        ((description, _), count) = detector.findings().popitem()
+        assert description == "repeated fetch: cache|get of 'foo'"
+        assert count == 2
+
+    def test_fetch_on_different_aliases(self):
+        with detect_redundant_cache_ops() as detector:
+            caches["default"].get("foo")
+            caches["second"].get("foo")
+
+        assert detector.findings() == {}
+
+    def test_unchanged_set(self):
+        caches["default"].set("foo", [1, 2])
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            caches["default"].get("foo")
+            caches["default"].set("foo", [1, 2])
+
+        assert [description for description, _ in detector.findings()] == [
+            "unchanged set: cache|set of 'foo' to the value just fetched"
+        ]
+
+    def test_unchanged_set_many(self):
+        caches["default"].set("foo", 1)
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            caches["default"].get_many(["foo", "bar"])
+            caches["default"].set_many({"foo": 1, "bar": 2})
+
+        assert [description for description, _ in detector.findings()] == [
+            "unchanged set: cache|set_many of 'foo' to the value just fetched"
+        ]
+
+    def test_changed_set(self):
+        caches["default"].set("foo", 1)
+        with detect_redundant_cache_ops() as detector:
+            caches["default"].get("foo")
+            caches["default"].set("foo", 2)
+
+        assert detector.findings() == {}
+
+    def test_set_after_miss(self):
+        with detect_redundant_cache_ops() as detector:
+            caches["default"].get("foo")
+            caches["default"].set("foo", None)
+
+        assert detector.findings() == {}
+
+    def test_get_loop(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            get_each(["a", "b", "c", "d"])
+
+        ((description, callsite),) = detector.findings()
+        assert description == (
+            "get loop: 4 x cache|get of different keys could be one get_many()"
+        )
+        assert callsite is not None
+        assert callsite[2] == "get_each"
+
+    def test_get_loop_below_threshold(self):
+        with detect_redundant_cache_ops(get_many_threshold=3) as detector:
+            get_each(["a", "b"])
+
+        assert detector.findings() == {}
+
+    def test_get_loop_threshold(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(
+                get_many_threshold=2, action="warning"
+            ) as detector,
+        ):
+            get_each(["a", "b"])
+
+        assert len(detector.findings()) == 1
+
+    def test_get_loop_broken_by_other_operation(self):
+        with detect_redundant_cache_ops() as detector:
+            get_each(["a", "b"])
+            caches["default"].set("c", 1)
+            get_each(["d", "e"])
+
+        assert detector.findings() == {}
+
+    def test_needless_delete(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            caches["default"].delete("foo")
+
+        assert [description for description, _ in detector.findings()] == [
+            "needless delete: cache|delete of unset 'foo'"
+        ]
+
+    def test_needless_delete_many_after_miss(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning),
+            detect_redundant_cache_ops(action="warning") as detector,
+        ):
+            caches["default"].get_many(["foo"])
+            caches["default"].delete_many(["foo"])
+
+        assert [description for description, _ in detector.findings()] == [
+            "needless delete: cache|delete_many of unset 'foo'"
+        ]
+
+    def test_delete_after_set(self):
+        with detect_redundant_cache_ops() as detector:
+            caches["default"].set("foo", 1)
+            caches["default"].delete_many(["foo"])
+
+        assert detector.findings() == {}
+
+    def test_warning(self):
+        with (
+            pytest.warns(RedundantCacheOpWarning, match="repeated fetch") as record,
+            detect_redundant_cache_ops(action="warning"),
+        ):
+            caches["default"].get("foo")
+            caches["default"].get("foo")
+
+        assert record[0].filename == __file__
+
+    def test_exception_not_masked(self):
+        with pytest.raises(ValueError), detect_redundant_cache_ops():
+            caches["default"].get("foo")
+            caches["default"].get("foo")
+            raise ValueError("boom")
+
+    def test_get_many_threshold_validated(self):
+        with pytest.raises(AssertionError):
+            detect_redundant_cache_ops(get_many_threshold=1)
+
+
+class RecordRedundantCacheOpsTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+
+    @override_settings(PERF_REC={"REDUNDANT_CACHE_OPS": "error", "MODE": "overwrite"})
+    def test_record_error(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.raises(AssertionError, match="Redundant cache operations"),
+            record(path="perf_files/"),
+        ):
+            caches["default"].get("foo")
+            caches["default"].get("foo")
+
+    @override_settings(PERF_REC={"REDUNDANT_CACHE_OPS": "warning", "MODE": "overwrite"})
+    def test_record_warning(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.warns(RedundantCacheOpWarning),
+            record(path="perf_files/"),
+        ):
+            caches["default"].delete("foo")
+
+    @override_settings(PERF_REC={"MODE": "overwrite"})
+    def test_record_disabled_by_default(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir), record(path="perf_files/"):
+            caches["default"].get("foo")
+            caches["default"].get("foo")
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from django.test import SimpleTestCase
+
+from django_perf_rec.report import Report, record_counts
+
+
+class RecordCountsTests(SimpleTestCase):
+    def test_counts(self):
+        counts = record_counts(
+            [
+                {"db": "SELECT #"},
+                {"cache|get_many": ["a", "b"]},
+                {"db": "SELECT #", "repeat": 3},
+                {"db|replica": "SELECT #", "traceback": ["File 'x.py'"]},
+            ]
+        )
+
+        assert counts == {
+            "db: SELECT #": 4,
+            "cache|get_many: ['a', 'b']": 1,
+            "db|replica: SELECT #": 1,
+        }
+
+
+class ReportTests(SimpleTestCase):
+    def test_collapsed_repeats_unchanged(self):
+        report = Report()
+
+        changes = list(
+            report.compare_file(
+                "test_x.perf.yml",
+                {"foo": [{"db": "SELECT #"}, {"db": "SELECT #"}]},
+                {"foo": [{"db": "SELECT #", "repeat": 2}]},
+            )
+        )
+
+        assert changes == []
+        assert report.summary() == {
+            "changed_records": 0,
+            "totals": {
+                "queries": {"old": 0, "new": 0},
+                "cache_ops": {"old": 0, "new": 0},
+            },
+            "tables": {},
+        }
+
+    def test_tables(self):
+        report = Report()
+
+        changes = list(
+            report.compare_file(
+                "test_x.perf.yml",
+                {
+                    "foo": [{"db": 'SELECT ... FROM "a" INNER JOIN "b" ON (...)'}],
+                    "bar": [{"db|replica": 'UPDATE "c" SET ...'}],
+                },
+                {
+                    "foo": [{"db": 'SELECT ... FROM "a"'}],
+                    "bar": [{"db|replica": 'UPDATE "c" SET ...'}],
+                },
+            )
+        )
+
+        assert [change["record"] for change in changes] == ["foo"]
+        assert report.tables == {
+            "a": {"old": 1, "new": 1},
+            "b": {"old": 1, "new": 0},
+        }
+        assert report.changed_tables() == {"b": {"old": 1, "new": 0}}
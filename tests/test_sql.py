@@ -1,6 +1,22 @@
 from __future__ import annotations
 
-from django_perf_rec.sql import sql_fingerprint
+import sqlite3
+import threading
+from unittest import mock
+
+import pytest
+
+from django_perf_rec.sql import (
+    FingerprintCache,
+    FingerprintCacheInfo,
+    PersistentFingerprintCache,
+    fingerprint_cache,
+    get_persistent_fingerprint_cache,
+    native_sql_fingerprint,
+    sql_fingerprint,
+    sql_tables,
+    sqlparse_sql_fingerprint,
+)
 
 
 def test_empty():
@@ -332,3 +348,346 @@ def test_multiple_queries():
         )
         == "SELECT ...; UPDATE user SET ..."
     )
+
+
+# Queries in the shapes Django's compiler generates, which the native engine
+# should fingerprint identically to sqlparse.
+native_queries = [
+    "BEGIN",
+    "COMMIT",
+    "ROLLBACK",
+    'SAVEPOINT "s140323809662784_x1"',
+    'RELEASE SAVEPOINT "s140323809662784_x1"',
+    "ROLLBACK TO SAVEPOINT `s140323809662784_x1`",
+    (
+        'DECLARE "_django_curs_140323809662784_sync_1" NO SCROLL CURSOR WITHOUT '
+        + 'HOLD FOR SELECT "a"."id", "a"."b" FROM "a"'
+    ),
+    "SELECT `f1`, `f2` FROM `b` WHERE `x` IN (1, 2, 3) AND (`y` = 1 OR `y` = 2)",
+    "SELECT f1, f2 FROM a INNER JOIN b ON (a.b_id = b.id) WHERE a.f2 = 1",
+    "SELECT f1, f2 FROM a GROUP BY f1, f2 HAVING f1 > 21",
+    'SELECT DISTINCT "a"."id", "a"."x" FROM "a" LIMIT 10 OFFSET 20',
+    'SELECT "a"."id", "a"."b" FROM "a" ORDER BY "a"."id" ASC, "a"."b" DESC',
+    'SELECT "a"."id" FROM "a" ORDER BY UPPER("a"."b") ASC',
+    'SELECT COUNT(*) AS "__count" FROM "a"',
+    'SELECT COUNT(DISTINCT "a"."id") FROM "a"',
+    'SELECT CAST("a"."x" AS integer) AS "y" FROM "a"',
+    'SELECT (1) AS "a" FROM "a" WHERE "a"."id" = 1 LIMIT 1',
+    'SELECT 1 AS "a", 2 AS "b" FROM "a"',
+    'SELECT "a"."x" || "a"."y" AS "z" FROM "a"',
+    'SELECT CASE WHEN "a"."x" IN (1, 2) THEN 1 ELSE NULL END FROM "a"',
+    'SELECT MAX("a"."age") AS "age__max", SUM("a"."age") AS "age__sum" FROM "a"',
+    'SELECT COALESCE("a"."x", \'z\') AS "c" FROM "a"',
+    'SELECT "a"."id" FROM "a" WHERE NOT ("a"."id" IN (1, 2))',
+    'SELECT "a"."id" FROM "a" WHERE NOT ("a"."id" IN (1))',
+    'SELECT "a"."id" FROM "a" WHERE "a"."id" NOT IN (1)',
+    'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (NULL)',
+    'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (\'x\') AND "a"."b" IS NOT NULL',
+    'SELECT "a"."id" FROM "a" WHERE "a"."b" IS NULL',
+    'SELECT "a"."id" FROM "a" WHERE "a"."x" = TRUE',
+    'SELECT "a"."id" FROM "a" WHERE "a"."x" BETWEEN 1 AND 3',
+    'SELECT "a"."id" FROM "a" WHERE "a"."id" = -1 OR "a"."id" = 1.5',
+    'SELECT "a"."id" FROM "a" WHERE "a"."id" > 1 - 2',
+    'SELECT "a"."id" FROM "a" WHERE "a"."data" = \'it\'\'s\'',
+    'SELECT "a"."id" FROM "a" WHERE UPPER("a"."x") LIKE UPPER(\'%b%\')',
+    'SELECT "a"."id" FROM "a" WHERE NOT "a"."x" ILIKE \'%b%\'',
+    'SELECT "a"."id" FROM "a" WHERE COALESCE("a"."x", 1) = 1',
+    (
+        'SELECT "a"."id", COUNT("b"."id") AS "n" FROM "a" LEFT OUTER JOIN "b" '
+        + 'ON ("a"."id" = "b"."a_id") GROUP BY "a"."id" HAVING COUNT("b"."id") > 1'
+    ),
+    (
+        'SELECT "a"."id" FROM "a" INNER JOIN "b" T3 ON ("a"."id" = T3."a_id") '
+        + 'WHERE T3."x" = 1'
+    ),
+    'SELECT COUNT(*) FROM (SELECT "a"."id" AS "col1" FROM "a" GROUP BY 1) subquery',
+    (
+        'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (SELECT U0."id" FROM "b" U0 '
+        + 'WHERE U0."x" IN (1))'
+    ),
+    (
+        'SELECT "a"."id" FROM "a" WHERE EXISTS(SELECT 1 AS "a" FROM "b" U0 '
+        + 'WHERE U0."x" = ("a"."id") LIMIT 1)'
+    ),
+    'INSERT INTO "a" ("x", "y") VALUES (1, \'b\') RETURNING "a"."id"',
+    'INSERT INTO "a" ("x") VALUES (1), (2) RETURNING "a"."id", "a"."x"',
+    'UPDATE "a" SET "x" = 1 WHERE "a"."id" IN (1, 2) RETURNING "a"."id"',
+    'UPDATE "a" SET "x" = ("a"."x" + 1) WHERE "a"."id" = 3',
+    'UPDATE "a" SET "x" = 1',
+    'DELETE FROM "a" WHERE "a"."id" IN (1, 2)',
+]
+
+
+@pytest.mark.parametrize("hide_columns", [True, False])
+@pytest.mark.parametrize("query", native_queries)
+def test_native_matches_sqlparse(query, hide_columns):
+    fingerprint = native_sql_fingerprint(query, hide_columns=hide_columns)
+    assert fingerprint is not None
+    assert fingerprint == sqlparse_sql_fingerprint(query, hide_columns=hide_columns)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "",
+        "SELECT /* comment */ `f1`, `f2` FROM `b`",
+        "SELECT `f1`,  `f2` FROM `b`",
+        "SELECT `f1`, `f2`\nFROM `b`",
+        "SELECT set_config('flag1', true); UPDATE user SET username = 'username'",
+        "SELECT f1, f2 FROM a GROUP BY f1 HAVING f1 > 21, f2 < 42",
+        'SELECT "a"."id" FROM "a" ORDER BY UPPER("a"."b") ASC, "a"."c" ASC',
+        'SELECT "a"."id" FROM "a" WHERE "a"."x" LIKE \'%a%\' ESCAPE \'\\\'',
+    ],
+)
+def test_native_unsupported(query):
+    assert native_sql_fingerprint(query) is None
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        'SELECT "a"."id" FROM "a" WHERE NOT NULL = "a"."x"',
+        'SELECT "a"."id" FROM "a" WHERE NOT NULL',
+        'SELECT "a"."id" FROM "a" WHERE NOT NULL IS NULL',
+        'SELECT "a"."id" FROM "a" WHERE NOT NULL > 1 AND "a"."id" = 1',
+        'SELECT "a"."id" FROM "a" WHERE NOT NOT NULL = 1',
+        'SELECT "a"."id" FROM "a" WHERE NOT NULL IN (1)',
+        'SELECT "a"."id" FROM "a" WHERE "a"."id" = 1 OR NOT NULL LIKE \'%b%\'',
+    ],
+)
+def test_native_engine_matches_sqlparse(query):
+    # Queries the native fingerprinter leaves to sqlparse
+    assert native_sql_fingerprint(query) is None
+    assert sql_fingerprint(query, engine="native") == sqlparse_sql_fingerprint(query)
+
+
+def test_native_engine_fallback():
+    assert (
+        sql_fingerprint("SELECT /* comment */ `f1`, `f2` FROM `b`", engine="native")
+        == "SELECT /* comment */ ... FROM `b`"
+    )
+
+
+def test_native_engine():
+    assert (
+        sql_fingerprint("SELECT `f1`, `f2` FROM `b` WHERE `x` IN (1)", engine="native")
+        == "SELECT ... FROM `b` WHERE `x` IN (...)"
+    )
+
+
+class TestFingerprintCache:
+    def test_hits_and_misses(self):
+        cache = FingerprintCache(maxsize=2)
+        key = cache.key("SELECT 1", True, "sqlparse")
+        assert cache.get(key) is None
+        cache.set(key, "SELECT #")
+        assert cache.get(key) == "SELECT #"
+        assert cache.info() == FingerprintCacheInfo(
+            hits=1, misses=1, evictions=0, maxsize=2, currsize=1
+        )
+
+    def test_key_is_digest(self):
+        query = "SELECT " + ", ".join(f"`f{i}`" for i in range(1000))
+        digest, hide_columns, engine = FingerprintCache.key(query, False, "native")
+        assert len(digest) == 16
+        assert not hide_columns
+        assert engine == "native"
+
+    def test_key_differs_by_options(self):
+        assert FingerprintCache.key("SELECT 1", True, "sqlparse") != (
+            FingerprintCache.key("SELECT 1", False, "sqlparse")
+        )
+        assert FingerprintCache.key("SELECT 1", True, "sqlparse") != (
+            FingerprintCache.key("SELECT 1", True, "native")
+        )
+
+    def test_evicts_least_recently_used(self):
+        cache = FingerprintCache(maxsize=2)
+        key1 = cache.key("SELECT 1", True, "sqlparse")
+        key2 = cache.key("SELECT 2", True, "sqlparse")
+        key3 = cache.key("SELECT 3", True, "sqlparse")
+        cache.set(key1, "SELECT #")
+        cache.set(key2, "SELECT #")
+        cache.get(key1)
+        cache.set(key3, "SELECT #")
+        assert cache.get(key2) is None
+        assert cache.get(key1) == "SELECT #"
+        assert cache.info().evictions == 1
+
+    def test_resize(self):
+        cache = FingerprintCache(maxsize=2)
+        cache.set(cache.key("SELECT 1", True, "sqlparse"), "SELECT #")
+        cache.set(cache.key("SELECT 2", True, "sqlparse"), "SELECT #")
+        cache.resize(1)
+        assert cache.info().currsize == 1
+        assert cache.info().evictions == 1
+
+    def test_disabled(self):
+        cache = FingerprintCache(maxsize=0)
+        key = cache.key("SELECT 1", True, "sqlparse")
+        cache.set(key, "SELECT #")
+        assert cache.get(key) is None
+        assert cache.info().evictions == 0
+
+    def test_clear(self):
+        cache = FingerprintCache(maxsize=2)
+        key = cache.key("SELECT 1", True, "sqlparse")
+        cache.set(key, "SELECT #")
+        cache.get(key)
+        cache.clear()
+        assert cache.info() == FingerprintCacheInfo(
+            hits=0, misses=0, evictions=0, maxsize=2, currsize=0
+        )
+
+
+def test_sql_fingerprint_cached():
+    fingerprint_cache.clear()
+    try:
+        sql_fingerprint("SELECT `f1`, `f2` FROM `b`")
+        sql_fingerprint("SELECT `f1`, `f2` FROM `b`")
+        info = fingerprint_cache.info()
+        assert info.hits == 1
+        assert info.misses == 1
+    finally:
+        fingerprint_cache.clear()
+
+
+def test_sql_fingerprint_cache_size():
+    try:
+        sql_fingerprint("SELECT 1", cache_size=10)
+        assert fingerprint_cache.info().maxsize == 10
+    finally:
+        fingerprint_cache.resize(500)
+
+
+class TestPersistentFingerprintCache:
+    @pytest.fixture
+    def make_cache(self):
+        caches: list[PersistentFingerprintCache] = []
+
+        def make_cache(path: str) -> PersistentFingerprintCache:
+            cache = PersistentFingerprintCache(path)
+            caches.append(cache)
+            return cache
+
+        yield make_cache
+        for cache in caches:
+            cache.close()
+
+    def test_round_trip(self, make_cache, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        key = FingerprintCache.key("SELECT 1", True, "sqlparse")
+        make_cache(path).set(key, "SELECT #")
+        assert make_cache(path).get(key) == "SELECT #"
+
+    def test_miss(self, make_cache, tmp_path):
+        cache = make_cache(str(tmp_path / "cache.sqlite3"))
+        assert cache.get(FingerprintCache.key("SELECT 1", True, "sqlparse")) is None
+
+    def test_keyed_by_version(self, make_cache, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        key = FingerprintCache.key("SELECT 1", True, "sqlparse")
+        make_cache(path).set(key, "SELECT #")
+        cache = make_cache(path)
+        cache.version = "sqlparse==0.0.1;native==0"
+        assert cache.get(key) is None
+
+    def test_keyed_by_options(self, make_cache, tmp_path):
+        cache = make_cache(str(tmp_path / "cache.sqlite3"))
+        cache.set(FingerprintCache.key("SELECT 1", True, "sqlparse"), "SELECT #")
+        assert cache.get(FingerprintCache.key("SELECT 1", False, "sqlparse")) is None
+        assert cache.get(FingerprintCache.key("SELECT 1", True, "native")) is None
+
+    def test_concurrent_writers(self, make_cache, tmp_path):
+        path = str(tmp_path / "cache.sqlite3")
+        queries = [f"SELECT {i}" for i in range(50)]
+
+        def write(worker: int) -> None:
+            cache = make_cache(path)
+            for query in queries[worker::2] + queries:
+                cache.set(FingerprintCache.key(query, True, "sqlparse"), "SELECT #")
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cache = make_cache(path)
+        assert not cache.disabled
+        for query in queries:
+            key = FingerprintCache.key(query, True, "sqlparse")
+            assert cache.get(key) == "SELECT #"
+
+    def test_error_disables(self, make_cache, tmp_path):
+        cache = make_cache(str(tmp_path))
+        key = FingerprintCache.key("SELECT 1", True, "sqlparse")
+        with pytest.warns(RuntimeWarning, match="disabling the fingerprint cache"):
+            assert cache.get(key) is None
+        assert cache.disabled
+        cache.set(key, "SELECT #")
+        assert cache.get(key) is None
+
+    def test_close(self, make_cache, tmp_path):
+        cache = make_cache(str(tmp_path / "cache.sqlite3"))
+        key = FingerprintCache.key("SELECT 1", True, "sqlparse")
+        cache.set(key, "SELECT #")
+        thread = threading.Thread(target=cache.get, args=(key,))
+        thread.start()
+        thread.join()
+        connections = [connection for _, connection in cache.connections]
+        assert len(connections) == 2
+
+        cache.close()
+
+        assert cache.connections == []
+        for connection in connections:
+            with pytest.raises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+        # Reopened when used again
+        assert cache.get(key) == "SELECT #"
+        assert not cache.disabled
+
+
+def test_sql_fingerprint_cache_path(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    query = "SELECT `f1`, `f2` FROM `b` WHERE `f1` = 'persistent'"
+    fingerprint_cache.clear()
+    try:
+        assert sql_fingerprint(query, cache_path=path) == (
+            "SELECT ... FROM `b` WHERE `f1` = #"
+        )
+        fingerprint_cache.clear()
+        with mock.patch(
+            "django_perf_rec.sql.uncached_sql_fingerprint"
+        ) as uncached_sql_fingerprint:
+            assert sql_fingerprint(query, cache_path=path) == (
+                "SELECT ... FROM `b` WHERE `f1` = #"
+            )
+        uncached_sql_fingerprint.assert_not_called()
+    finally:
+        fingerprint_cache.clear()
+        get_persistent_fingerprint_cache(path).close()
+
+
+@pytest.mark.parametrize(
+    "query,tables",
+    [
+        ("SELECT #", []),
+        ('SELECT ... FROM "testapp_author"', ["testapp_author"]),
+        (
+            'SELECT ... FROM "a" INNER JOIN "b" ON ("a"."id" = "b"."a_id") '
+            + 'LEFT OUTER JOIN "a" T3 ON ("b"."id" = T3."b_id")',
+            ["a", "b"],
+        ),
+        ("SELECT ... FROM `b` WHERE `f1` = #", ["b"]),
+        ('INSERT INTO "a" (...) VALUES (...)', ["a"]),
+        ('UPDATE "a" SET ... WHERE "a"."id" = #', ["a"]),
+        ('DELETE FROM "a" WHERE "a"."id" IN (...)', ["a"]),
+        ("select * from plain_table", ["plain_table"]),
+        ('SELECT ... FROM (SELECT ... FROM "a") subquery', ["a"]),
+        ('SELECT ... FROM "we""ird"', ['we"ird']),
+    ],
+)
+def test_sql_tables(query, tables):
+    assert sql_tables(query) == tables
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+import shutil
+from tempfile import mkdtemp
+from typing import Any
+
+import pytest
+import yaml
+from django.test import SimpleTestCase
+
+from django_perf_rec.storage import (
+    HAVE_LIBYAML,
+    GzipCompressor,
+    JSONBackend,
+    SQLiteBackend,
+    YAMLBackend,
+    convert,
+    detect_storage,
+    dump_yaml,
+    get_backend,
+    get_extension,
+    libyaml_dumps_identically,
+    load_yaml,
+)
+from django_perf_rec.types import PerformanceRecord
+
+try:
+    get_backend("yaml", "zstd")
+except ImportError:
+    HAVE_ZSTD = False
+else:
+    HAVE_ZSTD = True
+
+
+class BackendTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def round_trip(self, storage: str, compression: str | None = None) -> str:
+        file_name = os.path.join(
+            self.temp_dir, "test" + get_extension(storage, compression)
+        )
+        backend = get_backend(storage, compression)
+        assert backend.load(file_name) == {}
+        backend.save(file_name, {"foo": [{"db": "SELECT #"}]})
+        backend.save(file_name, {"bar": [{"cache|get": "ключ"}]})
+        assert get_backend(storage, compression).load(file_name) == {
+            "foo": [{"db": "SELECT #"}],
+            "bar": [{"cache|get": "ключ"}],
+        }
+        return file_name
+
+    def delete(self, storage: str, compression: str | None = None) -> None:
+        file_name = os.path.join(
+            self.temp_dir, "test" + get_extension(storage, compression)
+        )
+        backend = get_backend(storage, compression)
+        backend.delete(file_name, ["foo"])
+        assert not os.path.exists(file_name)
+        backend.save(file_name, {"foo": [], "bar": [], "baz": []})
+        backend.delete(file_name, ["foo", "baz", "missing"])
+        assert get_backend(storage, compression).load(file_name) == {"bar": []}
+
+    def test_yaml(self):
+        file_name = self.round_trip("yaml")
+        with open(file_name) as fp:
+            assert fp.read() == "bar:\n- cache|get: ключ\nfoo:\n- db: 'SELECT #'\n"
+
+    def test_json(self):
+        file_name = self.round_trip("json")
+        with open(file_name) as fp:
+            assert json.load(fp) == {
+                "bar": [{"cache|get": "ключ"}],
+                "foo": [{"db": "SELECT #"}],
+            }
+
+    def test_yaml_delete(self):
+        self.delete("yaml")
+
+    def test_yaml_delete_none_present(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.yml")
+        with open(file_name, "w") as fp:
+            fp.write("foo: []  # unchanged\n")
+        YAMLBackend().delete(file_name, ["bar"])
+        with open(file_name) as fp:
+            assert fp.read() == "foo: []  # unchanged\n"
+
+    def test_json_delete(self):
+        self.delete("json")
+
+    def test_json_canonical(self):
+        backend = JSONBackend()
+        assert backend.dumps({"b": [], "a": [{"db": "é"}]}) == (
+            '{\n  "a": [\n    {\n      "db": "é"\n    }\n  ],\n  "b": []\n}\n'.encode()
+        )
+
+    def test_json_empty_file(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.json")
+        open(file_name, "w").close()
+        assert JSONBackend().load(file_name) == {}
+
+    def test_json_non_dictionary(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.json")
+        with open(file_name, "w") as fp:
+            fp.write("[]")
+        with pytest.raises(TypeError) as excinfo:
+            JSONBackend().load(file_name)
+        assert "JSON content" in str(excinfo.value)
+
+    def test_sqlite(self):
+        self.round_trip("sqlite")
+
+    def test_sqlite_overwrite(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.sqlite3")
+        SQLiteBackend().save(file_name, {"foo": [{"db": "SELECT #"}]})
+        SQLiteBackend().save(file_name, {"foo": []})
+        assert SQLiteBackend().load(file_name) == {"foo": []}
+
+    def test_sqlite_parse(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.sqlite3")
+        SQLiteBackend().save(file_name, {"foo": [{"db": "SELECT #"}]})
+        with open(file_name, "rb") as fp:
+            content = fp.read()
+        assert SQLiteBackend().parse("other.perf.sqlite3", content) == {
+            "foo": [{"db": "SELECT #"}]
+        }
+
+    def test_sqlite_delete(self):
+        self.delete("sqlite")
+
+    def test_sqlite_missing_file(self):
+        file_name = os.path.join(self.temp_dir, "test.perf.sqlite3")
+        assert SQLiteBackend().load(file_name) == {}
+        assert not os.path.exists(file_name)
+
+    def test_sqlite_compression(self):
+        with pytest.raises(AssertionError):
+            get_backend("sqlite", "gzip")
+
+    def test_gzip(self):
+        file_name = self.round_trip("json", "gzip")
+        with gzip.open(file_name) as fp:
+            assert json.load(fp)["foo"] == [{"db": "SELECT #"}]
+
+    def test_gzip_delete(self):
+        self.delete("json", "gzip")
+
+    def test_gzip_deterministic(self):
+        assert GzipCompressor().compress(b"foo") == GzipCompressor().compress(b"foo")
+
+    @pytest.mark.skipif(not HAVE_ZSTD, reason="zstd unavailable")
+    def test_zstd(self):
+        self.round_trip("yaml", "zstd")
+
+
+class DetectStorageTests(SimpleTestCase):
+    def test_yaml(self):
+        assert detect_storage("test_x.perf.yml") == ("yaml", None)
+        assert detect_storage("test_x.perf.yaml") == ("yaml", None)
+
+    def test_json(self):
+        assert detect_storage("test_x.perf.json") == ("json", None)
+
+    def test_sqlite(self):
+        assert detect_storage("test_x.perf.sqlite3") == ("sqlite", None)
+
+    def test_compressed(self):
+        assert detect_storage("test_x.perf.json.gz") == ("json", "gzip")
+        assert detect_storage("test_x.perf.yml.zst") == ("yaml", "zstd")
+
+    def test_unknown(self):
+        assert detect_storage("test_x.perf") is None
+        assert detect_storage("test_x.gz") is None
+
+
+class GetExtensionTests(SimpleTestCase):
+    def test_default(self):
+        assert get_extension("yaml", None) == ".yml"
+
+    def test_compressed(self):
+        assert get_extension("json", "gzip") == ".json.gz"
+
+
+class ConvertTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def test_convert(self):
+        yaml_name = os.path.join(self.temp_dir, "test.perf.yml")
+        json_name = os.path.join(self.temp_dir, "test.perf.json.gz")
+        records: dict[str, PerformanceRecord] = {"foo": [{"db": "SELECT #"}]}
+        YAMLBackend().save(yaml_name, records)
+
+        convert(yaml_name, json_name, "json", "gzip")
+
+        assert get_backend("json", "gzip").load(json_name) == records
+
+    def test_convert_unknown(self):
+        with pytest.raises(ValueError):
+            convert("test.txt", "test.perf.json", "json")
+
+
+class LibyamlTests(SimpleTestCase):
+    def dump(self, data: Any, dumper: Any) -> str:
+        return yaml.dump(
+            data,
+            Dumper=dumper,
+            default_flow_style=False,
+            allow_unicode=True,
+            width=10000,
+        )
+
+    def test_dump_yaml_matches_pure_python(self):
+        data = {
+            "AuthorTests.test_name": [
+                {"db": 'SELECT ... FROM "testapp_author" WHERE "id" = #'},
+                {"cache|get": "ключ ☃ 日本"},
+                {"cache|get": "tab\there"},
+                {"cache|get": "yes"},
+                {"cache|get": ""},
+                {"cache|get": "a: b"},
+                {
+                    "db": "SELECT #",
+                    "traceback": ['  File "a.py", line 1, in f\n    x = 1\n'],
+                },
+            ],
+            "test_emoji": [{"cache|get": "emoji 😀"}],
+            "test_next_line": [{"cache|get": "\x85"}],
+            "T" * 100: [],
+            "\t" * 70: [],
+        }
+        stream = io.StringIO()
+        dump_yaml(data, stream)
+        assert stream.getvalue() == self.dump(data, yaml.SafeDumper)
+
+    def test_dump_yaml_matches_pure_python_separately(self):
+        # Each on its own, so nothing else rules out libyaml's dumper
+        for data in [
+            {"": []},
+            {"test": [{"db": "SELECT a,\n  b FROM c " * 600}]},
+            {"test": [{"cache|get": "a\tb " * 3000}]},
+            {"test": [{"cache|get": "a\r\nb " * 3000}]},
+            {"test": [{"cache|get": "a b " * 3000}]},
+        ]:
+            stream = io.StringIO()
+            dump_yaml(data, stream)
+            assert stream.getvalue() == self.dump(data, yaml.SafeDumper)
+
+    @pytest.mark.skipif(not HAVE_LIBYAML, reason="PyYAML built without libyaml")
+    def test_libyaml_dumps_identically(self):
+        data = {
+            "AuthorTests.test_name": [
+                {"db": 'SELECT ... FROM "testapp_author" WHERE "id" = #'},
+                {"cache|get": "ключ ☃ 日本 'a: b' #"},
+                {"cache|get": "a b " * 1000},
+            ],
+        }
+        assert libyaml_dumps_identically(data)
+        assert self.dump(data, yaml.CSafeDumper) == self.dump(data, yaml.SafeDumper)
+
+    def test_libyaml_dumps_identically_not(self):
+        assert not libyaml_dumps_identically({"test": [{"cache|get": "😀"}]})
+        assert not libyaml_dumps_identically({"test": [{"cache|get": "\x85"}]})
+        assert not libyaml_dumps_identically({"t" * 65: []})
+        assert not libyaml_dumps_identically({"a\rb": []})
+        assert not libyaml_dumps_identically({"ключ": []})
+        assert not libyaml_dumps_identically({"": []})
+        assert not libyaml_dumps_identically({"test": [{"cache|get": "a\tb"}]})
+        assert not libyaml_dumps_identically({"test": [{"cache|get": "a\r\nb"}]})
+        assert not libyaml_dumps_identically({"test": [{"db": "SELECT\n#"}]})
+        assert not libyaml_dumps_identically({"test": [{"db": "a " * 6000}]})
+
+    def test_load_yaml(self):
+        assert load_yaml("foo: [{bar: baz}]") == {"foo": [{"bar": "baz"}]}
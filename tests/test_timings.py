@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import json
+import os
+from traceback import extract_stack
+from unittest import mock
+
+import pytest
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from django_perf_rec import flush, record
+from django_perf_rec.cache import CacheRecorder
+from django_perf_rec.db import DBOp, DBRecorder
+from django_perf_rec.operation import Operation
+from django_perf_rec.timings import (
+    Timings,
+    get_timings_path,
+    timing_stats,
+    timings,
+)
+from tests.utils import run_query, temporary_path
+
+FILE_DIR = os.path.dirname(__file__)
+
+
+def make_op(query: str, duration: float | None) -> DBOp:
+    op = DBOp("default", query, extract_stack())
+    op.duration = duration
+    return op
+
+
+class GetTimingsPathTests(SimpleTestCase):
+    def test_yaml(self):
+        assert get_timings_path("/a/test_x.perf.yml") == "/a/test_x.perf-timings.json"
+
+    def test_compressed(self):
+        assert (
+            get_timings_path("/a/test_x.perf.json.gz") == "/a/test_x.perf-timings.json"
+        )
+
+    def test_custom_name(self):
+        assert get_timings_path("/a/custom.yml") == "/a/custom.perf-timings.json"
+
+    def test_unrecognized(self):
+        assert get_timings_path("/a/custom") == "/a/custom.perf-timings.json"
+
+
+class TimingStatsTests(SimpleTestCase):
+    def test_single(self):
+        assert timing_stats([0.0015]) == {
+            "count": 1,
+            "p50_ms": 1.5,
+            "p95_ms": 1.5,
+            "max_ms": 1.5,
+        }
+
+    def test_many(self):
+        samples = [i / 1000 for i in range(100, 0, -1)]
+        assert timing_stats(samples) == {
+            "count": 100,
+            "p50_ms": 50.0,
+            "p95_ms": 95.0,
+            "max_ms": 100.0,
+        }
+
+
+class TimingsTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.timings = Timings()
+        self.timings.atexit_registered = True
+
+    def test_add_skips_unmeasured(self):
+        self.timings.add(
+            "/a/x.perf.yml", [make_op("SELECT #", None), make_op("SELECT #", 0.5)]
+        )
+
+        assert self.timings.samples == {
+            "/a/x.perf-timings.json": {"db: SELECT #": [0.5]}
+        }
+
+    def test_add_nothing_measured(self):
+        self.timings.add("/a/x.perf.yml", [make_op("SELECT #", None)])
+
+        assert self.timings.dirty == set()
+
+    def test_add_registers_atexit(self):
+        self.timings.atexit_registered = False
+        with mock.patch("atexit.register") as register:
+            self.timings.add("/a/x.perf.yml", [make_op("SELECT #", 0.5)])
+            self.timings.add("/a/x.perf.yml", [make_op("SELECT #", 0.5)])
+
+        register.assert_called_once_with(self.timings.flush)
+
+    def test_take_and_merge(self):
+        self.timings.add("/a/x.perf.yml", [make_op("SELECT #", 0.5)])
+        other = Timings()
+        other.atexit_registered = True
+        other.add("/a/x.perf.yml", [make_op("SELECT #", 0.25)])
+
+        self.timings.merge(other.take())
+
+        assert other.samples == {}
+        assert self.timings.samples == {
+            "/a/x.perf-timings.json": {"db: SELECT #": [0.5, 0.25]}
+        }
+
+    def test_flush(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir):
+            os.mkdir(temp_dir)
+            file_name = os.path.join(temp_dir, "x.perf.yml")
+            timings_path = os.path.join(temp_dir, "x.perf-timings.json")
+            with open(timings_path, "w") as fp:
+                json.dump({"db: SELECT old": {"count": 1}}, fp)
+            self.timings.add(file_name, [make_op("SELECT #", 0.001)])
+
+            self.timings.flush()
+            self.timings.flush()
+
+            with open(timings_path) as fp:
+                data = json.load(fp)
+            assert not os.path.exists(file_name)
+
+        assert data == {
+            "db: SELECT #": {"count": 1, "max_ms": 1.0, "p50_ms": 1.0, "p95_ms": 1.0},
+            "db: SELECT old": {"count": 1},
+        }
+
+    def test_slowest(self):
+        self.timings.add(
+            "/a/x.perf.yml",
+            [make_op("SELECT 1", 0.001), make_op("SELECT 2", 0.003)],
+        )
+        self.timings.add("/a/y.perf.yml", [make_op("SELECT 1", 0.002)])
+
+        slowest = self.timings.slowest(5)
+
+        assert [key for key, _ in slowest] == ["db: SELECT 2", "db: SELECT 1"]
+        assert slowest[1][1]["count"] == 2
+        assert self.timings.slowest(1) == slowest[:1]
+
+
+class RecordTimingsTests(TestCase):
+    def tearDown(self):
+        timings.clear()
+        super().tearDown()
+
+    def test_disabled_by_default(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir), record(path="perf_files/"):
+            run_query("default", "SELECT 1")
+
+        assert timings.samples == {}
+
+    @override_settings(PERF_REC={"TIMINGS": True})
+    def test_enabled(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with temporary_path(temp_dir):
+            with record(path="perf_files/", capture_operation=lambda op: False):
+                run_query("default", "SELECT 1")
+                caches["default"].get("foo")
+
+            (samples,) = timings.samples.values()
+            assert sorted(samples) == ["cache|get: foo", "db: SELECT #"]
+            assert all(duration >= 0 for (duration,) in samples.values())
+
+            flush()
+
+            timings_path = os.path.join(
+                FILE_DIR, "perf_files", "test_timings.perf-timings.json"
+            )
+            with open(timings_path) as fp:
+                data = json.load(fp)
+            assert sorted(data) == ["cache|get: foo", "db: SELECT #"]
+            assert data["db: SELECT #"]["count"] == 1
+
+    @override_settings(PERF_REC={"TIMINGS": True})
+    def test_recorded_on_failure(self):
+        temp_dir = os.path.join(FILE_DIR, "perf_files/")
+        with (
+            temporary_path(temp_dir),
+            pytest.raises(ValueError),
+            record(path="perf_files/"),
+        ):
+            run_query("default", "SELECT 1")
+            raise ValueError("boom")
+
+        assert len(timings.samples) == 1
+
+
+class OpDurationTests(TestCase):
+    @override_settings(PERF_REC={"TIMINGS": True})
+    def test_db_op_duration(self):
+        callback = mock.Mock()
+        with DBRecorder("default", callback):
+            run_query("default", "SELECT 1")
+
+        (op,) = (call[0][0] for call in callback.call_args_list)
+        assert op.duration is not None and op.duration >= 0
+
+    def test_db_op_duration_not_timed(self):
+        callback = mock.Mock()
+        with (
+            DBRecorder("default", callback),
+            mock.patch("django_perf_rec.db.perf_counter") as perf_counter,
+        ):
+            run_query("default", "SELECT 1")
+
+        perf_counter.assert_not_called()
+        (op,) = (call[0][0] for call in callback.call_args_list)
+        assert op.duration is None
+
+    def test_db_settings_read_once(self):
+        callback = mock.Mock()
+        with (
+            DBRecorder("default", callback),
+            override_settings(PERF_REC={"HIDE_COLUMNS": False}),
+        ):
+            run_query("default", "SELECT 1 AS a, 2 AS b")
+
+        (op,) = (call[0][0] for call in callback.call_args_list)
+        assert op.query == "SELECT ..."
+
+    @override_settings(PERF_REC={"TIMINGS": True})
+    def test_cache_op_duration(self):
+        ops: list[Operation] = []
+        with CacheRecorder("default", ops.append):
+            caches["default"].get("foo")
+
+        (op,) = ops
+        assert op.duration is not None and op.duration >= 0
+
+    def test_cache_op_duration_not_timed(self):
+        ops: list[Operation] = []
+        with (
+            CacheRecorder("default", ops.append),
+            mock.patch("django_perf_rec.cache.perf_counter") as perf_counter,
+        ):
+            caches["default"].get("foo")
+
+        perf_counter.assert_not_called()
+        (op,) = ops
+        assert op.duration is None
+
+    async def test_async_cache_op_duration_not_timed(self):
+        ops: list[Operation] = []
+        with (
+            CacheRecorder("default", ops.append),
+            mock.patch("django_perf_rec.cache.perf_counter") as perf_counter,
+        ):
+            await caches["default"].aget("foo")
+
+        perf_counter.assert_not_called()
+        (op,) = ops
+        assert op.duration is None
+
+    def test_cache_op_duration_nested_timed(self):
+        ops: list[Operation] = []
+        with (
+            CacheRecorder("default", ops.append),
+            override_settings(PERF_REC={"TIMINGS": True}),
+            CacheRecorder("default", lambda op: None),
+        ):
+            caches["default"].get("foo")
+
+        (op,) = ops
+        assert op.duration is not None
@@ -2,7 +2,16 @@ from __future__ import annotations
 
 from django.test import SimpleTestCase
 
-from django_perf_rec.utils import TestDetails, current_test, sorted_names
+from django_perf_rec.types import PerformanceRecord
+from django_perf_rec.utils import (
+    RecordDigest,
+    TestDetails,
+    collapse_repeats,
+    current_test,
+    expand_repeats,
+    record_digest,
+    sorted_names,
+)
 
 
 class CurrentTestTests(SimpleTestCase):
@@ -50,3 +59,84 @@ class SortedNamesTests(SimpleTestCase):
 
     def test_sort_keeps_default_first(self):
         assert sorted_names(["a", "default"]) == ["default", "a"]
+
+
+class CollapseRepeatsTests(SimpleTestCase):
+    def test_empty(self):
+        assert collapse_repeats([]) == []
+
+    def test_collapses_consecutive(self):
+        assert collapse_repeats(
+            [{"db": "A"}, {"db": "A"}, {"db": "B"}, {"db": "A"}, {"db": "A"}]
+        ) == [{"db": "A", "repeat": 2}, {"db": "B"}, {"db": "A", "repeat": 2}]
+
+    def test_tracebacks_distinguish(self):
+        record: PerformanceRecord = [
+            {"db": "A", "traceback": ["x"]},
+            {"db": "A", "traceback": ["y"]},
+        ]
+        assert collapse_repeats(record) == record
+
+    def test_merges_existing_repeats(self):
+        assert collapse_repeats(
+            [{"db": "A", "repeat": 2}, {"db": "A"}, {"db": "A", "repeat": 3}]
+        ) == [{"db": "A", "repeat": 6}]
+
+    def test_idempotent(self):
+        record: PerformanceRecord = [{"db": "A", "repeat": 2}, {"db": "B"}]
+        assert collapse_repeats(record) == record
+
+    def test_expand(self):
+        assert expand_repeats([{"db": "A", "repeat": 3}, {"db": "B"}]) == [
+            {"db": "A"},
+            {"db": "A"},
+            {"db": "A"},
+            {"db": "B"},
+        ]
+
+    def test_round_trip(self):
+        record: PerformanceRecord = [{"db": "A"}, {"db": "A"}, {"cache|get": "b"}]
+        assert expand_repeats(collapse_repeats(record)) == record
+
+
+class RecordDigestTests(SimpleTestCase):
+    def test_streaming_matches_whole(self):
+        digest = RecordDigest()
+        digest.update({"db": "SELECT #"})
+        digest.update({"cache|get": "foo", "traceback": ["a", "b"]})
+        assert digest.hexdigest() == record_digest(
+            [{"db": "SELECT #"}, {"cache|get": "foo", "traceback": ["a", "b"]}]
+        )
+
+    def test_empty(self):
+        assert RecordDigest().hexdigest() == record_digest([])
+
+    def test_key_order_ignored(self):
+        assert record_digest([{"db": "SELECT #", "traceback": ["a"]}]) == (
+            record_digest([{"traceback": ["a"], "db": "SELECT #"}])
+        )
+
+    def test_different_values(self):
+        assert record_digest([{"db": "SELECT #"}]) != record_digest(
+            [{"db": "SELECT #, #"}]
+        )
+
+    def test_different_boundaries(self):
+        assert record_digest([{"db": "ab"}, {"db": "c"}]) != record_digest(
+            [{"db": "a"}, {"db": "bc"}]
+        )
+
+    def test_string_not_list(self):
+        assert record_digest([{"traceback": "a"}]) != record_digest(
+            [{"traceback": ["a"]}]
+        )
+
+    def test_repeat_count(self):
+        assert record_digest([{"db": "A", "repeat": 2}]) != record_digest(
+            [{"db": "A", "repeat": 3}]
+        )
+
+    def test_int_not_string(self):
+        assert record_digest([{"db": "A", "repeat": 2}]) != record_digest(
+            [{"db": "A", "repeat": "2"}]
+        )
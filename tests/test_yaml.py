@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+import os
 import shutil
 from tempfile import mkdtemp
+from threading import Thread
+from unittest import mock
 
 import pytest
 import yaml
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 
-from django_perf_rec.yaml import KVFile
+from django_perf_rec.storage import dump_yaml
+from django_perf_rec.types import PerformanceRecord
+from django_perf_rec.utils import record_digest
+from django_perf_rec.yaml import KVFile, get_file_backend
 
 
 class KVFileTests(SimpleTestCase):
@@ -17,6 +23,8 @@ class KVFileTests(SimpleTestCase):
         self.temp_dir = mkdtemp()
 
     def tearDown(self):
+        KVFile.PENDING.clear()
+        KVFile.JOURNALED.clear()
         shutil.rmtree(self.temp_dir)
         super().tearDown()
 
@@ -92,3 +100,349 @@ class KVFileTests(SimpleTestCase):
             "foo": [{"bar": "baz"}],
             "foo2": [{"bar": "baz"}],
         }
+
+    def test_set_deferred_does_not_write(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_deferred("foo", [{"bar": "baz"}])
+
+        assert kvf.get("foo", None) == [{"bar": "baz"}]
+        assert KVFile(file_name).get("foo", None) == [{"bar": "baz"}]
+        assert not os.path.exists(file_name)
+
+    def test_set_deferred_flush(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_deferred("foo", [{"bar": "baz"}])
+        kvf.set_deferred("foo2", [{"bar": "qux"}])
+
+        with mock.patch(
+            "django_perf_rec.storage.dump_yaml", wraps=dump_yaml
+        ) as mock_dump_yaml:
+            KVFile.flush()
+
+        assert mock_dump_yaml.call_count == 1
+        with open(file_name) as fp:
+            data = yaml.safe_load(fp)
+        assert data == {"foo": [{"bar": "baz"}], "foo2": [{"bar": "qux"}]}
+        assert KVFile.PENDING == {}
+
+    def test_set_deferred_flush_merges(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_deferred("foo", [{"bar": "baz"}])
+        # Another process writes to the file in the meantime
+        with open(file_name, "w") as fp:
+            fp.write("other: [{bar: qux}]")
+
+        KVFile.flush()
+
+        with open(file_name) as fp:
+            data = yaml.safe_load(fp)
+        assert data == {"foo": [{"bar": "baz"}], "other": [{"bar": "qux"}]}
+
+    def test_set_deferred_same(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]")
+        kvf = KVFile(file_name)
+        kvf.set_deferred("foo", [{"bar": "baz"}])
+
+        assert KVFile.PENDING == {}
+
+    def test_set_deferred_registers_atexit(self):
+        with (
+            mock.patch.object(KVFile, "atexit_registered", False),
+            mock.patch("atexit.register") as register,
+        ):
+            KVFile(self.temp_dir + "/foo.yml").set_deferred("foo", [])
+            KVFile(self.temp_dir + "/foo.yml").set_deferred("foo2", [])
+            registered = KVFile.atexit_registered
+
+        register.assert_called_once_with(KVFile.flush)
+        assert registered
+
+    def test_set_journaled_appends(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        kvf = KVFile(file_name)
+        kvf.set_journaled("foo2", [{"bar": "qux"}])
+        kvf.set_journaled("foo", [{"bar": "quux"}])
+
+        with open(file_name) as fp:
+            assert fp.read() == "foo: [{bar: baz}]\n"
+        with open(file_name + ".journal") as fp:
+            assert fp.read() == (
+                '{"name": "foo2", "record": [{"bar": "qux"}]}\n'
+                + '{"name": "foo", "record": [{"bar": "quux"}]}\n'
+            )
+        assert file_name in KVFile.JOURNALED
+
+    def test_set_journaled_same(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]")
+        kvf = KVFile(file_name)
+        kvf.set_journaled("foo", [{"bar": "baz"}])
+
+        assert not os.path.exists(file_name + ".journal")
+
+    def test_load_replays_journal(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\nfoo2: []\n")
+        with open(file_name + ".journal", "w") as fp:
+            fp.write(
+                '{"name": "foo", "record": [{"bar": "qux"}]}\n'
+                + '{"name": "foo3", "record": []}\n'
+                + '{"name": "foo", "record": [{"bar": "quux"}]}\n'
+            )
+
+        assert KVFile.load_file(file_name) == {
+            "foo": [{"bar": "quux"}],
+            "foo2": [],
+            "foo3": [],
+        }
+
+    def test_load_during_compact(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: []\n")
+        with open(file_name + ".journal", "w") as fp:
+            fp.write('{"name": "foo2", "record": []}\n')
+        backend = get_file_backend(file_name)
+        real_load = backend.load
+        compactions: list[Thread] = []
+
+        def load(file_name: str) -> dict[str, PerformanceRecord]:
+            data = real_load(file_name)
+            if not compactions:
+                # Compact in another thread after the file is read, which
+                # waits for the journal lock
+                thread = Thread(target=KVFile.compact, args=(file_name,))
+                thread.start()
+                thread.join(0.1)
+                compactions.append(thread)
+            return data
+
+        with mock.patch.object(type(backend), "load", side_effect=load):
+            data = KVFile.load_file(file_name)
+        compactions[0].join()
+
+        assert data == {"foo": [], "foo2": []}
+        assert not os.path.exists(file_name + ".journal")
+
+    def test_load_ignores_partial_journal_line(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name + ".journal", "w") as fp:
+            fp.write('{"name": "foo", "record": []}\n{"name": "fo')
+
+        assert KVFile.load_file(file_name) == {"foo": []}
+
+    def test_compact(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        kvf = KVFile(file_name)
+        kvf.set_journaled("foo2", [{"bar": "qux"}])
+
+        assert KVFile.compact(file_name) is True
+
+        assert not os.path.exists(file_name + ".journal")
+        with open(file_name) as fp:
+            data = yaml.safe_load(fp.read())
+        assert data == {"foo": [{"bar": "baz"}], "foo2": [{"bar": "qux"}]}
+
+    def test_compact_no_journal(self):
+        file_name = self.temp_dir + "/foo.yml"
+
+        assert KVFile.compact(file_name) is False
+        assert not os.path.exists(file_name)
+
+    def test_set_journaled_after_compact(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_journaled("foo", [])
+        KVFile.compact(file_name)
+        kvf.set_journaled("foo2", [])
+        KVFile.compact(file_name)
+
+        KVFile._clear_load_cache()
+        assert KVFile.load_file(file_name) == {"foo": [], "foo2": []}
+
+    def test_flush_compacts_journals(self):
+        file_name = self.temp_dir + "/foo.yml"
+        KVFile(file_name).set_journaled("foo", [{"bar": "baz"}])
+
+        KVFile.flush()
+
+        assert not KVFile.JOURNALED
+        assert not os.path.exists(file_name + ".journal")
+        with open(file_name) as fp:
+            assert yaml.safe_load(fp.read()) == {"foo": [{"bar": "baz"}]}
+
+    def test_delete(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_and_save("foo", [])
+        kvf.set_journaled("foo2", [])
+        kvf.set_journaled("foo3", [])
+
+        KVFile.delete(file_name, ["foo2", "missing"])
+
+        assert not os.path.exists(file_name + ".journal")
+        with open(file_name) as fp:
+            assert yaml.safe_load(fp.read()) == {"foo": [], "foo3": []}
+        assert KVFile.load(file_name) == {"foo": [], "foo3": []}
+
+    def test_load_reloads_after_edit(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        KVFile(file_name)
+
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: quux}]\n")
+
+        assert KVFile(file_name).get("foo", None) == [{"bar": "quux"}]
+
+    def test_load_reloads_after_replace(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        stat = os.stat(file_name)
+        KVFile(file_name)
+
+        # Same size and modification time, but a different inode
+        with open(file_name + ".new", "w") as fp:
+            fp.write("foo: [{bar: qux}]\n")
+        os.utime(file_name + ".new", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(file_name + ".new", file_name)
+
+        assert KVFile(file_name).get("foo", None) == [{"bar": "qux"}]
+
+    def test_load_reloads_after_delete(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        KVFile(file_name)
+
+        os.unlink(file_name)
+
+        assert len(KVFile(file_name)) == 0
+
+    def test_load_cached_after_own_save(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_and_save("foo", [{"bar": "baz"}])
+
+        with mock.patch.object(KVFile, "load_file") as load_file:
+            kvf2 = KVFile(file_name)
+
+        load_file.assert_not_called()
+        assert kvf2.data is kvf.data
+
+    def test_load_reloads_after_save_following_edit(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]\n")
+        kvf.set_and_save("foo2", [{"bar": "qux"}])
+
+        assert KVFile(file_name).data == {
+            "foo": [{"bar": "baz"}],
+            "foo2": [{"bar": "qux"}],
+        }
+
+    def test_load_keeps_deferred_records_after_edit(self):
+        file_name = self.temp_dir + "/foo.yml"
+        KVFile(file_name).set_deferred("foo", [{"bar": "baz"}])
+        with open(file_name, "w") as fp:
+            fp.write("foo2: [{bar: qux}]\n")
+
+        assert KVFile(file_name).data == {
+            "foo": [{"bar": "baz"}],
+            "foo2": [{"bar": "qux"}],
+        }
+
+    def test_load_cache_evicts_least_recently_used(self):
+        file_names = [f"{self.temp_dir}/foo{i}.yml" for i in range(3)]
+        for file_name in file_names:
+            with open(file_name, "w") as fp:
+                fp.write("foo: []\nfoo2: []\n")
+
+        with override_settings(PERF_REC={"LOAD_CACHE_SIZE": 4}):
+            KVFile(file_names[0])
+            KVFile(file_names[1])
+            KVFile(file_names[0])
+            KVFile(file_names[2])
+
+        assert list(KVFile.LOAD_CACHE.entries) == [file_names[0], file_names[2]]
+
+    def test_load_cache_keeps_file_over_bound(self):
+        file_names = [f"{self.temp_dir}/foo{i}.yml" for i in range(2)]
+        with open(file_names[0], "w") as fp:
+            fp.write("foo: []\n")
+        with open(file_names[1], "w") as fp:
+            fp.write("foo: []\nfoo2: []\nfoo3: []\n")
+
+        with override_settings(PERF_REC={"LOAD_CACHE_SIZE": 2}):
+            KVFile(file_names[0])
+            kvf = KVFile(file_names[1])
+            kvf.set_and_save("foo4", [])
+
+            assert list(KVFile.LOAD_CACHE.entries) == [file_names[1]]
+            with mock.patch.object(KVFile, "load_file") as load_file:
+                assert KVFile(file_names[1]).data == kvf.data
+            load_file.assert_not_called()
+
+    def test_load_cache_disabled(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: []\n")
+
+        with override_settings(PERF_REC={"LOAD_CACHE_SIZE": 0}):
+            kvf = KVFile(file_name)
+
+        assert kvf.data == {"foo": []}
+        assert KVFile.LOAD_CACHE.entries == {}
+
+    def test_get_digest(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]")
+        kvf = KVFile(file_name)
+
+        assert kvf.get_digest("foo") == record_digest([{"bar": "baz"}])
+        assert kvf.get_digest("missing") is None
+
+    def test_set_and_save_digest_unchanged(self):
+        file_name = self.temp_dir + "/foo.yml"
+        with open(file_name, "w") as fp:
+            fp.write("foo: [{bar: baz}]")
+        kvf = KVFile(file_name)
+
+        with mock.patch.object(KVFile, "save") as save:
+            kvf.set_and_save(
+                "foo", [{"bar": "baz"}], digest=record_digest([{"bar": "baz"}])
+            )
+
+        save.assert_not_called()
+
+    def test_set_and_save_digest_changed(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        digest = record_digest([{"bar": "baz"}])
+        kvf.set_and_save("foo", [{"bar": "baz"}], digest=digest)
+
+        assert kvf.get_digest("foo") == digest
+        assert KVFile.load_file(file_name) == {"foo": [{"bar": "baz"}]}
+
+    def test_set_and_save_without_digest_resets_it(self):
+        file_name = self.temp_dir + "/foo.yml"
+        kvf = KVFile(file_name)
+        kvf.set_and_save("foo", [{"bar": "baz"}], digest=record_digest([]))
+        kvf.set_and_save("foo", [{"bar": "qux"}])
+
+        assert kvf.get_digest("foo") == record_digest([{"bar": "qux"}])
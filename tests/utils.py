@@ -3,7 +3,6 @@ from __future__ import annotations
 import errno
 import os
 import shutil
-import traceback
 from collections.abc import Callable, Generator
 from contextlib import contextmanager
 from functools import wraps
@@ -12,7 +11,8 @@ from unittest import mock
 
 from django.db import connections
 
-from django_perf_rec import pytest_plugin
+from django_perf_rec import state
+from django_perf_rec.operation import FrameSnapshot
 
 
 def run_query(alias: str, sql: str, params: list[str] | None = None) -> None:
@@ -20,6 +20,17 @@ def run_query(alias: str, sql: str, params: list[str] | None = None) -> None:
         cursor.execute(sql, params)
 
 
+def run_query_in_thread(alias: str, sql: str) -> None:
+    """
+    Run a query from a thread other than the main one, closing the thread's
+    connections afterwards.
+    """
+    try:
+        run_query(alias, sql)
+    finally:
+        connections.close_all()
+
+
 @contextmanager
 def temporary_path(path: str) -> Generator[None]:
     ensure_path_does_not_exist(path)
@@ -40,22 +51,22 @@ def ensure_path_does_not_exist(path: str) -> None:
 
 @contextmanager
 def pretend_not_under_pytest() -> Generator[None]:
-    orig = pytest_plugin.in_pytest
-    pytest_plugin.in_pytest = False
+    orig = state.in_pytest
+    state.in_pytest = False
     try:
         yield
     finally:
-        pytest_plugin.in_pytest = orig
+        state.in_pytest = orig
 
 
 TestFunc = TypeVar("TestFunc", bound=Callable[..., None])
 
 
-def override_extract_stack(func: TestFunc) -> TestFunc:
+def override_frame_snapshot(func: TestFunc) -> TestFunc:
     @wraps(func)
     def wrapper(*args: Any, **kwargs: Any) -> None:
-        summary = traceback.extract_stack()
-        with mock.patch.object(traceback, "extract_stack", return_value=summary):
-            func(*args, stack_summary=summary, **kwargs)
+        snapshot = FrameSnapshot.capture()
+        with mock.patch.object(FrameSnapshot, "capture", return_value=snapshot):
+            func(*args, stack_summary=snapshot.summary(), **kwargs)
 
     return cast(TestFunc, wrapper)